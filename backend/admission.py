@@ -0,0 +1,120 @@
+"""Admission control in front of LLM-backed endpoints.
+
+Each request declares how many LLM calls it will make. The controller
+estimates how long those calls would queue behind the RPM limiter —
+calls already waiting in it plus calls admitted but not issued yet — and
+rejects the request up front with 429 + Retry-After when the estimate
+exceeds the SLO, instead of holding the connection until a proxy
+timeout turns it into a generic error.
+"""
+
+import contextlib
+import math
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterator, Protocol
+
+# Max acceptable queueing before the first byte; proxies cut at 60 s
+ADMISSION_SLO_SECONDS = float(os.environ.get("ADMISSION_SLO_SECONDS", "30"))
+
+
+class Limiter(Protocol):
+    rate: int
+    queued: int
+
+    def available(self) -> float: ...
+
+
+class Overloaded(Exception):
+    """Raised instead of admitting a request that would miss the SLO."""
+
+    def __init__(self, retry_after: int, queue_position: int, estimated_wait: float):
+        super().__init__(f"Overloaded: ~{estimated_wait:.0f}s queue")
+        self.retry_after = retry_after
+        self.queue_position = queue_position
+        self.estimated_wait = estimated_wait
+
+
+class Ticket:
+    __slots__ = ("controller", "outstanding", "admitted_at")
+
+    def __init__(self, controller: "AdmissionController", cost: int):
+        self.controller = controller
+        self.outstanding = cost  # LLM calls admitted but not issued yet
+        self.admitted_at = time.monotonic()
+
+
+_current_ticket: ContextVar[Ticket | None] = ContextVar("admission_ticket", default=None)
+
+
+def note_llm_call(cost: int = 1) -> None:
+    """Called by the LLM client as a call enters the limiter: that demand
+    is now visible in limiter.queued and leaves the admitted backlog."""
+    ticket = _current_ticket.get()
+    if ticket is None or ticket.outstanding <= 0:
+        return
+    used = min(cost, ticket.outstanding)
+    ticket.outstanding -= used
+    ticket.controller.outstanding -= used
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limiter: Limiter,
+        slo_seconds: float = ADMISSION_SLO_SECONDS,
+        precheck: Callable[[], None] | None = None,
+    ):
+        self.limiter = limiter
+        self.precheck = precheck  # e.g. budget check; raises to reject
+        self.slo = slo_seconds
+        self.outstanding = 0
+        self._tickets: set[Ticket] = set()
+        self.admitted = 0
+        self.rejected = 0
+
+    def estimate_wait(self, cost: int) -> float:
+        """Seconds until `cost` more calls would clear the limiter."""
+        demand = self.limiter.queued + self.outstanding + cost
+        deficit = demand - self.limiter.available()
+        return max(0.0, deficit) / (self.limiter.rate / 60)
+
+    @contextlib.contextmanager
+    def ticket(self, cost: int) -> Iterator[Ticket]:
+        """Admit a request making `cost` LLM calls, or raise Overloaded
+        (or whatever precheck raises)."""
+        if self.precheck is not None:
+            self.precheck()
+        wait = self.estimate_wait(cost)
+        if wait > self.slo:
+            self.rejected += 1
+            position = sum(1 for t in self._tickets if t.outstanding > 0) + 1
+            raise Overloaded(
+                retry_after=max(1, math.ceil(wait - self.slo)),
+                queue_position=position,
+                estimated_wait=wait,
+            )
+        ticket = Ticket(self, cost)
+        self._tickets.add(ticket)
+        self.outstanding += cost
+        self.admitted += 1
+        token = _current_ticket.set(ticket)
+        try:
+            yield ticket
+        finally:
+            _current_ticket.reset(token)
+            self._tickets.discard(ticket)
+            self.outstanding -= ticket.outstanding
+            ticket.outstanding = 0
+
+    def stats(self) -> dict:
+        return {
+            "slo_seconds": self.slo,
+            "in_flight": len(self._tickets),
+            "outstanding_calls": self.outstanding,
+            "queued_calls": self.limiter.queued,
+            "estimated_wait": round(self.estimate_wait(0), 2),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
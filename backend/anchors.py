@@ -0,0 +1,125 @@
+"""Cut parse sections out of raw_text by their anchors.
+
+Parse used to copy every experience block into sections[*].full_text.
+Those output tokens were the slowest and most expensive part of the call,
+and the main reason it hit max_tokens. Now the model returns only a few
+words at the start and end of each block (start_anchor / end_anchor).
+full_text is sliced from the original text here, so it is verbatim by
+construction.
+
+The model rarely quotes exactly (dashes, bullets, case, line breaks), so
+matching happens on a normalized copy of the text: lower case, ё → е,
+and every run of non-word characters collapsed to one space. An index
+maps positions back to raw_text. When a whole anchor is not found, a
+shrinking run of its first or last words is tried, then difflib's
+longest common run.
+"""
+
+import bisect
+import difflib
+import logging
+import re
+
+logger = logging.getLogger("llm")
+
+MIN_ANCHOR_WORDS = 2  # shortest word prefix/suffix still trusted
+MIN_FUZZY_RATIO = 0.6  # difflib: matched share of the anchor
+
+_WORD = re.compile(r"\w")
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", text.lower().replace("ё", "е")).split())
+
+
+class AnchorIndex:
+    """Normalized text of a resume plus a map back to raw offsets."""
+
+    def __init__(self, raw_text: str):
+        self.raw = raw_text
+        chars: list[str] = []
+        offsets: list[int] = []
+        for i, ch in enumerate(raw_text):
+            if _WORD.match(ch):
+                chars.append("е" if ch in "ёЁ" else ch.lower())
+                offsets.append(i)
+            elif chars and chars[-1] != " ":
+                chars.append(" ")
+                offsets.append(i)
+        self.norm = "".join(chars)
+        self._offsets = offsets
+
+    def _raw_span(self, start: int, end: int) -> tuple[int, int]:
+        return self._offsets[start], self._offsets[end - 1] + 1
+
+    def find(self, anchor: str, pos: int = 0, from_end: bool = False) -> tuple[int, int] | None:
+        """Raw (start, end) of anchor at or after raw offset pos, or None.
+
+        from_end: the anchor ends a block, so partial matches try its
+        last words before its first.
+        """
+        needle = normalize(anchor)
+        if not needle:
+            return None
+        npos = bisect.bisect_left(self._offsets, pos)
+
+        idx = self.norm.find(needle, npos)
+        if idx >= 0:
+            return self._raw_span(idx, idx + len(needle))
+
+        words = needle.split()
+        for k in range(len(words) - 1, MIN_ANCHOR_WORDS - 1, -1):
+            parts = (words[-k:], words[:k]) if from_end else (words[:k], words[-k:])
+            for part in parts:
+                part = " ".join(part)
+                idx = self.norm.find(part, npos)
+                if idx >= 0:
+                    return self._raw_span(idx, idx + len(part))
+
+        haystack = self.norm[npos:]
+        match = difflib.SequenceMatcher(None, haystack, needle, autojunk=False).find_longest_match(
+            0, len(haystack), 0, len(needle)
+        )
+        if match.size >= MIN_FUZZY_RATIO * len(needle):
+            return self._raw_span(npos + match.a, npos + match.a + match.size)
+        return None
+
+
+def locate_sections(raw_text: str, sections: list[dict]) -> list[dict]:
+    """Replace start/end anchors with full_text sliced from raw_text.
+
+    Blocks are expected in resume order. A block whose end anchor is not
+    found runs up to the next block; a block whose start anchor is not
+    found starts where the previous one ended.
+    """
+    index = AnchorIndex(raw_text)
+    spans: list[list[int | None]] = []
+    cursor = 0
+    for section in sections:
+        found = index.find(section.get("start_anchor", ""), cursor)
+        start = found[0] if found else None
+        if found:
+            cursor = found[1]
+        end_found = index.find(section.get("end_anchor", ""), cursor, from_end=True)
+        end = end_found[1] if end_found else None
+        if end_found:
+            cursor = end
+        spans.append([start, end])
+
+    located = []
+    for i, section in enumerate(sections):
+        start, end = spans[i]
+        if start is None:
+            start = spans[i - 1][1] if i and spans[i - 1][1] is not None else 0
+            logger.warning(f"!!! [parse] block {section.get('block_id')}: start anchor not found")
+        if end is None or end <= start:
+            logger.warning(f"!!! [parse] block {section.get('block_id')}: end anchor not found")
+            later = [s for s, _ in spans[i + 1:] if s is not None and s > start]
+            end = later[0] if later else len(raw_text)
+        located.append({
+            "block_id": section.get("block_id", i + 1),
+            "section_title": section.get("section_title", ""),
+            "period": section.get("period", ""),
+            "full_text": raw_text[start:end].strip(),
+        })
+    return located
@@ -0,0 +1,148 @@
+"""Compressed, content-addressed storage for large task payloads.
+
+A task used to hold the resume 3-4 times: raw_text, every
+parse_result.sections[*].full_text (a verbatim copy), the same sections
+again inside annotations, then the rewrite. Here each large value is
+stored once:
+
+- values are keyed by the hash of their JSON, so identical step results
+  (same resume uploaded twice) share one blob;
+- long strings that occur verbatim in the task's raw_text are replaced
+  by a (start, end) slice of it instead of being stored again;
+- blobs are compressed (zstd when installed, zlib otherwise) and only
+  decompressed on access, through a small LRU of decoded values.
+
+Decoded values are shared between readers: treat them as read-only and
+write changes back with storage.update_task.
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Any
+
+import orjson
+
+from jsonutil import dumpb
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard
+    zstandard = None
+
+MIN_SLICE_CHARS = 64  # shorter strings stay inline
+DECODED_CACHE_SIZE = 128
+
+_SLICE = "$slice"
+
+if zstandard is not None:
+    _zstd_c = zstandard.ZstdCompressor(level=6)
+    _zstd_d = zstandard.ZstdDecompressor()
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return b"Z" + _zstd_c.compress(data)
+    return b"z" + zlib.compress(data, 6)
+
+
+def _decompress(blob: bytes) -> bytes:
+    if blob[:1] == b"Z":
+        return _zstd_d.decompress(blob[1:])
+    return zlib.decompress(blob[1:])
+
+
+def _pack(value: Any, base: str | None, slices: list[int]) -> Any:
+    """Replace long verbatim substrings of base with slice markers.
+
+    slices collects the start offsets used (empty → blob is standalone).
+    """
+    if isinstance(value, str):
+        if base and len(value) >= MIN_SLICE_CHARS:
+            start = base.find(value)
+            if start >= 0:
+                slices.append(start)
+                return {_SLICE: [start, start + len(value)]}
+        return value
+    if isinstance(value, dict):
+        return {k: _pack(v, base, slices) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_pack(v, base, slices) for v in value]
+    return value
+
+
+def _unpack(value: Any, base: str | None) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and _SLICE in value:
+            start, end = value[_SLICE]
+            return base[start:end]
+        return {k: _unpack(v, base) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack(v, base) for v in value]
+    return value
+
+
+class ArtifactStore:
+    """Refcounted blobs: key → compressed JSON of {"base": key|None, "value": ...}."""
+
+    def __init__(self, cache_size: int = DECODED_CACHE_SIZE):
+        self._blobs: dict[str, bytes] = {}
+        self._refs: dict[str, int] = {}
+        self._bases: dict[str, str] = {}  # blob key → base (raw_text) key
+        self._raw_sizes: dict[str, int] = {}
+        self._decoded: OrderedDict[str, Any] = OrderedDict()
+        self._cache_size = cache_size
+
+    def put(self, value: Any, base_key: str | None = None) -> str:
+        """Store a JSON-able value; returns its key. Verbatim substrings of the
+        base artifact (a string) are stored as slices of it."""
+        base = self.get(base_key) if base_key else None
+        slices: list[int] = []
+        packed = _pack(value, base, slices)
+        uses_base = bool(slices)
+        data = dumpb({"base": base_key if uses_base else None, "value": packed})
+        key = hashlib.sha256(data).hexdigest()
+
+        if key in self._blobs:
+            self._refs[key] += 1
+            return key
+        self._blobs[key] = _compress(data)
+        self._refs[key] = 1
+        self._raw_sizes[key] = len(data)
+        if uses_base:
+            self._refs[base_key] += 1
+            self._bases[key] = base_key
+        return key
+
+    def get(self, key: str) -> Any:
+        if key in self._decoded:
+            self._decoded.move_to_end(key)
+            return self._decoded[key]
+        record = orjson.loads(_decompress(self._blobs[key]))
+        base_key = record["base"]
+        value = _unpack(record["value"], self.get(base_key) if base_key else None)
+        self._decoded[key] = value
+        if len(self._decoded) > self._cache_size:
+            self._decoded.popitem(last=False)
+        return value
+
+    def release(self, key: str) -> None:
+        self._refs[key] -= 1
+        if self._refs[key] > 0:
+            return
+        del self._refs[key], self._blobs[key], self._raw_sizes[key]
+        self._decoded.pop(key, None)
+        base_key = self._bases.pop(key, None)
+        if base_key is not None:
+            self.release(base_key)
+
+    def stats(self) -> dict:
+        stored = sum(len(b) for b in self._blobs.values())
+        raw = sum(self._raw_sizes.values())
+        return {
+            "artifacts": len(self._blobs),
+            "stored_bytes": stored,
+            "json_bytes": raw,
+            "decoded_cached": len(self._decoded),
+            "codec": "zstd" if zstandard is not None else "zlib",
+        }
@@ -6,11 +6,15 @@ import os
 import time
 from typing import Any
 
-from fastapi import Request
+from fastapi import HTTPException, Request
 
-from storage import storage
+from sessions import session_tokens
+from tenants import set_tenant, tenant_for
 
 TELEGRAM_BOT_TOKEN: str | None = os.environ.get("TELEGRAM_BOT_TOKEN")
+# Bearer token for /api/metrics (spend, limiter and storage internals);
+# without it the endpoint does not exist
+METRICS_TOKEN: str | None = os.environ.get("METRICS_TOKEN")
 
 
 def verify_telegram_auth(data: dict[str, str]) -> bool:
@@ -34,11 +38,28 @@ def verify_telegram_auth(data: dict[str, str]) -> bool:
 
 
 async def get_current_user(request: Request) -> dict[str, Any] | None:
-    """Extract current user from session cookie. Returns None for anonymous."""
+    """Extract current user from the signed session cookie (no storage
+    lookup). Returns None for anonymous."""
     token = request.cookies.get("session")
     if not token:
         return None
-    session = storage.get_session(token)
-    if session is None:
+    claims = session_tokens.verify(token)
+    if claims is None:
         return None
-    return storage.get_user(session["tg_id"])
+    return claims["user"]
+
+
+async def bind_tenant(request: Request) -> None:
+    """App-wide dependency: key LLM fair queueing on the user or client IP."""
+    user = await get_current_user(request)
+    set_tenant(tenant_for(user, request.client.host if request.client else None))
+
+
+async def require_metrics_token(request: Request) -> None:
+    """Dependency for operator endpoints: 404 if METRICS_TOKEN is unset,
+    401 unless the request carries it as a bearer token."""
+    if not METRICS_TOKEN:
+        raise HTTPException(404, "Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(401, "Unauthorized", headers={"WWW-Authenticate": "Bearer"})
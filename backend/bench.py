@@ -0,0 +1,369 @@
+"""Micro-benchmarks for backend hot paths (no API calls unless stated).
+
+Run:
+  python bench.py startup          # cold import time per module
+  python bench.py serialize        # response + prompt JSON cost per request
+  python bench.py storage          # memory per task, plain dict vs artifact store
+  python bench.py fused            # LIVE API: split vs fused parse+scoring latency/cost
+  python bench.py segment          # local segmenter accuracy/latency on labeled resumes
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules worth tracking: ours + the heavy third-party ones
+LOCAL_MODULES = [
+    "main", "llm", "prompts", "schemas", "storage", "auth", "parsers",
+    "events", "http_cache", "jsonutil", "artifacts", "admission", "tenants",
+    "ledger", "routing", "speculation", "market_cache", "anchors", "segmenter",
+    "skills", "supersede", "disconnect",
+    "idempotency", "sessions", "recheck_history", "rewrite_versions",
+]
+THIRD_PARTY = ["fastapi", "pydantic", "starlette", "anthropic"]
+
+
+# ---------------------------------------------------------------------------
+# startup — import time per module in fresh interpreters
+# ---------------------------------------------------------------------------
+
+def _importtime(statement: str) -> dict[str, int]:
+    """Cumulative import time (µs) per module for one fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if cumulative.isdigit():
+            times[name] = int(cumulative)
+    return times
+
+
+def bench_startup(runs: int) -> None:
+    samples = [_importtime("import main") for _ in range(runs)]
+    lazy = [_importtime("import anthropic") for _ in range(runs)]
+
+    print(f"Cold `import main`, median of {runs} runs (cumulative ms):")
+    for name in LOCAL_MODULES + THIRD_PARTY:
+        values = [s[name] for s in samples if name in s]
+        if values:
+            print(f"  {name:<12} {statistics.median(values) / 1000:8.1f}")
+        else:
+            print(f"  {name:<12} {'not imported':>12}")
+    lazy_values = [s.get("anthropic", 0) for s in lazy]
+    print(f"Deferred to first LLM call: anthropic {statistics.median(lazy_values) / 1000:.1f} ms")
+
+
+# ---------------------------------------------------------------------------
+# serialize — JSON cost per request, before (stdlib) and after (orjson)
+# ---------------------------------------------------------------------------
+
+def _sample_resume() -> str:
+    with open(os.path.join(HERE, "test_resume.txt"), encoding="utf-8") as f:
+        return f.read() * 6  # ~10 KB, a typical long resume
+
+
+def _sample_rewrite(blocks: int) -> tuple[dict, dict, list[dict]]:
+    """(rewrite result, role details, annotated sections) of realistic size."""
+    bullet = "Управлял портфелем из [уточнить: X] проектов, сократив сроки релиза на 20%"
+    role = {
+        "role": "Менеджер проектов",
+        "match_level": "высокое",
+        "match_score": 85,
+        "strengths": ["Опыт управления командой из 8 человек"] * 4,
+        "gaps": ["Нет метрик по бюджету"] * 3,
+        "typical_duties": "Планирование, контроль сроков и бюджета, коммуникация с заказчиком",
+        "matched_skills": ["Jira", "Confluence", "SQL", "Agile"],
+        "missing_skills": ["MS Project", "PMP"],
+        "reports_to": "CTO",
+        "works_with": "Разработка, QA, дизайн, бизнес-заказчики",
+    }
+    sections = [
+        {
+            "block_id": i + 1,
+            "section_title": f"Компания {i + 1} — Менеджер проектов",
+            "period": "2020–2024",
+            "full_text": "\n".join(f"- {bullet}" for _ in range(6)),
+            "annotations": [
+                {
+                    "original_text": bullet[:40],
+                    "type": "major",
+                    "comment": "Нет измеримого результата — рекрутер не поймёт масштаб",
+                    "suggestion": "Добавь количество проектов и эффект в цифрах",
+                }
+            ] * 4,
+        }
+        for i in range(blocks)
+    ]
+    rewrite = {
+        "summary": "Менеджер проектов с 6 годами опыта в IT " * 3,
+        "original_summary": "Менеджер с опытом в IT",
+        "experiences": [
+            {
+                "block_id": i + 1,
+                "company": f"Компания {i + 1}",
+                "role": "Менеджер проектов",
+                "period": "2020–2024",
+                "original_bullets": [bullet] * 6,
+                "rewritten_bullets": [bullet] * 6,
+                "highlights": [{"action": "add_metrics", "comment": "Уточни цифры"}] * 6,
+                "responsibilities": ["Управление проектами", "Координация команды"],
+            }
+            for i in range(blocks)
+        ],
+        "skills": {
+            "key_competencies": ["Управление проектами"] * 8,
+            "tools": ["Jira", "Confluence"] * 4,
+            "ats_keywords": ["project manager", "agile"] * 5,
+        },
+        "recommendations": ["Добавь 2-3 главных достижения с цифрами"] * 5,
+    }
+    return rewrite, role, sections
+
+
+def _per_call_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def bench_serialize(blocks: int, number: int) -> None:
+    from fastapi.encoders import jsonable_encoder
+
+    import llm
+    from jsonutil import dumpb, dumps
+
+    resume = _sample_resume()
+    rewrite, role, sections = _sample_rewrite(blocks)
+    context = {"resume_type": "Список обязанностей", "main_problem": "Нет метрик", "gender": "male"}
+
+    # Response path: FastAPI default vs ORJSONResponse returned directly
+    def response_before():
+        json.dumps(jsonable_encoder(rewrite), ensure_ascii=False).encode()
+
+    def response_after():
+        dumpb(rewrite)
+
+    # Prompt construction for one rewrite: N block prompts + the meta prompt
+    def prompts_before():
+        for section in sections:
+            json.dumps(section["annotations"], ensure_ascii=False)
+            (
+                f"Оригинальное резюме:\n{resume}\n\n---\n\n"
+                f"Контекст роли:\n{json.dumps(role, ensure_ascii=False)}\n\n"
+                f"Тип резюме: {context['resume_type']}\n"
+            )
+        json.dumps(role, ensure_ascii=False)
+        json.dumps(rewrite["experiences"], ensure_ascii=False)
+
+    def prompts_after():
+        llm._rewrite_shared_prefix.cache_clear()  # one fresh request
+        role_json = dumps(role)
+        for section in sections:
+            dumps(section["annotations"])
+            llm._rewrite_shared_prefix(
+                resume, "Менеджер проектов", role_json,
+                context["resume_type"], context["main_problem"], context["gender"],
+            )
+        dumps(rewrite["experiences"])
+
+    print(f"Serialization per request ({blocks} blocks, µs, best of 5):")
+    for name, before, after in (
+        ("rewrite response", response_before, response_after),
+        ("rewrite prompts", prompts_before, prompts_after),
+    ):
+        b = _per_call_us(before, number)
+        a = _per_call_us(after, number)
+        print(f"  {name:<18} before {b:8.1f}   after {a:8.1f}   ×{b / a:.1f}")
+
+
+# ---------------------------------------------------------------------------
+# storage — memory per task
+# ---------------------------------------------------------------------------
+
+def _sample_task_fields(i: int) -> dict:
+    """Step results of one realistic task; unique per i (no cross-task dedup)."""
+    raw_text = f"Кандидат №{i}\n" + _sample_resume()
+    rewrite, role, _ = _sample_rewrite(8)
+    chunks = [c for c in raw_text.split("\n\n") if len(c) > 80][:8]
+    sections = [
+        {"block_id": n + 1, "section_title": c.split("\n")[0], "period": "2020–2024", "full_text": c}
+        for n, c in enumerate(chunks)
+    ]
+    annotation = {
+        "original_text": "Управлял проектами по разработке ПО",
+        "type": "major",
+        "comment": "Нет измеримого результата — рекрутер не поймёт масштаб",
+        "suggestion": "Добавь количество проектов и эффект в цифрах",
+    }
+    return {
+        "raw_text": raw_text,
+        "parse_result": {
+            "resume_type": "Список обязанностей",
+            "resume_type_description": "Опыт описан процессами без результатов",
+            "main_problem": "Нет конкретных метрик и результатов",
+            "red_flags": [{"flag": "Нет цифр", "detail": "Отсутствуют метрики", "severity": "critical"}],
+            "sections": sections,
+        },
+        "annotations": [{**s, "annotations": [annotation] * 4} for s in sections],
+        "roles": {"roles": [role] * 3, "recommendation": {"primary_role": role["role"], "reasoning": "…"}},
+        "rewrite": {**rewrite, "summary": f"{i} " + rewrite["summary"]},
+    }
+
+
+def _allocated(build) -> tuple[int, object]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+
+def bench_storage(tasks: int) -> None:
+    from storage import TaskStorage
+
+    samples = [_sample_task_fields(i) for i in range(tasks)]
+
+    def plain():
+        # Same shape as before: every field held as decoded Python objects
+        return [json.loads(json.dumps(s)) for s in samples]
+
+    def packed():
+        store = TaskStorage()
+        for s in samples:
+            task_id = store.create_task("resume.txt", s["raw_text"])
+            store.update_task(task_id, **{k: v for k, v in s.items() if k != "raw_text"})
+        return store
+
+    plain_bytes, _ = _allocated(plain)
+    packed_bytes, store = _allocated(packed)
+    print(f"Memory for {tasks} tasks (tracemalloc):")
+    print(f"  plain dicts     {plain_bytes / tasks / 1024:8.1f} KiB/task")
+    print(f"  artifact store  {packed_bytes / tasks / 1024:8.1f} KiB/task   ×{plain_bytes / packed_bytes:.1f} less")
+    print(f"  {store.memory_stats()}")
+
+
+# ---------------------------------------------------------------------------
+# fused — parse + scoring: two calls vs one (live API, costs money)
+# ---------------------------------------------------------------------------
+
+def bench_fused(runs: int) -> None:
+    import asyncio
+
+    import llm
+
+    resume = _sample_resume()
+
+    async def measure(fn) -> tuple[float, float, int]:
+        before = dict(llm._session_totals)
+        t0 = time.perf_counter()
+        await fn()
+        elapsed = time.perf_counter() - t0
+        after = llm._session_totals
+        return elapsed, after["cost"] - before["cost"], after["output"] - before["output"]
+
+    async def split():
+        # What the frontend does: /analyze, then /score
+        await llm.run_parse(resume)
+        await llm.run_scoring(resume)
+
+    async def fused():
+        await llm.run_parse_scoring(resume)
+
+    async def run_all():
+        results = {"split": [], "fused": []}
+        for _ in range(runs):
+            results["split"].append(await measure(split))
+            results["fused"].append(await measure(fused))
+        await llm.close_client()
+        return results
+
+    results = asyncio.run(run_all())
+    print(f"Parse + scoring, median of {runs} runs ({len(resume)} chars):")
+    for name, samples in results.items():
+        seconds, cost, out = (statistics.median(col) for col in zip(*samples))
+        print(f"  {name:<6} {seconds:6.1f} s   ${cost:.4f}   out={out:.0f} tokens")
+
+
+# ---------------------------------------------------------------------------
+# segment — local segmenter vs labeled resumes (bench_data/segmenter)
+# ---------------------------------------------------------------------------
+
+def bench_segment(number: int) -> None:
+    from segmenter import SEGMENTER_MIN_CONFIDENCE, segment
+
+    paths = sorted(glob.glob(os.path.join(HERE, "bench_data", "segmenter", "*.txt")))
+    exact = confident = confident_wrong = 0
+    print(f"Segmenter on {len(paths)} labeled resumes (threshold {SEGMENTER_MIN_CONFIDENCE}):")
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        with open(path[:-4] + ".json", encoding="utf-8") as f:
+            expected = json.load(f)["blocks"]
+        result = segment(text)
+        got = [
+            {"period": s["period"], "starts": s["full_text"].splitlines()[0],
+             "ends": s["full_text"].splitlines()[-1]}
+            for s in result.sections
+        ]
+        ok = got == expected
+        exact += ok
+        if result.confidence >= SEGMENTER_MIN_CONFIDENCE:
+            confident += 1
+            confident_wrong += not ok
+        us = _per_call_us(lambda: segment(text), number)
+        print(f"  {os.path.basename(path):<20} blocks {len(got)}/{len(expected)}  "
+              f"{'ok  ' if ok else 'MISS'}  conf={result.confidence:.2f}  {us:8.1f} µs")
+    print(f"Exact: {exact}/{len(paths)}; fast path taken: {confident}, of them wrong: {confident_wrong}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    startup = sub.add_parser("startup", help="import time per module")
+    startup.add_argument("--runs", type=int, default=5)
+
+    serialize = sub.add_parser("serialize", help="JSON cost per request")
+    serialize.add_argument("--blocks", type=int, default=8)
+    serialize.add_argument("--number", type=int, default=500)
+
+    storage = sub.add_parser("storage", help="memory per task")
+    storage.add_argument("--tasks", type=int, default=200)
+
+    fused = sub.add_parser("fused", help="split vs fused parse+scoring (live API)")
+    fused.add_argument("--runs", type=int, default=3)
+
+    segment = sub.add_parser("segment", help="local segmenter accuracy/latency")
+    segment.add_argument("--number", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "startup":
+        bench_startup(args.runs)
+    elif args.command == "serialize":
+        bench_serialize(args.blocks, args.number)
+    elif args.command == "storage":
+        bench_storage(args.tasks)
+    elif args.command == "fused":
+        bench_fused(args.runs)
+    elif args.command == "segment":
+        bench_segment(args.number)
+
+
+if __name__ == "__main__":
+    main()
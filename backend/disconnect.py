@@ -0,0 +1,82 @@
+"""Stop a request's LLM work when its client goes away.
+
+A user who closes the tab during annotate or rewrite used to leave the
+whole fan-out running: every per-block call finished, each one holding
+a limiter token and a pool slot that live requests were waiting for.
+until_disconnect() runs the step as a task and polls the connection.
+When the client is gone, it cancels the task. Cancellation reaches
+asyncio.gather fan-outs, pending rpm_limiter.acquire() waits (which give
+the tenant its virtual time back) and in-flight HTTP calls.
+
+Work that somebody else is still waiting for is not cancelled:
+  - a retry with the same Idempotency-Key is attached to it;
+  - keep() is true when the client leaves, e.g. another client is
+    subscribed to the task's events;
+  - the awaitable is shielded, e.g. an adopted speculative rewrite,
+    which runs on for whoever asks next.
+Rewrite blocks finished before a cancel are kept in rewrite_partial, so
+a retry resumes from them.
+
+CANCEL_ON_DISCONNECT=0 turns cancellation off (steps always finish).
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, TypeVar
+
+from starlette.requests import Request
+
+from idempotency import retry_attached
+
+CANCEL_ON_DISCONNECT = os.environ.get("CANCEL_ON_DISCONNECT", "1") == "1"
+DISCONNECT_POLL_SECONDS = 0.5
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The client left; its work was cancelled."""
+
+
+class DisconnectStats:
+    def __init__(self):
+        self.cancelled = 0
+        self.kept = 0  # client left, work finished for another waiter
+
+    def stats(self) -> dict:
+        return {"enabled": CANCEL_ON_DISCONNECT, "cancelled": self.cancelled, "kept": self.kept}
+
+
+disconnects = DisconnectStats()
+
+
+async def until_disconnect(
+    request: Request,
+    awaitable: Awaitable[T],
+    keep: Callable[[], bool] = lambda: False,
+) -> T:
+    """Await `awaitable`; cancel it and raise ClientDisconnected if the
+    client disconnects first, unless keep() says someone else needs it."""
+    # The task copies the current context: tenant, usage task, admission ticket
+    work = asyncio.ensure_future(awaitable)
+    if not CANCEL_ON_DISCONNECT:
+        return await work
+    try:
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return work.result()
+            if not await request.is_disconnected():
+                continue
+            if retry_attached() or keep():
+                disconnects.kept += 1
+                return await work
+            work.cancel()
+            disconnects.cancelled += 1
+            await asyncio.wait({work})
+            if not work.cancelled():
+                work.exception()  # finished meanwhile; nobody left to report to
+            raise ClientDisconnected()
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
@@ -0,0 +1,97 @@
+"""Per-task event stream for progressive delivery of fan-out results.
+
+Steps publish each finished piece (annotated section, rewritten block,
+rewrite meta) the moment it is ready; GET /api/tasks/{id}/events relays
+them to the browser as Server-Sent Events. Every task keeps a short
+replay log so a client that subscribes late (or reconnects with
+Last-Event-ID) still gets what it missed.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator
+
+from jsonutil import dumps
+
+LOG_SIZE = 256  # events kept per task for replay
+IDLE_TTL = 3600  # drop logs of tasks without events for an hour
+HEARTBEAT_SECONDS = 15
+
+
+class TaskEvents:
+    def __init__(self):
+        self._logs: dict[str, deque[dict[str, Any]]] = {}
+        self._seq: dict[str, int] = {}
+        self._touched: dict[str, float] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+
+    def publish(self, task_id: str, event: str, data: dict[str, Any]) -> int:
+        """Append an event to the task log and wake its subscribers."""
+        self._prune()
+        seq = self._seq.get(task_id, 0) + 1
+        self._seq[task_id] = seq
+        entry = {"id": seq, "event": event, "data": data}
+        self._logs.setdefault(task_id, deque(maxlen=LOG_SIZE)).append(entry)
+        self._touched[task_id] = time.monotonic()
+        for queue in self._subscribers.get(task_id, ()):
+            queue.put_nowait(entry)
+        return seq
+
+    def watched(self, task_id: str) -> bool:
+        """Someone is subscribed to the task's events right now."""
+        return bool(self._subscribers.get(task_id))
+
+    def history(self, task_id: str, after: int = 0) -> list[dict[str, Any]]:
+        return [e for e in self._logs.get(task_id, ()) if e["id"] > after]
+
+    async def subscribe(self, task_id: str, after: int = 0) -> AsyncIterator[dict[str, Any] | None]:
+        """Replay events after `after`, then yield live ones.
+
+        Yields None every HEARTBEAT_SECONDS of silence so the caller can
+        keep the connection alive.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            last = after
+            for entry in self.history(task_id, after):
+                last = entry["id"]
+                yield entry
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if entry["id"] > last:
+                    last = entry["id"]
+                    yield entry
+        finally:
+            subs = self._subscribers.get(task_id)
+            if subs is not None:
+                subs.discard(queue)
+                if not subs:
+                    del self._subscribers[task_id]
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        stale = [
+            t for t, ts in self._touched.items()
+            if now - ts > IDLE_TTL and t not in self._subscribers
+        ]
+        for task_id in stale:
+            self._logs.pop(task_id, None)
+            self._seq.pop(task_id, None)
+            self._touched.pop(task_id, None)
+
+
+def format_sse(entry: dict[str, Any] | None) -> str:
+    """Serialize an event (or a heartbeat for None) in SSE wire format."""
+    if entry is None:
+        return ": keep-alive\n\n"
+    data = dumps(entry["data"])
+    return f"id: {entry['id']}\nevent: {entry['event']}\ndata: {data}\n\n"
+
+
+task_events = TaskEvents()
@@ -0,0 +1,133 @@
+"""Conditional GET and precompressed bodies for task polling.
+
+Every storage.update_task bumps the task's version. GET /api/tasks/{id}
+derives a strong ETag from (task_id, version) and answers 304 when the
+client already has it. The serialized body and its gzip/brotli variants
+are cached per task version, so a repeat poll is a dict lookup rather
+than a serialize-and-compress pass.
+"""
+
+import gzip
+from collections import OrderedDict
+from typing import Callable
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+MAX_TASKS = 512  # task payloads kept (one version each)
+MIN_COMPRESS_SIZE = 1024  # bytes; smaller bodies go out as-is
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str:
+    """Pick br > gzip > identity from an Accept-Encoding header."""
+    offered = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        offered.add(name.strip().lower())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return "identity"
+
+
+def make_etag(task_id: str, version: int, encoding: str) -> str:
+    # Strong ETags must differ per representation, hence the encoding suffix
+    suffix = "" if encoding == "identity" else f"-{encoding}"
+    return f'"{task_id}.{version}{suffix}"'
+
+
+def etag_matches(if_none_match: str | None, task_id: str, version: int) -> bool:
+    """True if If-None-Match names any encoding of this task version."""
+    if not if_none_match:
+        return False
+    base = f"{task_id}.{version}"
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip('"')
+        if tag == base or tag.startswith(base + "-"):
+            return True
+    return False
+
+
+class TaskPayloadCache:
+    """LRU of serialized task payloads keyed by (task_id, version, encoding)."""
+
+    def __init__(self, max_tasks: int = MAX_TASKS):
+        self._entries: OrderedDict[str, tuple[int, dict[str, bytes]]] = OrderedDict()
+        self._max = max_tasks
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        task_id: str,
+        version: int,
+        encoding: str,
+        serialize: Callable[[], bytes],
+    ) -> tuple[bytes, str]:
+        """Body for this task version in `encoding` (or identity if too small).
+
+        Returns (body, actual_encoding).
+        """
+        bodies, hit = self._bodies(task_id, version, serialize)
+        encoding = self._actual_encoding(bodies, encoding)
+        body = bodies.get(encoding)
+        if body is None:
+            hit = False
+            body = bodies[encoding] = _compress(bodies["identity"], encoding)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return body, encoding
+
+    def encoding_for(
+        self,
+        task_id: str,
+        version: int,
+        encoding: str,
+        serialize: Callable[[], bytes],
+    ) -> str:
+        """Encoding get() serves for this version, without compressing:
+        the ETag of a 304 must be the one the 200 carried."""
+        bodies, _ = self._bodies(task_id, version, serialize)
+        return self._actual_encoding(bodies, encoding)
+
+    def _bodies(self, task_id: str, version: int, serialize: Callable[[], bytes]) -> tuple[dict[str, bytes], bool]:
+        entry = self._entries.get(task_id)
+        hit = True
+        if entry is None or entry[0] != version:
+            hit = False
+            entry = (version, {"identity": serialize()})
+            self._entries[task_id] = entry
+            if len(self._entries) > self._max:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(task_id)
+        return entry[1], hit
+
+    @staticmethod
+    def _actual_encoding(bodies: dict[str, bytes], encoding: str) -> str:
+        if len(bodies["identity"]) < MIN_COMPRESS_SIZE:
+            return "identity"
+        return encoding
+
+    def stats(self) -> dict:
+        return {"tasks": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+task_payloads = TaskPayloadCache()
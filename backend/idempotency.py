@@ -0,0 +1,226 @@
+"""Idempotency-Key support for LLM-backed POST endpoints.
+
+Mobile clients and proxies retry POSTs that time out. Each retry of
+rewrite or recheck started another paid run, and recheck appended
+another entry to task["rechecks"]. A client that sends an
+Idempotency-Key header gets one execution per key:
+
+  - first request: runs normally; its response is captured;
+  - retry while it runs: attaches to the same execution and gets the
+    same response once it is done;
+  - retry after it finished: the stored response is replayed
+    (Idempotent-Replayed: true);
+  - same key, different body: 422.
+
+Keys are scoped to the caller (user, or client IP for anonymous) and to
+the path. Entries live for IDEMPOTENCY_TTL. Responses that a retry
+should not get again (5xx, 408, 409, 429, 499) are handed to requests
+already attached and then forgotten, so the next retry runs again.
+While a retry is attached, the original run is not cancelled when its
+own client disconnects (see disconnect.py).
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, NamedTuple
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth import get_current_user
+from jsonutil import dumpb
+from tenants import tenant_for
+
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_ENTRIES = 2000
+MAX_KEY_LENGTH = 255
+
+# POST endpoints that spend LLM calls
+IDEMPOTENT_PATHS = re.compile(
+    r"^/api/(?:analyze|analyze-text|tasks/[^/]+/(?:parse|score|annotate|rewrite|regenerate|recheck))$"
+)
+_NOT_STORED = {408, 409, 429, 499}
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "created_at", "attached")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.created_at = time.monotonic()
+        self.attached = 0  # retries waiting on this execution
+
+
+_current_entry: ContextVar[_Entry | None] = ContextVar("idempotency_entry", default=None)
+
+
+def retry_attached() -> bool:
+    """A retry of the current request is waiting for its response."""
+    entry = _current_entry.get()
+    return entry is not None and entry.attached > 0
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self._entries: OrderedDict[tuple[str, str, str], _Entry] = OrderedDict()
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self.executed = 0
+        self.attached = 0  # retries that joined a running execution
+        self.replayed = 0  # retries served from a stored response
+        self.conflicts = 0
+
+    def get(self, key: tuple[str, str, str]) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self._ttl:
+            del self._entries[key]
+            return None
+        return entry
+
+    def begin(self, key: tuple[str, str, str], fingerprint: str) -> _Entry:
+        entry = _Entry(fingerprint)
+        self._entries[key] = entry
+        self.executed += 1
+        while len(self._entries) > self._max_entries:
+            # Oldest first; never drop a running execution
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if not oldest.future.done():
+                break
+            del self._entries[oldest_key]
+        return entry
+
+    def finish(self, key: tuple[str, str, str], entry: _Entry, response: StoredResponse) -> None:
+        if not entry.future.done():
+            entry.future.set_result(response)
+        if response.status >= 500 or response.status in _NOT_STORED:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "in_flight": sum(1 for e in self._entries.values() if not e.future.done()),
+            "executed": self.executed,
+            "attached": self.attached,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+        }
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _fingerprint(headers: Headers, body: bytes) -> str:
+    # A re-built multipart form gets a new boundary; the content is what matters
+    match = re.search(r"boundary=\"?([^\";]+)", headers.get("content-type", ""))
+    if match:
+        body = body.replace(match.group(1).encode(), b"")
+    return hashlib.sha256(body).hexdigest()
+
+
+async def _send_stored(send: Send, response: StoredResponse, replayed: bool) -> None:
+    headers = list(response.headers)
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+
+async def _send_error(send: Send, status: int, detail: str) -> None:
+    body = dumpb({"detail": detail})
+    await _send_stored(send, StoredResponse(
+        status,
+        [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        body,
+    ), replayed=False)
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp, store: IdempotencyStore | None = None):
+        self.app = app
+        self.store = store or idempotency_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not IDEMPOTENT_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idem_key = headers.get("idempotency-key")
+        if not idem_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idem_key) > MAX_KEY_LENGTH:
+            await _send_error(send, 400, "Idempotency-Key слишком длинный")
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        request = Request(scope)
+        user = await get_current_user(request)
+        owner = tenant_for(user, request.client.host if request.client else None).key
+        key = (owner, scope["path"], idem_key)
+        fingerprint = _fingerprint(headers, body)
+
+        entry = self.store.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                self.store.conflicts += 1
+                await _send_error(send, 422, "Idempotency-Key уже использован с другим запросом")
+                return
+            if entry.future.done():
+                self.store.replayed += 1
+            else:
+                self.store.attached += 1
+                entry.attached += 1
+            try:
+                response = await asyncio.shield(entry.future)
+            finally:
+                if not entry.future.done():
+                    entry.attached -= 1
+            await _send_stored(send, response, replayed=True)
+            return
+
+        entry = self.store.begin(key, fingerprint)
+        _current_entry.set(entry)
+        body_sent = False
+
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status, response_headers, parts = 500, [], []
+
+        async def capture_send(message: Message) -> None:
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status, response_headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                parts.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            self.store.finish(key, entry, StoredResponse(status, response_headers, b"".join(parts)))
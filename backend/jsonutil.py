@@ -0,0 +1,29 @@
+"""Fast JSON (orjson) for API responses, cached payloads and prompt text."""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumpb(obj: Any) -> bytes:
+    """Compact UTF-8 JSON bytes (Cyrillic stays unescaped)."""
+    return orjson.dumps(obj, option=_OPTIONS)
+
+
+def dumps(obj: Any) -> str:
+    """Compact JSON text — drop-in for json.dumps(obj, ensure_ascii=False)."""
+    return orjson.dumps(obj, option=_OPTIONS).decode()
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson.
+
+    Return it directly from an endpoint to also skip FastAPI's
+    jsonable_encoder pass, which dominates for large LLM payloads.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumpb(content)
@@ -0,0 +1,161 @@
+"""Per-task and per-user daily LLM usage, with budget enforcement.
+
+Every LLM response's usage (tokens by kind + dollars) is charged to the
+task the request is working on and to the tenant's (user or client IP)
+counter for the current UTC day. Counters live in memory and are written
+back to the storage backend at most every FLUSH_SECONDS (and on
+shutdown), so a call costs a few dict updates.
+
+Admission checks the budgets before a request starts any LLM call; a
+fan-out that is already running is allowed to finish.
+
+The daily budget is per signed-in user. Anonymous tenants are client
+IPs, and one IP can be a whole office or a carrier NAT, so they have a
+separate, larger limit: ANON_DAILY_BUDGET_USD, by default
+ANON_BUDGET_MULTIPLIER times the user budget.
+"""
+
+import datetime
+import os
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from storage import storage
+from tenants import current_tenant
+
+# Dollar limits; 0 disables a limit
+TASK_BUDGET_USD = float(os.environ.get("TASK_BUDGET_USD", "0.50"))
+USER_DAILY_BUDGET_USD = float(os.environ.get("USER_DAILY_BUDGET_USD", "3.00"))
+ANON_BUDGET_MULTIPLIER = 5  # people sharing one IP, roughly
+ANON_DAILY_BUDGET_USD = float(
+    os.environ.get("ANON_DAILY_BUDGET_USD", str(ANON_BUDGET_MULTIPLIER * USER_DAILY_BUDGET_USD))
+)
+# Recheck / regenerate loops are cheap per call but unbounded in count
+TASK_MAX_CALLS = int(os.environ.get("TASK_MAX_CALLS", "120"))
+FLUSH_SECONDS = 5.0
+
+COUNTERS = ("calls", "input", "output", "cache_read", "cache_write", "cost")
+
+_current_task: ContextVar[str | None] = ContextVar("usage_task", default=None)
+
+
+def bind_task(task_id: str | None) -> None:
+    """Charge LLM calls made for the rest of this request to task_id."""
+    _current_task.set(task_id)
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, scope: str, limit: float, retry_after: int | None = None):
+        super().__init__(f"{scope} budget of {limit} exceeded")
+        self.scope = scope  # "task" | "user"
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def _today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _seconds_to_midnight() -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    midnight = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+def _empty() -> dict[str, Any]:
+    return {name: 0.0 if name == "cost" else 0 for name in COUNTERS}
+
+
+class UsageLedger:
+    def __init__(self):
+        self._counters: dict[str, dict[str, Any]] = {}  # ledger key → counters
+        self._dirty: set[str] = set()
+        self._last_flush = time.monotonic()
+
+    def _get(self, key: str) -> dict[str, Any]:
+        counters = self._counters.get(key)
+        if counters is None:
+            counters = {**_empty(), **(storage.get_usage(key) or {})}
+            self._counters[key] = counters
+        return counters
+
+    @staticmethod
+    def task_key(task_id: str) -> str:
+        return f"task:{task_id}"
+
+    @staticmethod
+    def user_key(tenant_key: str, day: str | None = None) -> str:
+        return f"{tenant_key}:{day or _today()}"
+
+    def record(self, input: int, output: int, cache_read: int, cache_write: int, cost: float) -> None:
+        """Charge one LLM call to the bound task and the current tenant's day."""
+        keys = [self.user_key(current_tenant().key)]
+        task_id = _current_task.get()
+        if task_id is not None:
+            keys.append(self.task_key(task_id))
+        for key in keys:
+            counters = self._get(key)
+            counters["calls"] += 1
+            counters["input"] += input
+            counters["output"] += output
+            counters["cache_read"] += cache_read
+            counters["cache_write"] += cache_write
+            counters["cost"] += cost
+            self._dirty.add(key)
+        if time.monotonic() - self._last_flush > FLUSH_SECONDS:
+            self.flush()
+
+    def check(self) -> None:
+        """Raise BudgetExceeded if the bound task or tenant is over a limit."""
+        task_id = _current_task.get()
+        if task_id is not None:
+            task = self._get(self.task_key(task_id))
+            if TASK_BUDGET_USD and task["cost"] >= TASK_BUDGET_USD:
+                raise BudgetExceeded("task", TASK_BUDGET_USD)
+            if TASK_MAX_CALLS and task["calls"] >= TASK_MAX_CALLS:
+                raise BudgetExceeded("task", TASK_MAX_CALLS)
+        tenant_key = current_tenant().key
+        budget = _daily_budget(tenant_key)
+        if budget and self._get(self.user_key(tenant_key))["cost"] >= budget:
+            raise BudgetExceeded("user", budget, retry_after=_seconds_to_midnight())
+
+    def task_usage(self, task_id: str) -> dict[str, Any]:
+        return dict(self._get(self.task_key(task_id)))
+
+    def user_usage(self, tenant_key: str) -> dict[str, Any]:
+        return dict(self._get(self.user_key(tenant_key)))
+
+    def flush(self) -> None:
+        """Write changed counters through to storage."""
+        for key in self._dirty:
+            storage.save_usage(key, dict(self._counters[key]))
+        self._dirty.clear()
+        self._last_flush = time.monotonic()
+        # Keep only hot counters: live tasks and today's tenant totals
+        suffix = f":{_today()}"
+        self._counters = {
+            k: v for k, v in self._counters.items()
+            if k.endswith(suffix)
+            or (k.startswith("task:") and storage.get_task(k[len("task:"):]) is not None)
+        }
+
+
+def _daily_budget(tenant_key: str) -> float:
+    if tenant_key.startswith("user:"):
+        return USER_DAILY_BUDGET_USD
+    if tenant_key.startswith("ip:"):
+        return ANON_DAILY_BUDGET_USD
+    return 0.0  # system work
+
+
+def limits() -> dict[str, float]:
+    return {
+        "task_usd": TASK_BUDGET_USD,
+        "task_calls": TASK_MAX_CALLS,
+        "user_daily_usd": USER_DAILY_BUDGET_USD,
+        "anon_daily_usd": ANON_DAILY_BUDGET_USD,
+    }
+
+
+ledger = UsageLedger()
@@ -1,21 +1,31 @@
 """Claude API client — unified interface for all LLM calls."""
 
-import json
+import asyncio
+import contextlib
+import functools
+import hashlib
+import heapq
+import importlib.util
 import logging
 import os
+import random
+import secrets
 import time
-
-import anthropic
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
 
 from prompts import (
     ANNOTATE_SCHEMA,
     ANNOTATE_SYSTEM,
+    PARSE_CLASSIFY_SCHEMA,
+    PARSE_CLASSIFY_SYSTEM,
     PARSE_SCHEMA,
+    PARSE_SCORING_SCHEMA,
+    PARSE_SCORING_SYSTEM,
     PARSE_SYSTEM,
     RECHECK_SCHEMA,
     RECHECK_SYSTEM,
     RECHECK_USER_TEMPLATE,
-    REGENERATE_BULLET_SCHEMA,
     REGENERATE_BULLET_SYSTEM,
     REWRITE_BLOCK_SCHEMA,
     REWRITE_BLOCK_SYSTEM,
@@ -26,48 +36,74 @@ from prompts import (
     SCORING_SCHEMA,
     SCORING_SYSTEM,
 )
+from admission import note_llm_call
+from anchors import locate_sections
+from jsonutil import dumps
+from ledger import ledger
+from market_cache import role_market
+from schemas import compile_all, get_validator, prompt_fingerprints
+from routing import DEFAULT_MODEL, HAIKU, SONNET, model_router
+from segmenter import SEGMENTER_MIN_CONFIDENCE, segment
+from skills import skill_index
+from tenants import Tenant, current_tenant
+
+if TYPE_CHECKING:
+    import anthropic
+
+ResultCallback = Callable[[dict], None]
 
 # ---------------------------------------------------------------------------
 # Logging
 # ---------------------------------------------------------------------------
 
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
 
 logger = logging.getLogger("llm")
 logger.setLevel(logging.DEBUG)
 
-_file_handler = logging.FileHandler(os.path.join(LOG_DIR, "llm.log"), encoding="utf-8")
-_file_handler.setFormatter(logging.Formatter("%(asctime)s | %(message)s", datefmt="%H:%M:%S"))
-logger.addHandler(_file_handler)
 
-# Also print to console
-_console_handler = logging.StreamHandler()
-_console_handler.setFormatter(logging.Formatter("\033[36m%(asctime)s\033[0m | %(message)s", datefmt="%H:%M:%S"))
-logger.addHandler(_console_handler)
+def setup_logging() -> None:
+    """Attach file + console handlers. Idempotent; runs at startup, not import."""
+    if logger.handlers:
+        return
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    file_handler = logging.FileHandler(os.path.join(LOG_DIR, "llm.log"), encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(asctime)s | %(message)s", datefmt="%H:%M:%S"))
+    logger.addHandler(file_handler)
 
-# Pricing per 1M tokens (Haiku 4.5)
-PRICE_INPUT = 0.80   # $/1M input tokens
-PRICE_OUTPUT = 4.00  # $/1M output tokens
-PRICE_CACHE_READ = 0.08  # $/1M cached input tokens
-PRICE_CACHE_WRITE = 1.00  # $/1M cache write tokens
+    # Also print to console
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("\033[36m%(asctime)s\033[0m | %(message)s", datefmt="%H:%M:%S"))
+    logger.addHandler(console_handler)
+
+# Pricing per 1M tokens, $ — input is non-cached input
+ESTIMATE_CHARS_PER_TOKEN = 3  # Cyrillic-heavy text; errs towards overcharging
+MODEL_PRICES = {
+    HAIKU: {"input": 0.80, "output": 4.00, "cache_read": 0.08, "cache_write": 1.00},
+    SONNET: {"input": 3.00, "output": 15.00, "cache_read": 0.30, "cache_write": 3.75},
+}
 
 # Session totals
 _session_totals = {"input": 0, "output": 0, "cache_read": 0, "cache_write": 0, "cost": 0.0, "calls": 0}
 
 
-def _calc_cost(usage) -> float:
+def _calc_cost(usage, model: str) -> float:
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        # Unknown (e.g. pinned via env) — overestimate rather than undercount
+        price = max(MODEL_PRICES.values(), key=lambda p: p["output"])
     inp = getattr(usage, "input_tokens", 0) or 0
     out = getattr(usage, "output_tokens", 0) or 0
     cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
     cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
     # input_tokens = non-cached input (separate from cache counters)
     return (
-        inp * PRICE_INPUT / 1_000_000
-        + out * PRICE_OUTPUT / 1_000_000
-        + cache_read * PRICE_CACHE_READ / 1_000_000
-        + cache_write * PRICE_CACHE_WRITE / 1_000_000
-    )
+        inp * price["input"]
+        + out * price["output"]
+        + cache_read * price["cache_read"]
+        + cache_write * price["cache_write"]
+    ) / 1_000_000
 
 
 # ---------------------------------------------------------------------------
@@ -76,36 +112,284 @@ def _calc_cost(usage) -> float:
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 
-MODEL = "claude-haiku-4-5-20251001"
+MODEL = DEFAULT_MODEL  # per-step choice: routing.STEP_ROUTES
 MAX_TOKENS = 16384
 
-client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+# One call for parse + scoring instead of two (see run_parse_scoring)
+FUSED_PARSE_SCORING = os.environ.get("FUSED_PARSE_SCORING", "0") == "1"
+
+# Web searches per roles call; each role found in the market cache saves one
+ROLES_WEB_SEARCHES = 3
+MARKET_REGION = "RU"
+
+# Per-block retries in run_rewrite (on top of the SDK's transport retries)
+REWRITE_BLOCK_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 1.0
 
 
 # ---------------------------------------------------------------------------
-# Rate limiter
+# HTTP client — one shared connection pool for all LLM calls
 # ---------------------------------------------------------------------------
 
-import asyncio
+# Max in-flight LLM requests per process; the pool holds exactly this many
+# connections so a fan-out never waits for a socket the pool could have had.
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "16"))
+KEEPALIVE_SECONDS = 60.0
+CONNECT_TIMEOUT = 5.0
+WARMUP_CONNECTIONS = 4
+
+# Read timeout per step (tool name), seconds. Web search makes roles slow.
+STEP_TIMEOUTS = {
+    "parse": 120.0,
+    "parse_classify": 60.0,
+    "scoring": 60.0,
+    "parse_scoring": 150.0,
+    "annotate": 60.0,
+    "roles": 180.0,
+    "rewrite_block": 60.0,
+    "rewrite_meta": 60.0,
+    "regenerate_bullet": 20.0,
+    "recheck": 90.0,
+}
+DEFAULT_TIMEOUT = 120.0
+
+_client: "anthropic.AsyncAnthropic | None" = None
+_http_client = None
+_step_timeouts: dict = {}
+_llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+_pool_stats = {"acquired": 0, "waited": 0, "wait_total": 0.0, "wait_max": 0.0, "in_flight": 0}
+
+
+def _build_http_client():
+    """httpx client with pool limits, keep-alive and HTTP/2 when h2 is installed."""
+    import anthropic
+    import httpx
+
+    return anthropic.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_CONCURRENCY,
+            max_keepalive_connections=LLM_CONCURRENCY,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        ),
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def get_client() -> "anthropic.AsyncAnthropic":
+    """Shared client; the anthropic SDK (~1s to import) loads on first use."""
+    global _client, _http_client
+    if _client is None:
+        import anthropic
+
+        setup_logging()
+        _http_client = _build_http_client()
+        _client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            http_client=_http_client,
+        )
+    return _client
+
+
+def _step_timeout(schema_name: str):
+    timeout = _step_timeouts.get(schema_name)
+    if timeout is None:
+        import anthropic
+
+        timeout = anthropic.Timeout(
+            STEP_TIMEOUTS.get(schema_name, DEFAULT_TIMEOUT), connect=CONNECT_TIMEOUT
+        )
+        _step_timeouts[schema_name] = timeout
+    return timeout
+
+
+async def init() -> None:
+    """Startup work kept out of import: logging, validators, skill index, client, warm-up."""
+    t0 = time.monotonic()
+    setup_logging()
+    compile_all()
+    skill_index.load()
+    get_client()
+    logger.info(
+        f"=== LLM init in {time.monotonic() - t0:.2f}s | prompts: "
+        + ", ".join(f"{k}={v}" for k, v in prompt_fingerprints().items())
+    )
+    await warm_up()
+
+
+async def warm_up() -> None:
+    """Open pool connections (DNS + TCP + TLS) before the first user request."""
+    if not ANTHROPIC_API_KEY:
+        return
+    base_url = str(get_client().base_url)
+    t0 = time.monotonic()
+    results = await asyncio.gather(
+        *[_http_client.head(base_url) for _ in range(WARMUP_CONNECTIONS)],
+        return_exceptions=True,
+    )
+    failed = sum(isinstance(r, Exception) for r in results)
+    logger.info(
+        f"=== Warm-up: {WARMUP_CONNECTIONS - failed}/{WARMUP_CONNECTIONS} connections "
+        f"in {time.monotonic() - t0:.2f}s"
+    )
+
+
+async def close_client() -> None:
+    global _client, _http_client
+    if _client is not None:
+        await _client.close()
+        _client = _http_client = None
+
+
+def llm_stats() -> dict:
+    """Session token/cost totals, limiter queues, per-model health and pool wait stats."""
+    acquired = _pool_stats["acquired"]
+    return {
+        "session": dict(_session_totals),
+        "prompts": prompt_fingerprints(),
+        "limiter": rpm_limiter.stats(),
+        "models": model_router.stats(),
+        "role_market_cache": role_market.stats(),
+        "skills": skill_index.stats(),
+        "pool": {
+            "size": LLM_CONCURRENCY,
+            **_pool_stats,
+            "wait_avg": _pool_stats["wait_total"] / acquired if acquired else 0.0,
+        },
+    }
 
 
+# ---------------------------------------------------------------------------
+# Rate limiter
+# ---------------------------------------------------------------------------
+
 class TokenBucket:
+    """RPM limiter that hands out tokens by weighted fair queueing.
+
+    Waiters are served in order of their virtual start time (start-time
+    fair queueing): each tenant's next request starts where its previous
+    one finished, at cost / weight, so a tenant with a long queue only
+    delays itself and a weight-2 tenant drains twice as fast as a
+    weight-1 one. Background tenants (speculative work) are served only
+    when no other tenant is waiting. With no contention a call is
+    admitted immediately.
+    """
+
     def __init__(self, rate_per_minute: int):
         self.rate = rate_per_minute
         self.tokens = float(rate_per_minute)
         self.last_refill = time.monotonic()
+        self.queued = 0  # cost of callers currently inside acquire()
+        self._vtime = 0.0  # start tag of the last request served
+        self._finish: dict[str, float] = {}  # tenant queue → finish tag of its last request
+        # (background, start tag, seq, tenant, cost, future): background sorts last
+        self._waiters: list[tuple[bool, float, int, Tenant, int, asyncio.Future]] = []
+        self._seq = 0
+        self._dispatcher: asyncio.Task | None = None
+        self._depth: dict[str, int] = {}  # tenant queue → waiting callers
+
+    def available(self) -> float:
+        """Tokens available right now (refill applied, state untouched)."""
+        elapsed = time.monotonic() - self.last_refill
+        return min(self.rate, self.tokens + elapsed * (self.rate / 60))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * (self.rate / 60))
+        self.last_refill = now
 
     async def acquire(self, cost: int = 1) -> None:
-        while True:
-            now = time.monotonic()
-            elapsed = now - self.last_refill
-            self.tokens = min(self.rate, self.tokens + elapsed * (self.rate / 60))
-            self.last_refill = now
-            if self.tokens >= cost:
-                self.tokens -= cost
-                return
-            wait = (cost - self.tokens) / (self.rate / 60)
-            await asyncio.sleep(wait)
+        tenant = current_tenant()
+        start = max(self._vtime, self._finish.get(tenant.queue, 0.0))
+        self._finish[tenant.queue] = start + cost / tenant.weight
+
+        self._refill()
+        if not self._waiters and self.tokens >= cost:
+            self.tokens -= cost
+            if not tenant.background:
+                self._vtime = start
+            if len(self._finish) > 1024:
+                self._prune_finish()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (tenant.background, start, self._seq, tenant, cost, future))
+        self.queued += cost
+        self._depth[tenant.queue] = self._depth.get(tenant.queue, 0) + 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        finally:
+            self.queued -= cost
+            self._depth[tenant.queue] -= 1
+            if not self._depth[tenant.queue]:
+                del self._depth[tenant.queue]
+            if future.cancelled() and tenant.queue in self._finish:
+                # Never served: don't charge the tenant's virtual time for it
+                self._finish[tenant.queue] = max(
+                    self._vtime, self._finish[tenant.queue] - cost / tenant.weight
+                )
+
+    async def _dispatch(self) -> None:
+        """Grant tokens to waiters in start-tag order as the bucket refills."""
+        while self._waiters:
+            background, start, _, _, cost, future = self._waiters[0]
+            if future.done():  # caller cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self.tokens < cost:
+                await asyncio.sleep((cost - self.tokens) / (self.rate / 60))
+                continue
+            heapq.heappop(self._waiters)
+            self.tokens -= cost
+            if not background:  # background tags must not push the clock ahead
+                self._vtime = start
+            future.set_result(None)
+        self._prune_finish()
+
+    def retag(self, old: Tenant, new: Tenant) -> None:
+        """Requeue `old`'s waiting calls as `new`'s (an adopted speculation
+        now serves a real request, so it leaves the background tier)."""
+        waiters = []
+        for entry in self._waiters:
+            if entry[3] == old and not entry[5].done():
+                _, _, seq, _, cost, future = entry
+                start = max(self._vtime, self._finish.get(new.queue, 0.0))
+                self._finish[new.queue] = start + cost / new.weight
+                entry = (new.background, start, seq, new, cost, future)
+            waiters.append(entry)
+        heapq.heapify(waiters)
+        self._waiters = waiters
+
+    def _prune_finish(self) -> None:
+        # Tenants whose finish tag is behind the clock restart from it anyway
+        self._finish = {k: f for k, f in self._finish.items() if f > self._vtime}
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "tokens": round(self.available(), 2),
+            "queued": self.queued,
+            "tenants": {
+                _pseudonym(queue): depth
+                for queue, depth in sorted(self._depth.items(), key=lambda kv: -kv[1])
+            },
+        }
+
+
+# Metrics name tenants by keyed hash: stable within a process, but no
+# client IPs or Telegram ids
+_PSEUDONYM_KEY = secrets.token_bytes(16)
+
+
+def _pseudonym(queue: str) -> str:
+    """Queue "user:42/user" → "user/3f9a0c1d2b7e": the tier stays readable."""
+    key, _, tier = queue.rpartition("/")
+    digest = hashlib.blake2b(key.encode(), key=_PSEUDONYM_KEY, digest_size=6).hexdigest()
+    return f"{tier}/{digest}"
 
 
 rpm_limiter = TokenBucket(rate_per_minute=50)
@@ -115,73 +399,59 @@ rpm_limiter = TokenBucket(rate_per_minute=50)
 # Core LLM call
 # ---------------------------------------------------------------------------
 
-async def call_claude(
+async def _request_tool_output(
     system_text: str,
-    user_message: str | list[dict],
+    user_content: str | list[dict],
     output_schema: dict,
-    schema_name: str = "result",
-    max_tokens: int = MAX_TOKENS,
-    label: str | None = None,
-    web_search: bool = False,
+    schema_name: str,
+    max_tokens: int,
+    log_label: str,
+    web_search: int,
 ) -> dict:
-    """Call Claude with structured output via tool_use pattern.
-
-    user_message can be a plain string or a list of content blocks
-    (dicts with "type", "text", and optional "cache_control").
-
-    schema_name — tool name in the API request (must be stable for caching).
-    label — display name for logs (defaults to schema_name).
-    web_search — if True, enable server-side web search tool (Claude searches the web).
-    """
-    log_label = label or schema_name
+    """Single Messages API round trip; returns the raw tool_use input."""
+    note_llm_call()
     await rpm_limiter.acquire()
+    async with _pool_slot(log_label):
+        return await _send_tool_request(
+            system_text, user_content, output_schema, schema_name,
+            max_tokens, log_label, web_search,
+        )
 
-    logger.info(f">>> [{log_label}] Sending request to {MODEL}{'  [+web_search]' if web_search else ''}...")
-    t0 = time.monotonic()
-
-    user_content = user_message if isinstance(user_message, list) else user_message
-
-    tools: list[dict] = []
-    if web_search:
-        tools.append({
-            "type": "web_search_20250305",
-            "name": "web_search",
-            "max_uses": 3,
-            "user_location": {
-                "type": "approximate",
-                "country": "RU",
-            },
-        })
-    tools.append({
-        "name": schema_name,
-        "description": "Return the structured analysis result",
-        "input_schema": output_schema,
-        "cache_control": {"type": "ephemeral"},
-    })
-
-    response = await client.messages.create(
-        model=MODEL,
-        max_tokens=max_tokens,
-        system=[
-            {
-                "type": "text",
-                "text": system_text,
-                "cache_control": {"type": "ephemeral"},
-            }
-        ],
-        messages=[{"role": "user", "content": user_content}],
-        tools=tools,
-        tool_choice={"type": "tool", "name": schema_name},
-    )
 
-    elapsed = time.monotonic() - t0
+@contextlib.asynccontextmanager
+async def _pool_slot(log_label: str):
+    """Hold one of LLM_CONCURRENCY connection slots; records pool wait time."""
+    t0 = time.monotonic()
+    async with _llm_slots:
+        wait = time.monotonic() - t0
+        _pool_stats["acquired"] += 1
+        _pool_stats["wait_total"] += wait
+        _pool_stats["wait_max"] = max(_pool_stats["wait_max"], wait)
+        if wait > 0.01:
+            _pool_stats["waited"] += 1
+            logger.info(f"... [{log_label}] waited {wait:.2f}s for a pool connection")
+        _pool_stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            _pool_stats["in_flight"] -= 1
+
+
+def _content_chars(user_content: str | list[dict]) -> int:
+    if isinstance(user_content, str):
+        return len(user_content)
+    return sum(len(block.get("text", "")) for block in user_content)
+
+
+def _record_usage(response, model: str, elapsed: float, max_tokens: int, log_label: str, note: str = "") -> None:
+    """Account a finished response (session totals, ledger, log); raise if truncated."""
     usage = response.usage
 
     inp = getattr(usage, "input_tokens", 0) or 0
     out = getattr(usage, "output_tokens", 0) or 0
     cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
     cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
-    cost = _calc_cost(usage)
+    cost = _calc_cost(usage, model)
 
     _session_totals["input"] += inp
     _session_totals["output"] += out
@@ -189,13 +459,14 @@ async def call_claude(
     _session_totals["cache_write"] += cache_write
     _session_totals["cost"] += cost
     _session_totals["calls"] += 1
+    ledger.record(inp, out, cache_read, cache_write, cost)
 
     # Log web search usage if present
     web_searches = getattr(getattr(usage, "server_tool_use", None), "web_search_requests", 0) or 0
     web_suffix = f" web_searches={web_searches}" if web_searches else ""
 
     logger.info(
-        f"<<< [{log_label}] {elapsed:.1f}s | "
+        f"<<< [{log_label}] {elapsed:.1f}s{note} | "
         f"in={inp} out={out} cache_read={cache_read} cache_write={cache_write}{web_suffix} | "
         f"${cost:.4f} (session: ${_session_totals['cost']:.4f}, {_session_totals['calls']} calls)"
     )
@@ -207,28 +478,246 @@ async def call_claude(
             "Попробуйте загрузить резюме покороче или повторите попытку."
         )
 
+
+def _record_cut_off(model: str, input_chars: int, output_chars: int, elapsed: float, log_label: str) -> None:
+    """Account a stream closed before its final message, from text sizes:
+    the API reports no usage for it, but the tokens were generated."""
+    usage = SimpleNamespace(
+        input_tokens=input_chars // ESTIMATE_CHARS_PER_TOKEN + 1,
+        output_tokens=output_chars // ESTIMATE_CHARS_PER_TOKEN + 1,
+    )
+    response = SimpleNamespace(usage=usage, stop_reason=None)
+    _record_usage(response, model, elapsed, 0, log_label, note=" (cut off, estimated)")
+
+
+async def _send_tool_request(
+    system_text: str,
+    user_content: str | list[dict],
+    output_schema: dict,
+    schema_name: str,
+    max_tokens: int,
+    log_label: str,
+    web_search: int,
+) -> dict:
+    input_chars = len(system_text) + _content_chars(user_content)
+    model = model_router.choose(schema_name, input_chars)
+    logger.info(f">>> [{log_label}] Sending request to {model}{'  [+web_search]' if web_search else ''}...")
+    t0 = time.monotonic()
+
+    tools: list[dict] = []
+    if web_search:
+        tools.append({
+            "type": "web_search_20250305",
+            "name": "web_search",
+            "max_uses": web_search,
+            "user_location": {
+                "type": "approximate",
+                "country": MARKET_REGION,
+            },
+        })
+    tools.append({
+        "name": schema_name,
+        "description": "Return the structured analysis result",
+        "input_schema": output_schema,
+        "cache_control": {"type": "ephemeral"},
+    })
+
+    try:
+        response = await get_client().messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            system=[
+                {
+                    "type": "text",
+                    "text": system_text,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            messages=[{"role": "user", "content": user_content}],
+            tools=tools,
+            tool_choice={"type": "tool", "name": schema_name},
+            timeout=_step_timeout(schema_name),
+        )
+    except Exception:
+        model_router.record(model, schema_name, input_chars, time.monotonic() - t0, ok=False)
+        raise
+
+    elapsed = time.monotonic() - t0
+    model_router.record(model, schema_name, input_chars, elapsed, ok=True)
+    _record_usage(response, model, elapsed, max_tokens, log_label)
+
     for block in response.content:
         if block.type == "tool_use":
             return block.input
     raise RuntimeError("No structured output returned by model")
 
 
+def _reask_content(user_message: str | list[dict], missing: list[str]) -> list[dict]:
+    """Original user content + a note asking only for the missing fields."""
+    blocks = (
+        list(user_message)
+        if isinstance(user_message, list)
+        else [{"type": "text", "text": user_message}]
+    )
+    blocks.append({
+        "type": "text",
+        "text": (
+            "В предыдущем ответе не хватило полей: "
+            f"{', '.join(missing)}. Верни ТОЛЬКО эти поля."
+        ),
+    })
+    return blocks
+
+
+async def call_claude(
+    system_text: str,
+    user_message: str | list[dict],
+    output_schema: dict,
+    schema_name: str = "result",
+    max_tokens: int = MAX_TOKENS,
+    label: str | None = None,
+    web_search: int = 0,
+) -> dict:
+    """Call Claude with structured output via tool_use pattern.
+
+    user_message can be a plain string or a list of content blocks
+    (dicts with "type", "text", and optional "cache_control").
+
+    schema_name — tool name in the API request (must be stable for caching).
+    label — display name for logs (defaults to schema_name).
+    web_search — max server-side web searches the model may run (0 = tool off).
+
+    The output is checked against the precompiled validator for
+    output_schema: slips are repaired locally, and required top-level
+    fields that are still missing are requested in one targeted re-ask.
+    """
+    log_label = label or schema_name
+    validator = get_validator(output_schema)
+
+    payload = await _request_tool_output(
+        system_text, user_message, output_schema, schema_name,
+        max_tokens, log_label, web_search,
+    )
+    result, missing = validator.validate(payload, log_label)
+    if not missing:
+        return result
+
+    logger.warning(f"!!! [{log_label}] Missing fields {missing}, re-asking for them only")
+    patch = await _request_tool_output(
+        system_text,
+        _reask_content(user_message, missing),
+        validator.subschema(missing),
+        schema_name,
+        max_tokens,
+        f"{log_label}_reask",
+        False,
+    )
+    patch, still_missing = validator.validate(patch, f"{log_label}_reask", only=missing)
+    if still_missing:
+        raise RuntimeError(
+            f"Модель не вернула обязательные поля ({', '.join(still_missing)}) "
+            f"на шаге «{log_label}». Повторите попытку."
+        )
+    result.update(patch)
+    return result
+
+
+async def stream_text(
+    system_text: str,
+    user_content: str | list[dict],
+    schema_name: str,
+    max_tokens: int = MAX_TOKENS,
+    label: str | None = None,
+) -> AsyncIterator[str]:
+    """Plain-text answer, yielded as it is generated (no tool, no schema).
+
+    Goes through the same limiter, pool, router and accounting as
+    call_claude. Closing the iterator early closes the HTTP stream, so a
+    cancelled consumer stops generation. The API reports no usage for a
+    cut-off stream; it is charged an estimate from the prompt size and
+    the text yielded so far.
+    """
+    log_label = label or schema_name
+    note_llm_call()
+    await rpm_limiter.acquire()
+    async with _pool_slot(log_label):
+        input_chars = len(system_text) + _content_chars(user_content)
+        model = model_router.choose(schema_name, input_chars)
+        logger.info(f">>> [{log_label}] Streaming from {model}...")
+        t0 = time.monotonic()
+        first_token = None
+        output_chars = 0
+        try:
+            async with get_client().messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=[
+                    {
+                        "type": "text",
+                        "text": system_text,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ],
+                messages=[{"role": "user", "content": user_content}],
+                timeout=_step_timeout(schema_name),
+            ) as stream:
+                async for text in stream.text_stream:
+                    if first_token is None:
+                        first_token = time.monotonic() - t0
+                    output_chars += len(text)
+                    yield text
+                response = await stream.get_final_message()
+        except (asyncio.CancelledError, GeneratorExit):
+            elapsed = time.monotonic() - t0
+            logger.info(f"... [{log_label}] stream cancelled after {elapsed:.1f}s")
+            _record_cut_off(model, input_chars, output_chars, elapsed, log_label)
+            raise
+        except Exception:
+            model_router.record(model, schema_name, input_chars, time.monotonic() - t0, ok=False)
+            raise
+
+        elapsed = time.monotonic() - t0
+        model_router.record(model, schema_name, input_chars, elapsed, ok=True)
+        ttft = f" (first token {first_token:.2f}s)" if first_token is not None else ""
+        _record_usage(response, model, elapsed, max_tokens, log_label, note=ttft)
+
+
 # ---------------------------------------------------------------------------
 # Pipeline step functions
 # ---------------------------------------------------------------------------
 
 async def run_parse(resume_text: str) -> dict:
-    """Parse resume: split into sections + classify type + red_flags."""
-    return await call_claude(
-        PARSE_SYSTEM, resume_text, PARSE_SCHEMA, "parse"
-    )
+    """Parse resume: split into sections + classify type + red_flags.
 
+    When the local segmenter is confident, the model only classifies and
+    the blocks come from segmenter.py. Otherwise the model returns block
+    anchors and full_text is sliced from resume_text. key_skills are
+    cross-checked against the local skill dictionary.
+    """
+    seg = segment(resume_text)
+    if seg.confidence >= SEGMENTER_MIN_CONFIDENCE:
+        logger.info(f"... [parse] segmenter: {len(seg.sections)} blocks, confidence {seg.confidence}")
+        blocks = "\n".join(
+            f"{s['block_id']}. {s['section_title']} ({s['period']})" for s in seg.sections
+        )
+        result = await call_claude(
+            PARSE_CLASSIFY_SYSTEM,
+            f"{resume_text}\n\n---\nБлоки опыта:\n{blocks}",
+            PARSE_CLASSIFY_SCHEMA,
+            "parse_classify",
+        )
+        result["sections"] = seg.sections
+    else:
+        result = await call_claude(
+            PARSE_SYSTEM, resume_text, PARSE_SCHEMA, "parse"
+        )
+        result["sections"] = locate_sections(resume_text, result["sections"])
+    result["key_skills"] = skill_index.cross_check(result.get("key_skills"), resume_text)
+    return result
 
-async def run_scoring(resume_text: str) -> dict:
-    """Run scoring: 10 dimensions + server-computed total_score and grade."""
-    result = await call_claude(
-        SCORING_SYSTEM, resume_text, SCORING_SCHEMA, "scoring"
-    )
+
+def _derive_grade(result: dict) -> dict:
+    """Server-computed total_score and grade from the 10 dimensions."""
     # Compute total_score from dimensions (model tends to hallucinate a fixed number)
     total = sum(d.get("score", 0) for d in result.get("dimensions", []))
     result["total_score"] = total
@@ -246,6 +735,29 @@ async def run_scoring(resume_text: str) -> dict:
     return result
 
 
+async def run_scoring(resume_text: str) -> dict:
+    """Run scoring: 10 dimensions + server-computed total_score and grade."""
+    result = await call_claude(
+        SCORING_SYSTEM, resume_text, SCORING_SCHEMA, "scoring"
+    )
+    return _derive_grade(result)
+
+
+async def run_parse_scoring(resume_text: str) -> tuple[dict, dict]:
+    """Parse and scoring in one call: one round trip, the resume sent once.
+
+    Returns (parse_result, scoring) shaped exactly like run_parse and
+    run_scoring results.
+    """
+    result = await call_claude(
+        PARSE_SCORING_SYSTEM, resume_text, PARSE_SCORING_SCHEMA, "parse_scoring"
+    )
+    scoring = {k: result.pop(k) for k in SCORING_SCHEMA["properties"]}
+    result["sections"] = locate_sections(resume_text, result["sections"])
+    result["key_skills"] = skill_index.cross_check(result.get("key_skills"), resume_text)
+    return result, _derive_grade(scoring)
+
+
 async def _annotate_section(section: dict, resume_text: str) -> dict:
     """Annotate a single experience section: weaknesses/strengths."""
     block_id = section["block_id"]
@@ -276,17 +788,32 @@ async def _annotate_section(section: dict, resume_text: str) -> dict:
     return {**section, "annotations": result.get("annotations", [])}
 
 
-async def run_annotate(sections: list[dict], resume_text: str) -> list[dict]:
-    """Annotate all sections in parallel. First call primes the cache, rest follow."""
+async def _notify(coro: Awaitable[dict], callback: ResultCallback | None) -> dict:
+    """Await a fan-out call and report its result as soon as it lands."""
+    result = await coro
+    if callback is not None:
+        callback(result)
+    return result
+
+
+async def run_annotate(
+    sections: list[dict],
+    resume_text: str,
+    on_section: ResultCallback | None = None,
+) -> list[dict]:
+    """Annotate all sections in parallel. First call primes the cache, rest follow.
+
+    on_section — called with each annotated section the moment it is ready.
+    """
     if not sections:
         return []
     # Fire first call to populate prompt cache
-    first = await _annotate_section(sections[0], resume_text)
+    first = await _notify(_annotate_section(sections[0], resume_text), on_section)
     if len(sections) == 1:
         return [first]
     # Remaining calls hit the cached prefix
     remaining = await asyncio.gather(
-        *[_annotate_section(s, resume_text) for s in sections[1:]]
+        *[_notify(_annotate_section(s, resume_text), on_section) for s in sections[1:]]
     )
     return [first] + list(remaining)
 
@@ -294,6 +821,8 @@ async def run_annotate(sections: list[dict], resume_text: str) -> list[dict]:
 async def run_roles(resume_text: str, analysis: dict, key_skills: dict | None = None) -> dict:
     skills_part = ""
     if key_skills:
+        # Canonical names: tasks parsed before a dictionary update still match
+        key_skills = skill_index.normalize(key_skills)
         skills_part = (
             f"\n\nНавыки кандидата:\n"
             f"Hard skills: {', '.join(key_skills.get('hard_skills', []))}\n"
@@ -305,9 +834,21 @@ async def run_roles(resume_text: str, analysis: dict, key_skills: dict | None =
         f"Результат анализа:\n"
         f"Тип резюме: {analysis['resume_type']}\n"
         f"Главная проблема: {analysis['main_problem']}\n"
-        f"Red flags: {json.dumps(analysis['red_flags'], ensure_ascii=False)}"
+        f"Red flags: {dumps(analysis['red_flags'])}"
         f"{skills_part}"
     )
+    # Market facts for roles other users' searches already found
+    known = role_market.lookup(
+        [s.get("section_title", "") for s in analysis.get("sections", [])],
+        (key_skills or {}).get("hard_skills", []),
+        MARKET_REGION,
+    )
+    if known:
+        analysis_part += (
+            "\n\n---\n\nСправка по рынку (уже найдено в вакансиях, актуально — "
+            "не ищи эти роли повторно, ищи только роли, которых здесь нет):\n"
+            f"{dumps(known)}"
+        )
     user_blocks = [
         {
             "type": "text",
@@ -321,11 +862,12 @@ async def run_roles(resume_text: str, analysis: dict, key_skills: dict | None =
     ]
     result = await call_claude(
         ROLES_SYSTEM, user_blocks, ROLES_SCHEMA, "roles",
-        web_search=True,
+        web_search=max(1, ROLES_WEB_SEARCHES - len(known)),
     )
+    role_market.store(result.get("roles", []), MARKET_REGION, injected=known)
 
-    # Safety: ensure recommendation exists (model may omit it)
-    if "recommendation" not in result or not result["recommendation"]:
+    # Safety: ensure recommendation names a role (model may leave it blank)
+    if not result["recommendation"].get("primary_role"):
         roles = result.get("roles", [])
         best = roles[0]["role"] if roles else ""
         result["recommendation"] = {"primary_role": best, "reasoning": ""}
@@ -333,31 +875,51 @@ async def run_roles(resume_text: str, analysis: dict, key_skills: dict | None =
     return result
 
 
+@functools.lru_cache(maxsize=64)
+def _rewrite_shared_prefix(
+    resume_text: str,
+    selected_role: str,
+    role_json: str,
+    resume_type: str,
+    main_problem: str,
+    gender: str,
+) -> str:
+    """Context shared by every block of a rewrite — built once, not per block."""
+    # Resume text included to exceed 2048 token minimum for Haiku caching
+    gender_label = "женский" if gender == "female" else "мужской"
+    return (
+        f"Оригинальное резюме:\n{resume_text}\n\n---\n\n"
+        f"Целевая роль: {selected_role}\n\n"
+        f"Контекст роли:\n"
+        f"{role_json}\n\n"
+        f"Тип резюме: {resume_type}\n"
+        f"Главная проблема: {main_problem}\n"
+        f"Пол кандидата: {gender_label} (используй соответствующий род глаголов!)"
+    )
+
+
 async def _rewrite_block(
     section: dict,
     selected_role: str,
-    role_details: dict,
+    role_json: str,
     analysis_context: dict,
     resume_text: str,
 ) -> dict:
-    """Rewrite a single experience block."""
+    """Rewrite a single experience block.
+
+    role_json — role details serialized once per rewrite by run_rewrite.
+    """
     block_id = section["block_id"]
-    annotations_json = json.dumps(
-        section.get("annotations", []), ensure_ascii=False
-    )
+    annotations_json = dumps(section.get("annotations", []))
 
     # Cached part: shared context (same for all blocks → cache hit)
-    # Resume text included to exceed 2048 token minimum for Haiku caching
-    gender = analysis_context.get("gender", "male")
-    gender_label = "женский" if gender == "female" else "мужской"
-    cached_part = (
-        f"Оригинальное резюме:\n{resume_text}\n\n---\n\n"
-        f"Целевая роль: {selected_role}\n\n"
-        f"Контекст роли:\n"
-        f"{json.dumps(role_details, ensure_ascii=False)}\n\n"
-        f"Тип резюме: {analysis_context.get('resume_type', '')}\n"
-        f"Главная проблема: {analysis_context.get('main_problem', '')}\n"
-        f"Пол кандидата: {gender_label} (используй соответствующий род глаголов!)"
+    cached_part = _rewrite_shared_prefix(
+        resume_text,
+        selected_role,
+        role_json,
+        analysis_context.get("resume_type", ""),
+        analysis_context.get("main_problem", ""),
+        analysis_context.get("gender", "male"),
     )
 
     # Variable part: this specific block
@@ -381,7 +943,7 @@ async def _rewrite_block(
         },
     ]
 
-    return await call_claude(
+    result = await call_claude(
         REWRITE_BLOCK_SYSTEM,
         user_blocks,
         REWRITE_BLOCK_SCHEMA,
@@ -389,16 +951,35 @@ async def _rewrite_block(
         max_tokens=4096,
         label=f"rewrite_block_{block_id}",
     )
+    # Persisted/resumed blocks are matched by block_id — don't trust the echo
+    result["block_id"] = block_id
+    return result
+
+
+async def _rewrite_block_with_retry(section: dict, *args) -> dict:
+    """_rewrite_block with per-block retries and exponential backoff."""
+    for attempt in range(REWRITE_BLOCK_RETRIES + 1):
+        try:
+            return await _rewrite_block(section, *args)
+        except Exception as e:
+            if attempt == REWRITE_BLOCK_RETRIES:
+                raise
+            delay = RETRY_BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random())
+            logger.warning(
+                f"!!! [rewrite_block_{section['block_id']}] attempt {attempt + 1} failed "
+                f"({e}), retrying in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
 
 
 async def _rewrite_meta(
     resume_text: str,
     rewritten_blocks: list[dict],
     selected_role: str,
-    role_details: dict,
+    role_json: str,
 ) -> dict:
     """Generate summary, skills, recommendations from all rewritten blocks."""
-    blocks_json = json.dumps(rewritten_blocks, ensure_ascii=False)
+    blocks_json = dumps(rewritten_blocks)
 
     # Resume first with cache_control — stable across role changes,
     # second call reuses cached prefix (~15K tokens saved)
@@ -413,7 +994,7 @@ async def _rewrite_meta(
             "text": (
                 f"Целевая роль: {selected_role}\n\n"
                 f"Контекст роли:\n"
-                f"{json.dumps(role_details, ensure_ascii=False)}\n\n"
+                f"{role_json}\n\n"
                 f"Переписанные блоки опыта:\n{blocks_json}"
             ),
         },
@@ -429,25 +1010,7 @@ async def _rewrite_meta(
 
 
 def _sanitize_block(block: dict) -> None:
-    """Ensure rewritten_bullets and highlights are proper arrays."""
-    # Model sometimes returns rewritten_bullets as a string instead of array
-    rb = block.get("rewritten_bullets", [])
-    if isinstance(rb, str):
-        logger.warning(
-            f"Block {block.get('block_id')}: rewritten_bullets is a string "
-            f"({len(rb)} chars), splitting by newlines."
-        )
-        block["rewritten_bullets"] = [
-            line.lstrip("•-– ").strip()
-            for line in rb.split("\n")
-            if line.strip()
-        ]
-
-    hl = block.get("highlights", [])
-    if isinstance(hl, str):
-        logger.warning(f"Block {block.get('block_id')}: highlights is a string, resetting.")
-        block["highlights"] = []
-
+    """Align highlights with rewritten_bullets (types are fixed by the validator)."""
     # Pad/trim highlights to match rewritten_bullets length
     rb_len = len(block.get("rewritten_bullets", []))
     highlights = block.get("highlights", [])
@@ -467,17 +1030,38 @@ def _sanitize_block(block: dict) -> None:
 
 
 async def run_rewrite(
-    resume_text: str, analysis: dict, roles: dict, selected_role: str
+    resume_text: str,
+    analysis: dict,
+    roles: dict,
+    selected_role: str,
+    on_block: ResultCallback | None = None,
+    on_meta: ResultCallback | None = None,
+    done_blocks: list[dict] | None = None,
 ) -> dict:
-    """Rewrite resume: parallel per-block calls, then meta call."""
+    """Rewrite resume: parallel per-block calls, then meta call.
+
+    on_block — called with each sanitized rewritten block as it lands
+    (persist it there: a later failure does not lose finished blocks).
+    on_meta — called with the meta result (summary, skills, recommendations).
+    done_blocks — blocks already rewritten for this role by an earlier,
+    partially failed run; only the missing ones are recomputed.
+    """
+
+    def block_done(block: dict) -> None:
+        _sanitize_block(block)
+        if on_block is not None:
+            on_block(block)
+
     sections = analysis.get("sections", [])
+    done = {b["block_id"]: b for b in (done_blocks or [])}
 
-    # Find matching role details
+    # Find matching role details; serialized once for all block + meta calls
     role_details = {}
     for r in roles.get("roles", []):
         if r["role"] == selected_role:
             role_details = r
             break
+    role_json = dumps(role_details)
 
     analysis_context = {
         "resume_type": analysis.get("resume_type", ""),
@@ -485,40 +1069,39 @@ async def run_rewrite(
         "gender": analysis.get("gender", "male"),
     }
 
-    # Phase 1: rewrite blocks — first call primes cache, rest follow
-    if not sections:
-        rewritten_blocks = []
-    elif len(sections) == 1:
-        rewritten_blocks = [await _rewrite_block(
-            sections[0], selected_role, role_details, analysis_context, resume_text
-        )]
-    else:
-        # First call populates prompt cache
-        first = await _rewrite_block(
-            sections[0], selected_role, role_details, analysis_context, resume_text
-        )
-        # Remaining calls hit cached prefix
-        remaining = await asyncio.gather(
-            *[_rewrite_block(s, selected_role, role_details, analysis_context, resume_text)
-              for s in sections[1:]],
-            return_exceptions=True,
+    def rewrite(section: dict) -> Awaitable[dict]:
+        return _notify(_rewrite_block_with_retry(
+            section, selected_role, role_json, analysis_context, resume_text
+        ), block_done)
+
+    # Phase 1: rewrite blocks not done yet — first call primes cache, rest follow
+    pending = [s for s in sections if s["block_id"] not in done]
+    if pending:
+        logger.info(
+            f"rewrite: {len(pending)} block(s) to rewrite, {len(done)} resumed"
         )
-        errors = [r for r in remaining if isinstance(r, Exception)]
-        if errors:
-            raise RuntimeError(
-                f"Не удалось переписать {len(errors)} блок(ов): {errors[0]}"
-            )
-        rewritten_blocks = sorted(
-            [first] + list(remaining), key=lambda b: b.get("block_id", 0)
+    results: list[dict | BaseException] = []
+    if pending and not done:
+        # First call populates prompt cache
+        results.append(await rewrite(pending[0]))
+        pending = pending[1:]
+    # Remaining calls hit cached prefix
+    results += await asyncio.gather(
+        *[rewrite(s) for s in pending], return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise RuntimeError(
+            f"Не удалось переписать {len(errors)} блок(ов): {errors[0]}"
         )
-
-    # Sanitize + validate highlights alignment
-    for block in rewritten_blocks:
-        _sanitize_block(block)
+    rewritten_blocks = sorted(
+        list(done.values()) + results, key=lambda b: b.get("block_id", 0)
+    )
 
     # Phase 2: generate meta (summary, skills, recommendations)
-    meta = await _rewrite_meta(
-        resume_text, rewritten_blocks, selected_role, role_details
+    meta = await _notify(
+        _rewrite_meta(resume_text, rewritten_blocks, selected_role, role_json),
+        on_meta,
     )
 
     # Assemble into the same RewriteResult shape
@@ -531,28 +1114,44 @@ async def run_rewrite(
     }
 
 
-async def run_regenerate_bullet(
+def _regenerate_prefix(resume_text: str, role: str, gender: str) -> str:
+    """Context shared by every regenerate of a task — the cacheable part."""
+    # Resume text included to exceed 2048 token minimum for Haiku caching
+    gender_label = "женский" if gender == "female" else "мужской"
+    return (
+        f"Оригинальное резюме:\n{resume_text}\n\n---\n\n"
+        f"Целевая роль: {role}\n"
+        f"Пол кандидата: {gender_label}"
+    )
+
+
+def stream_regenerate_bullet(
     full_bullet: str,
     selected_text: str,
     user_comment: str,
     role: str,
     gender: str = "male",
-) -> dict:
-    """Regenerate a single bullet based on user's selection and comment."""
-    gender_label = "женский" if gender == "female" else "мужской"
-    user_msg = (
-        f"Целевая роль: {role}\n"
-        f"Пол кандидата: {gender_label}\n\n"
-        f"Полный буллет:\n{full_bullet}\n\n"
-        f"Выделенный фрагмент:\n{selected_text}\n\n"
-        f"Комментарий пользователя:\n{user_comment}"
-    )
-    return await call_claude(
-        REGENERATE_BULLET_SYSTEM,
-        user_msg,
-        REGENERATE_BULLET_SCHEMA,
-        "regenerate_bullet",
-        max_tokens=1024,
+    resume_text: str = "",
+) -> AsyncIterator[str]:
+    """Regenerate a single bullet; yields the new bullet text as it is written."""
+    user_blocks = [
+        {
+            "type": "text",
+            "text": _regenerate_prefix(resume_text, role, gender),
+            "cache_control": {"type": "ephemeral"},
+        },
+        {
+            "type": "text",
+            "text": (
+                f"---\n\n"
+                f"Полный буллет:\n{full_bullet}\n\n"
+                f"Выделенный фрагмент:\n{selected_text}\n\n"
+                f"Комментарий пользователя:\n{user_comment}"
+            ),
+        },
+    ]
+    return stream_text(
+        REGENERATE_BULLET_SYSTEM, user_blocks, "regenerate_bullet", max_tokens=1024
     )
 
 
@@ -569,8 +1168,8 @@ async def run_recheck(
 
     user_msg = RECHECK_USER_TEMPLATE.format(
         updated_resume=updated_resume,
-        previous_annotations_json=json.dumps(annotations, ensure_ascii=False),
-        previous_blockers_json=json.dumps([], ensure_ascii=False),
+        previous_annotations_json=dumps(annotations),
+        previous_blockers_json=dumps([]),
         previous_score=previous_score,
     )
     return await call_claude(RECHECK_SYSTEM, user_msg, RECHECK_SCHEMA, "recheck")
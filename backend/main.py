@@ -1,18 +1,106 @@
 """Resume Screener — FastAPI backend."""
 
+import asyncio
+import copy
 import hashlib
+from contextlib import asynccontextmanager
+from typing import Callable
 
-from fastapi import Depends, FastAPI, File, HTTPException, Response, UploadFile
+from fastapi import Depends, FastAPI, File, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from auth import get_current_user, verify_telegram_auth
-from llm import run_annotate, run_parse, run_recheck, run_regenerate_bullet, run_rewrite, run_roles, run_scoring
+from admission import AdmissionController, Overloaded
+from auth import bind_tenant, get_current_user, require_metrics_token, verify_telegram_auth
+from disconnect import ClientDisconnected, disconnects, until_disconnect
+from events import format_sse, task_events
+from http_cache import etag_matches, make_etag, negotiate_encoding, task_payloads
+from idempotency import IdempotencyMiddleware, idempotency_store
+from jsonutil import ORJSONResponse, dumpb
+from ledger import BudgetExceeded, bind_task, ledger, limits
+from llm import (
+    FUSED_PARSE_SCORING,
+    close_client,
+    init as init_llm,
+    llm_stats,
+    run_annotate,
+    run_parse,
+    run_parse_scoring,
+    run_recheck,
+    run_rewrite,
+    run_roles,
+    run_scoring,
+    rpm_limiter,
+    stream_regenerate_bullet,
+)
 from parsers import parse_file
+from sessions import SESSION_TTL, session_tokens
+from speculation import SPECULATIVE_REWRITE, speculative
 from storage import storage
+from supersede import regenerations
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_llm()
+    yield
+    ledger.flush()
+    await close_client()
+
+
+async def bind_usage(request: Request) -> None:
+    """App-wide dependency: charge LLM usage to the task in the path."""
+    bind_task(request.path_params.get("task_id"))
+
+
+# Task/LLM endpoints return ORJSONResponse directly: it skips the
+# jsonable_encoder walk, which costs more than the serialization itself.
+app = FastAPI(
+    title="Resume Screener API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    dependencies=[Depends(bind_tenant), Depends(bind_usage)],
+)
 
-app = FastAPI(title="Resume Screener API")
+admission = AdmissionController(rpm_limiter, precheck=ledger.check)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return ORJSONResponse(
+        {
+            "detail": "Сервис перегружен, попробуйте через несколько секунд.",
+            "retryAfter": exc.retry_after,
+            "queuePosition": exc.queue_position,
+        },
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody reads it; 499 (nginx's "client closed request") keeps logs honest
+    return Response(status_code=499)
+
+
+@app.exception_handler(BudgetExceeded)
+async def budget_exceeded_handler(request: Request, exc: BudgetExceeded):
+    if exc.scope == "task":
+        detail = "Лимит запросов к модели для этого резюме исчерпан."
+    else:
+        detail = "Дневной лимит запросов к модели исчерпан, попробуйте завтра."
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return ORJSONResponse(
+        {"detail": detail, "scope": exc.scope, "limit": exc.limit},
+        status_code=429,
+        headers=headers,
+    )
 
+
+# Inside CORS, so replayed responses get CORS headers too
+app.add_middleware(IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
@@ -23,6 +111,7 @@ app.add_middleware(
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 ALLOWED_EXTENSIONS = {".pdf", ".docx", ".txt"}
+MAX_HISTORY_PAGE = 100
 
 
 # ---------------------------------------------------------------------------
@@ -31,6 +120,13 @@ ALLOWED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 
 class RewriteRequest(BaseModel):
     selectedRole: str
+    resume: bool = True  # reuse blocks saved by a failed run for the same role
+
+
+class SaveVersionRequest(BaseModel):
+    summary: str | None = None
+    bullets: list[list[str]] | None = None  # rewritten_bullets per experience
+    score: int | None = None  # recheck score of this text, if any
 
 
 class RegenerateRequest(BaseModel):
@@ -75,6 +171,51 @@ def _build_analysis(task: dict) -> dict | None:
     return result
 
 
+async def _run_parse_step(task_id: str, raw_text: str) -> dict:
+    """Parse the resume and store the result. In fused mode the same call
+    also scores it, so the following /score is served from the task."""
+    with admission.ticket(1):
+        try:
+            if FUSED_PARSE_SCORING:
+                parse_result, scoring = await run_parse_scoring(raw_text)
+            else:
+                parse_result, scoring = await run_parse(raw_text), None
+        except Exception as e:
+            raise HTTPException(500, f"LLM error: {e}")
+
+    if scoring is not None:
+        storage.update_task(task_id, parse_result=parse_result, scoring=scoring)
+    else:
+        storage.update_task(task_id, parse_result=parse_result)
+    return parse_result
+
+
+def _fanout_publisher(task_id: str, event: str, sections: list[dict]):
+    """Callback publishing each fan-out result with its block_id-order position."""
+    order = {
+        s.get("block_id"): i
+        for i, s in enumerate(sorted(sections, key=lambda s: s.get("block_id", 0)))
+    }
+
+    def publish(result: dict) -> None:
+        block_id = result.get("block_id")
+        task_events.publish(task_id, event, {
+            "block_id": block_id,
+            "position": order.get(block_id),
+            "total": len(sections),
+            "data": result,
+        })
+
+    return publish
+
+
+def _retry_of_unparsed(cached, user_id: int | None) -> bool:
+    """The same upload by the same owner left a task without a parse (e.g.
+    refused with 429): the retry parses that task instead of adding another
+    to the hash index and the user's history."""
+    return cached is not None and cached["parse_result"] is None and cached["user_id"] == user_id
+
+
 # ---------------------------------------------------------------------------
 # POST /api/analyze — upload file + parse (progressive step 1)
 # ---------------------------------------------------------------------------
@@ -96,37 +237,36 @@ async def analyze(file: UploadFile = File(...), user=Depends(get_current_user)):
     content_hash = hashlib.sha256(content).hexdigest()
     cached = storage.find_by_hash(content_hash)
     if cached and cached["parse_result"]:
-        return {
+        return ORJSONResponse({
             "taskId": cached["id"],
             "parse": cached["parse_result"],
             "cached": True,
-        }
-
-    # Parse text
-    try:
-        raw_text = parse_file(content, filename)
-    except Exception as e:
-        raise HTTPException(400, f"Failed to parse file: {e}")
+        })
 
-    if not raw_text.strip():
-        raise HTTPException(400, "File is empty or could not extract text.")
-
-    # Create task with hash
     user_id = user["tg_id"] if user else None
-    task_id = storage.create_task(filename, raw_text, content_hash=content_hash, user_id=user_id)
+    if _retry_of_unparsed(cached, user_id):
+        task_id, raw_text = cached["id"], cached["raw_text"]
+    else:
+        # Parse text
+        try:
+            raw_text = parse_file(content, filename)
+        except Exception as e:
+            raise HTTPException(400, f"Failed to parse file: {e}")
+
+        if not raw_text.strip():
+            raise HTTPException(400, "File is empty or could not extract text.")
+
+        # Create task with hash
+        task_id = storage.create_task(filename, raw_text, content_hash=content_hash, user_id=user_id)
+    bind_task(task_id)
 
     # Run parse only (sections + type + red_flags + main_problem)
-    try:
-        parse_result = await run_parse(raw_text)
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
+    parse_result = await _run_parse_step(task_id, raw_text)
 
-    storage.update_task(task_id, parse_result=parse_result)
-
-    return {
+    return ORJSONResponse({
         "taskId": task_id,
         "parse": parse_result,
-    }
+    })
 
 
 # ---------------------------------------------------------------------------
@@ -143,19 +283,23 @@ async def analyze_text(body: TextAnalyzeRequest, user=Depends(get_current_user))
     content_hash = hashlib.sha256(raw_text.encode()).hexdigest()
     cached = storage.find_by_hash(content_hash)
     if cached and cached["parse_result"]:
-        return {
+        return ORJSONResponse({
             "taskId": cached["id"],
             "parse": cached["parse_result"],
             "cached": True,
-        }
+        })
 
     user_id = user["tg_id"] if user else None
-    task_id = storage.create_task("pasted_text.txt", raw_text, content_hash=content_hash, user_id=user_id)
+    if _retry_of_unparsed(cached, user_id):
+        task_id = cached["id"]
+    else:
+        task_id = storage.create_task("pasted_text.txt", raw_text, content_hash=content_hash, user_id=user_id)
+    bind_task(task_id)
 
     # Return taskId immediately — parse will happen via /tasks/{id}/parse
-    return {
+    return ORJSONResponse({
         "taskId": task_id,
-    }
+    })
 
 
 # ---------------------------------------------------------------------------
@@ -170,18 +314,13 @@ async def parse(task_id: str):
 
     # Return cached if available
     if task["parse_result"] is not None:
-        return task["parse_result"]
+        return ORJSONResponse(task["parse_result"])
 
     if task["raw_text"] is None:
         raise HTTPException(400, "No resume text available")
 
-    try:
-        parse_result = await run_parse(task["raw_text"])
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
-
-    storage.update_task(task_id, parse_result=parse_result)
-    return parse_result
+    parse_result = await _run_parse_step(task_id, task["raw_text"])
+    return ORJSONResponse(parse_result)
 
 
 # ---------------------------------------------------------------------------
@@ -189,18 +328,87 @@ async def parse(task_id: str):
 # ---------------------------------------------------------------------------
 
 @app.get("/api/tasks/{task_id}")
-async def get_task(task_id: str):
+async def get_task(task_id: str, request: Request):
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
 
-    return {
-        "taskId": task["id"],
-        "parse": task["parse_result"],
-        "scoring": task["scoring"],
-        "annotations": task["annotations"],
-        "roles": task["roles"],
-    }
+    version = task["version"]
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+    def serialize() -> bytes:
+        return dumpb({
+            "taskId": task["id"],
+            "parse": task["parse_result"],
+            "scoring": task["scoring"],
+            "annotations": task["annotations"],
+            "roles": task["roles"],
+        })
+
+    if etag_matches(request.headers.get("if-none-match"), task_id, version):
+        # Small bodies go out as identity; the 304 must carry the same tag
+        encoding = task_payloads.encoding_for(task_id, version, encoding, serialize)
+        headers["ETag"] = make_etag(task_id, version, encoding)
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = task_payloads.get(task_id, version, encoding, serialize)
+    headers["ETag"] = make_etag(task_id, version, encoding)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# GET /api/tasks/{taskId}/events — SSE stream of fan-out results
+# ---------------------------------------------------------------------------
+
+@app.get("/api/tasks/{task_id}/events")
+async def events(task_id: str, request: Request, after: int = 0):
+    """Stream `section`, `block` and `rewrite_meta` events as they are produced.
+
+    Reconnecting clients resume via Last-Event-ID (or ?after=<id>).
+    """
+    if storage.get_task(task_id) is None:
+        raise HTTPException(404, "Task not found")
+
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def stream():
+        async for entry in task_events.subscribe(task_id, after):
+            if await request.is_disconnected():
+                break
+            yield format_sse(entry)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------------------------------------------------------------------------
+# GET /api/tasks/{taskId}/usage — LLM tokens and cost spent on the task
+# ---------------------------------------------------------------------------
+
+@app.get("/api/tasks/{task_id}/usage")
+async def task_usage(task_id: str):
+    if storage.get_task(task_id) is None:
+        raise HTTPException(404, "Task not found")
+
+    usage = ledger.task_usage(task_id)
+    budget = limits()
+    return ORJSONResponse({
+        "taskId": task_id,
+        "usage": usage,
+        "limits": budget,
+        "remaining": {
+            "task_usd": max(0.0, budget["task_usd"] - usage["cost"]) if budget["task_usd"] else None,
+            "task_calls": max(0, budget["task_calls"] - usage["calls"]) if budget["task_calls"] else None,
+        },
+    })
 
 
 # ---------------------------------------------------------------------------
@@ -215,18 +423,19 @@ async def score(task_id: str):
 
     # Return cached if available
     if task["scoring"] is not None:
-        return task["scoring"]
+        return ORJSONResponse(task["scoring"])
 
     if task["raw_text"] is None:
         raise HTTPException(400, "No resume text available")
 
-    try:
-        scoring = await run_scoring(task["raw_text"])
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
+    with admission.ticket(1):
+        try:
+            scoring = await run_scoring(task["raw_text"])
+        except Exception as e:
+            raise HTTPException(500, f"LLM error: {e}")
 
     storage.update_task(task_id, scoring=scoring)
-    return scoring
+    return ORJSONResponse(scoring)
 
 
 # ---------------------------------------------------------------------------
@@ -234,26 +443,38 @@ async def score(task_id: str):
 # ---------------------------------------------------------------------------
 
 @app.post("/api/tasks/{task_id}/annotate")
-async def annotate(task_id: str):
+async def annotate(task_id: str, request: Request):
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
 
     # Return cached if available
     if task["annotations"] is not None:
-        return {"sections": task["annotations"]}
+        return ORJSONResponse({"sections": task["annotations"]})
 
     if task["parse_result"] is None:
         raise HTTPException(400, "Parse not completed yet")
 
-    try:
-        sections = task["parse_result"]["sections"]
-        annotated_sections = await run_annotate(sections, task["raw_text"])
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
+    sections = task["parse_result"]["sections"]
+    with admission.ticket(len(sections)):
+        try:
+            annotated_sections = await until_disconnect(
+                request,
+                run_annotate(
+                    sections,
+                    task["raw_text"],
+                    on_section=_fanout_publisher(task_id, "section", sections),
+                ),
+                keep=lambda: task_events.watched(task_id),
+            )
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            task_events.publish(task_id, "error", {"step": "annotate", "detail": str(e)})
+            raise HTTPException(500, f"LLM error: {e}")
 
     storage.update_task(task_id, annotations=annotated_sections)
-    return {"sections": annotated_sections}
+    return ORJSONResponse({"sections": annotated_sections})
 
 
 # ---------------------------------------------------------------------------
@@ -261,14 +482,14 @@ async def annotate(task_id: str):
 # ---------------------------------------------------------------------------
 
 @app.get("/api/tasks/{task_id}/roles")
-async def get_roles(task_id: str):
+async def get_roles(task_id: str, request: Request):
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
 
     # Return cached if available
     if task["roles"] is not None:
-        return task["roles"]
+        return ORJSONResponse(task["roles"])
 
     if task["parse_result"] is None:
         raise HTTPException(400, "Parse not completed yet")
@@ -283,25 +504,107 @@ async def get_roles(task_id: str):
     if task["scoring"]:
         analysis_for_roles.update(task["scoring"])
 
-    try:
-        roles = await run_roles(
-            task["raw_text"],
-            analysis_for_roles,
-            key_skills=task["parse_result"].get("key_skills"),
-        )
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
+    with admission.ticket(1):
+        try:
+            roles = await until_disconnect(
+                request,
+                run_roles(
+                    task["raw_text"],
+                    analysis_for_roles,
+                    key_skills=task["parse_result"].get("key_skills"),
+                ),
+            )
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"LLM error: {e}")
 
     storage.update_task(task_id, roles=roles)
-    return roles
+    _maybe_speculate(task_id, task)
+    return ORJSONResponse(roles)
 
 
 # ---------------------------------------------------------------------------
 # POST /api/tasks/{taskId}/rewrite — repackage resume for selected role
 # ---------------------------------------------------------------------------
 
+def _rewrite_job(
+    task_id: str,
+    task,
+    analysis: dict,
+    role: str,
+    resume: bool = True,
+    publish: Callable[[], bool] = lambda: True,
+):
+    """(LLM calls still needed, coroutine running the rewrite for role).
+
+    Each finished block is saved to rewrite_partial so a failed or
+    cancelled run resumes from it; events go out while publish() is true.
+    """
+    partial = task["rewrite_partial"]
+    if not resume or partial is None or partial["role"] != role:
+        partial = {"role": role, "blocks": []}
+        storage.update_task(task_id, rewrite_partial=partial)
+
+    publish_block = _fanout_publisher(task_id, "block", analysis["sections"])
+
+    def on_block(block: dict) -> None:
+        nonlocal partial
+        partial = {**partial, "blocks": partial["blocks"] + [block]}
+        storage.update_task(task_id, rewrite_partial=partial)
+        if publish():
+            publish_block(block)
+
+    def on_meta(meta: dict) -> None:
+        if publish():
+            task_events.publish(task_id, "rewrite_meta", {"role": role, "data": meta})
+
+    async def run() -> dict:
+        try:
+            return await run_rewrite(
+                task["raw_text"],
+                analysis,
+                task["roles"],
+                role,
+                on_block=on_block,
+                on_meta=on_meta,
+                done_blocks=partial["blocks"],
+            )
+        except Exception as e:
+            e.saved_blocks = len(partial["blocks"])
+            raise
+
+    return len(analysis["sections"]) - len(partial["blocks"]) + 1, run()
+
+
+def _maybe_speculate(task_id: str, task) -> None:
+    """Pre-run the rewrite for the recommended role on spare capacity."""
+    if not SPECULATIVE_REWRITE or task["rewrite"] is not None:
+        return
+    role = (task["roles"].get("recommendation") or {}).get("primary_role")
+    analysis = _build_analysis(task)
+    if not role or analysis is None or task["annotations"] is None:
+        return
+    cost = len(analysis["sections"]) + 1
+    try:
+        ledger.check()
+    except BudgetExceeded:
+        speculative.skipped += 1
+        return
+    if admission.estimate_wait(cost) > 0:
+        speculative.skipped += 1
+        return
+
+    async def job(spec) -> dict:
+        cost, run = _rewrite_job(task_id, task, analysis, role, publish=lambda: spec.adopted)
+        with admission.ticket(cost):
+            return await run
+
+    speculative.start(task_id, role, job)
+
+
 @app.post("/api/tasks/{task_id}/rewrite")
-async def rewrite(task_id: str, body: RewriteRequest):
+async def rewrite(task_id: str, body: RewriteRequest, request: Request):
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
@@ -312,26 +615,141 @@ async def rewrite(task_id: str, body: RewriteRequest):
     if task["annotations"] is None:
         raise HTTPException(400, "Annotations not completed yet")
 
-    try:
-        result = await run_rewrite(
-            task["raw_text"],
-            analysis,
-            task["roles"],
-            body.selectedRole,
-        )
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
+    result = None
+    if not body.resume:
+        speculative.discard(task_id)
+    elif spec := speculative.take(task_id, body.selectedRole):
+        # Catch up on blocks the speculation finished before it was adopted
+        publish_block = _fanout_publisher(task_id, "block", analysis["sections"])
+        partial = task["rewrite_partial"]
+        if partial is not None and partial["role"] == body.selectedRole:
+            for block in partial["blocks"]:
+                publish_block(block)
+        try:
+            # Shielded: if this client leaves, the speculation runs on
+            result = await until_disconnect(request, asyncio.shield(spec.task))
+        except ClientDisconnected:
+            raise
+        except Exception:
+            pass  # fall through: the normal run resumes from saved blocks
+
+    if result is None:
+        # Blocks finished by an earlier failed run for this role are kept
+        cost, run = _rewrite_job(task_id, task, analysis, body.selectedRole, resume=body.resume)
+        with admission.ticket(cost):
+            try:
+                # Blocks finished before a disconnect stay in rewrite_partial
+                result = await until_disconnect(request, run, keep=lambda: task_events.watched(task_id))
+            except ClientDisconnected:
+                raise
+            except Exception as e:
+                task_events.publish(task_id, "error", {"step": "rewrite", "detail": str(e)})
+                saved = getattr(e, "saved_blocks", 0)
+                if saved:
+                    raise HTTPException(
+                        500,
+                        f"LLM error: {e}. Saved {saved} block(s) — retry to rewrite only the rest.",
+                    )
+                raise HTTPException(500, f"LLM error: {e}")
+
+    task["rewrite_versions"].append(result, "rewrite", role=body.selectedRole)
+    storage.update_task(
+        task_id, selected_role=body.selectedRole, rewrite=result, rewrite_partial=None
+    )
+    return ORJSONResponse(result)
+
+
+# ---------------------------------------------------------------------------
+# /api/tasks/{taskId}/versions — rewrite version history and rollback
+# ---------------------------------------------------------------------------
+
+def _versioned_task(task_id: str):
+    task = storage.get_task(task_id)
+    if task is None:
+        raise HTTPException(404, "Task not found")
+    versions = task["rewrite_versions"]
+    if versions.latest() is None:
+        raise HTTPException(400, "Rewrite not completed")
+    return task, versions
+
+
+def _save_version(task_id: str, task, rewrite: dict, source: str, score: int | None = None) -> dict:
+    n = task["rewrite_versions"].append(rewrite, source, role=task["selected_role"], score=score)
+    storage.update_task(task_id, rewrite=rewrite, rewrite_versions=task["rewrite_versions"])
+    return {"version": n, "rewrite": rewrite}
+
+
+@app.get("/api/tasks/{task_id}/versions")
+async def list_versions(task_id: str):
+    _, versions = _versioned_task(task_id)
+    return ORJSONResponse({"versions": versions.history()})
 
-    storage.update_task(task_id, selected_role=body.selectedRole, rewrite=result)
-    return result
+
+@app.get("/api/tasks/{task_id}/versions/{n}")
+async def get_version(task_id: str, n: int):
+    _, versions = _versioned_task(task_id)
+    try:
+        return ORJSONResponse(versions.get(n))
+    except KeyError:
+        raise HTTPException(404, "Version not found")
+
+
+@app.post("/api/tasks/{task_id}/versions")
+async def save_version(task_id: str, body: SaveVersionRequest):
+    """Save the user's edits of the latest version as a new version."""
+    task, versions = _versioned_task(task_id)
+    rewrite = copy.deepcopy(versions.latest())
+    if body.summary is not None:
+        rewrite["summary"] = body.summary
+    if body.bullets is not None:
+        experiences = rewrite.get("experiences", [])
+        if len(body.bullets) != len(experiences):
+            raise HTTPException(400, "Число блоков не совпадает с переупаковкой")
+        for block, bullets in zip(experiences, body.bullets):
+            block["rewritten_bullets"] = bullets
+    return ORJSONResponse(_save_version(task_id, task, rewrite, "edit", body.score))
+
+
+@app.post("/api/tasks/{task_id}/versions/{n}/restore")
+async def restore_version(task_id: str, n: int):
+    """Make version n current again (as a new version; no recheck)."""
+    task, versions = _versioned_task(task_id)
+    try:
+        rewrite = versions.get(n)
+    except KeyError:
+        raise HTTPException(404, "Version not found")
+    return ORJSONResponse(_save_version(task_id, task, rewrite, "restore"))
 
 
 # ---------------------------------------------------------------------------
 # POST /api/tasks/{taskId}/regenerate — regenerate a single bullet with AI
 # ---------------------------------------------------------------------------
 
+async def _admitted(cost: int, chunks):
+    """Hold an admission ticket for as long as `chunks` is producing, not
+    just until its first token: the stream keeps its pool slot till the end."""
+    with admission.ticket(cost):
+        async for chunk in chunks:
+            yield chunk
+
+
+async def _regenerate_events(first: tuple, queue: asyncio.Queue):
+    """(event, payload) items of one regenerate run, up to the terminal one."""
+    event = first
+    while True:
+        yield event
+        if event[0] != "delta":
+            return
+        event = await queue.get()
+
+
 @app.post("/api/tasks/{task_id}/regenerate")
-async def regenerate(task_id: str, body: RegenerateRequest):
+async def regenerate(task_id: str, body: RegenerateRequest, request: Request):
+    """Regenerate one bullet: JSON {new_bullet}, or with
+    Accept: text/event-stream `delta` events ({text}) and a final `done`
+    ({new_bullet}). A newer regenerate of the same bullet cancels this
+    one: `superseded` event, or 409 for JSON.
+    """
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
@@ -340,18 +758,72 @@ async def regenerate(task_id: str, body: RegenerateRequest):
     if task["parse_result"]:
         gender = task["parse_result"].get("gender", "male")
 
-    try:
-        result = await run_regenerate_bullet(
+    run, queue = regenerations.start(
+        (task_id, body.block_id, body.bullet_index),
+        _admitted(1, stream_regenerate_bullet(
             full_bullet=body.full_bullet,
             selected_text=body.selected_text,
             user_comment=body.user_comment,
             role=body.role,
             gender=gender,
+            resume_text=task["raw_text"],
+        )),
+    )
+    # Failures before the first token (admission included) still get a status code
+    try:
+        first = await until_disconnect(request, queue.get())
+    except BaseException:
+        run.cancel()
+        raise
+    if first[0] == "error":
+        if isinstance(first[1], (Overloaded, BudgetExceeded)):
+            raise first[1]
+        raise HTTPException(500, f"LLM error: {first[1]}")
+    if first[0] == "superseded":
+        raise HTTPException(409, "Запрос заменён более новым")
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def stream():
+            text = []
+            try:
+                seq = 0
+                async for kind, payload in _regenerate_events(first, queue):
+                    seq += 1
+                    if kind == "delta":
+                        text.append(payload)
+                        data = {"text": payload}
+                    elif kind == "done":
+                        data = {"new_bullet": "".join(text).strip()}
+                    elif kind == "error":
+                        data = {"detail": f"LLM error: {payload}"}
+                    else:
+                        data = {}
+                    yield format_sse({"id": seq, "event": kind, "data": data})
+            finally:
+                run.cancel()
+
+        return StreamingResponse(
+            stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
 
-    return result
+    async def collect() -> str:
+        text = []
+        async for kind, payload in _regenerate_events(first, queue):
+            if kind == "delta":
+                text.append(payload)
+            elif kind == "error":
+                raise HTTPException(500, f"LLM error: {payload}")
+            elif kind == "superseded":
+                raise HTTPException(409, "Запрос заменён более новым")
+        return "".join(text).strip()
+
+    try:
+        new_bullet = await until_disconnect(request, collect())
+    finally:
+        run.cancel()
+    return ORJSONResponse({"new_bullet": new_bullet})
 
 
 # ---------------------------------------------------------------------------
@@ -359,7 +831,7 @@ async def regenerate(task_id: str, body: RegenerateRequest):
 # ---------------------------------------------------------------------------
 
 @app.post("/api/tasks/{task_id}/recheck")
-async def recheck(task_id: str, body: RecheckRequest):
+async def recheck(task_id: str, body: RecheckRequest, request: Request):
     task = storage.get_task(task_id)
     if task is None:
         raise HTTPException(404, "Task not found")
@@ -372,20 +844,34 @@ async def recheck(task_id: str, body: RecheckRequest):
     if task["scoring"]:
         previous_score = task["scoring"].get("total_score", 0)
     # Use last recheck score if available
-    if task["rechecks"]:
-        previous_score = task["rechecks"][-1].get("updated_score", previous_score)
-
-    try:
-        result = await run_recheck(
-            body.updatedResume,
-            analysis,
-            previous_score,
-        )
-    except Exception as e:
-        raise HTTPException(500, f"LLM error: {e}")
-
-    task["rechecks"].append(result)
-    return result
+    last = task["rechecks"].latest()
+    if last is not None:
+        previous_score = last.get("updated_score", previous_score)
+
+    with admission.ticket(1):
+        try:
+            result = await until_disconnect(
+                request, run_recheck(body.updatedResume, analysis, previous_score)
+            )
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"LLM error: {e}")
+
+    rechecks = task["rechecks"]
+    rechecks.append(result)
+    storage.update_task(task_id, rechecks=rechecks)
+    return ORJSONResponse(result)
+
+
+@app.get("/api/tasks/{task_id}/rechecks")
+async def get_rechecks(task_id: str):
+    """Score timeline of the task's kept rechecks, oldest first."""
+    task = storage.get_task(task_id)
+    if task is None:
+        raise HTTPException(404, "Task not found")
+    rechecks = task["rechecks"]
+    return ORJSONResponse({"timeline": rechecks.timeline(), "latest": rechecks.latest()})
 
 
 # ---------------------------------------------------------------------------
@@ -411,13 +897,13 @@ async def auth_telegram(body: TelegramAuthRequest, response: Response):
         first_name=body.first_name,
         photo_url=body.photo_url or None,
     )
-    token = storage.create_session(body.id)
+    token = session_tokens.issue(user)
     response.set_cookie(
         key="session",
         value=token,
         httponly=True,
         samesite="lax",
-        max_age=86400,
+        max_age=SESSION_TTL,
     )
     return {"ok": True, "user": user}
 
@@ -436,7 +922,10 @@ async def auth_me(user=Depends(get_current_user)):
 # ---------------------------------------------------------------------------
 
 @app.post("/api/auth/logout")
-async def auth_logout(response: Response):
+async def auth_logout(request: Request, response: Response):
+    token = request.cookies.get("session")
+    if token:
+        session_tokens.revoke(token)
     response.delete_cookie("session")
     return {"ok": True}
 
@@ -446,21 +935,48 @@ async def auth_logout(response: Response):
 # ---------------------------------------------------------------------------
 
 @app.get("/api/history")
-async def get_history(user=Depends(get_current_user)):
+async def get_history(after: str | None = None, limit: int = 20, user=Depends(get_current_user)):
+    """User's tasks, newest first. Pass nextCursor back as ?after= for the
+    next page; it is null on the last page."""
     if user is None:
-        return {"tasks": []}
+        return {"tasks": [], "nextCursor": None}
 
-    tasks = storage.get_user_tasks(user["tg_id"])
-    return {
+    try:
+        tasks, next_cursor = storage.user_task_page(
+            user["tg_id"], after=after, limit=max(1, min(limit, MAX_HISTORY_PAGE))
+        )
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    return ORJSONResponse({
         "tasks": [
             {
                 "taskId": t["id"],
                 "fileName": t["file_name"],
                 "createdAt": t["created_at"],
-                "hasResults": t["parse_result"] is not None,
+                "hasResults": t.is_set("parse_result"),
             }
             for t in tasks
-        ]
+        ],
+        "nextCursor": next_cursor,
+    })
+
+
+# ---------------------------------------------------------------------------
+# GET /api/metrics — LLM usage and connection pool stats (METRICS_TOKEN)
+# ---------------------------------------------------------------------------
+
+@app.get("/api/metrics", dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    return {
+        **llm_stats(),
+        "task_payload_cache": task_payloads.stats(),
+        "storage": storage.memory_stats(),
+        "admission": admission.stats(),
+        "speculative_rewrite": speculative.stats(),
+        "regenerations": regenerations.stats(),
+        "disconnects": disconnects.stats(),
+        "idempotency": idempotency_store.stats(),
+        "sessions": session_tokens.stats(),
     }
 
 
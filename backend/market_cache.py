@@ -0,0 +1,146 @@
+"""Shared cache of web-search-derived facts about roles on the job market.
+
+run_roles asks the model to look roles up on hh.ru, and popular roles
+("категорийный менеджер", "продакт-менеджер") were searched again for
+every resume. The role-level part of each answer (title as written in
+vacancies, typical duties, required skills, reporting line) is kept here
+per normalized role name and region for ROLE_CACHE_TTL. The next roles
+call gets the entries relevant to its resume in the prompt and a smaller
+web_search budget, so search is spent only on roles missing from cache.
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+ROLE_CACHE_TTL = float(os.environ.get("ROLE_CACHE_TTL", str(7 * 86400)))
+ROLE_CACHE_SIZE = 2000
+MAX_INJECTED = 5  # cached roles put into one prompt
+# Injected roles cut the web_search budget, so a weak match costs quality:
+# a shared specific title word (2) plus a skill, or three shared skills
+MIN_RELEVANCE = 3
+
+# Seniority doesn't change what a role is on the market
+_GRADE_WORDS = {
+    "junior", "middle", "senior", "lead", "младший", "старший", "ведущий",
+    "главный", "jr", "sr",
+}
+# Too generic to tie a resume to a role ("менеджер" is half the market)
+_GENERIC_WORDS = {
+    "менеджер", "manager", "специалист", "specialist", "руководитель", "head",
+    "сотрудник", "ассистент", "assistant", "помощник", "инженер", "engineer",
+    "разработчик", "developer", "консультант", "consultant",
+}
+_NON_WORD = re.compile(r"[^\w+#]+")
+
+
+def normalize_role(title: str) -> str:
+    words = _NON_WORD.sub(" ", title.lower().replace("ё", "е")).split()
+    return " ".join(w for w in words if w not in _GRADE_WORDS)
+
+
+def _words(texts: Iterable[str]) -> set[str]:
+    return {
+        w for t in texts for w in normalize_role(t).split()
+        if len(w) > 2 and w not in _GENERIC_WORDS
+    }
+
+
+class RoleMarketCache:
+    def __init__(self, ttl: float = ROLE_CACHE_TTL, max_size: int = ROLE_CACHE_SIZE):
+        self._entries: OrderedDict[tuple[str, str], dict[str, Any]] = OrderedDict()
+        self._ttl = ttl
+        self._max_size = max_size
+        self.lookups = 0
+        self.injected = 0
+        self.role_hits = 0  # returned roles that were served from cache
+        self.role_misses = 0
+
+    def _fresh(self, key: tuple[str, str]) -> dict[str, Any] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["updated_at"] > self._ttl:
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, title: str, region: str) -> dict[str, Any] | None:
+        return self._fresh((normalize_role(title), region))
+
+    def lookup(
+        self,
+        titles: Iterable[str],
+        skills: Iterable[str],
+        region: str,
+        limit: int = MAX_INJECTED,
+    ) -> list[dict[str, Any]]:
+        """Cached roles relevant to a resume: specific job-title words it
+        mentions and overlap of its skills with each role's required
+        skills, scoring at least MIN_RELEVANCE."""
+        self.lookups += 1
+        title_words = _words(titles)
+        skill_set = {s.lower() for s in skills}
+        scored = []
+        for key in list(self._entries):
+            if key[1] != region:
+                continue
+            entry = self._fresh(key)
+            if entry is None:
+                continue
+            score = 2 * len(title_words & _words([key[0]]))
+            score += len(skill_set & {s.lower() for s in entry["required_skills"]})
+            if score >= MIN_RELEVANCE:
+                scored.append((score, entry))
+        scored.sort(key=lambda se: -se[0])
+        found = [
+            {k: v for k, v in entry.items() if k != "updated_at"}
+            for _, entry in scored[:limit]
+        ]
+        self.injected += len(found)
+        return found
+
+    def store(self, roles: list[dict], region: str, injected: list[dict] | None = None) -> None:
+        """Keep the role-level facts of a roles result; count cache hits."""
+        served = {normalize_role(e["title"]) for e in injected or ()}
+        for role in roles:
+            name = normalize_role(role.get("role", ""))
+            if not name:
+                continue
+            key = (name, region)
+            cached = self._fresh(key)
+            if name in served:
+                self.role_hits += 1
+            else:
+                self.role_misses += 1
+            if name in served and cached is not None:
+                continue  # facts came from cache; TTL runs from the search
+            self._entries[key] = {
+                "title": role["role"],
+                "typical_duties": role.get("typical_duties", ""),
+                # Role-level only: matched/missing skills describe this
+                # candidate and must not reach other users' prompts
+                "required_skills": list(dict.fromkeys(role.get("required_skills", []))),
+                "reports_to": role.get("reports_to", ""),
+                "works_with": role.get("works_with", ""),
+                "updated_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        returned = self.role_hits + self.role_misses
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "injected": self.injected,
+            "role_hits": self.role_hits,
+            "role_misses": self.role_misses,
+            "hit_rate": round(self.role_hits / returned, 3) if returned else 0.0,
+        }
+
+
+role_market = RoleMarketCache()
@@ -7,26 +7,29 @@ JSON schemas MUST match the frontend TypeScript types exactly.
 # Step 0a: Parse — split resume into sections + classify (lightweight)
 # ---------------------------------------------------------------------------
 
-PARSE_SYSTEM = """Ты — толковый карьерный консультант. Говоришь на «ты», даёшь прямые советы \
-без снобизма и HR-жаргона. Твоя задача — разобрать резюме на блоки и дать первичную диагностику.
-
-1. ОПРЕДЕЛИ ТИП РЕЗЮМЕ (что бросается в глаза с первого взгляда):
+_PARSE_TYPES = """1. ОПРЕДЕЛИ ТИП РЕЗЮМЕ (что бросается в глаза с первого взгляда):
 - "Список обязанностей" — опыт есть, но описан процессами, а не результатами
 - "Каша из ролей" — опыт разнородный, непонятно кто этот человек
 - "Джун после курсов" — нет реального коммерческого опыта
 - "Переходящий" — опыт из другой сферы, хочет сменить роль
 - "Нормальный" — есть результаты, нужна полировка
 
-2. РАЗБЕЙ НА БЛОКИ ОПЫТА:
+"""
+
+_PARSE_BLOCKS = """2. РАЗБЕЙ НА БЛОКИ ОПЫТА:
 ОДНА ПОЗИЦИЯ В ОДНОЙ КОМПАНИИ = ОДИН БЛОК. Если человек работал в одной \
 компании на одной должности, но вёл несколько проектов/продуктов — это \
 ОДИН блок, а не несколько. Разделяй только если РАЗНЫЕ должности или РАЗНЫЕ компании.
-Для каждого блока:
-- В full_text скопируй ВЕСЬ оригинальный текст блока как есть \
-(от названия компании до конца описания). \
+Для каждого блока НЕ копируй его текст — укажи только границы:
+- start_anchor — первые 5-8 слов блока ДОСЛОВНО, как в резюме \
+(обычно начинается с названия компании или должности)
+- end_anchor — последние 5-8 слов блока ДОСЛОВНО, как в резюме
+Блоки перечисляй в том порядке, в каком они идут в резюме. \
 НЕ ПРОПУСКАЙ ни один блок опыта.
 
-3. ОПРЕДЕЛИ:
+"""
+
+_PARSE_DIAGNOSIS = """3. ОПРЕДЕЛИ:
 - Red flags (частая смена работы, даунгрейд, пробелы) — \
 объясняй конкретно: что увидит рекрутер и почему это тревожит
 - Главная проблема этого резюме — одним предложением, как другу: \
@@ -40,7 +43,17 @@ PARSE_SYSTEM = """Ты — толковый карьерный консульт
 5. ОПРЕДЕЛИ ПОЛ кандидата по имени или глагольным формам в тексте \
 ("male" или "female"). Это нужно для правильного рода глаголов при переписывании.
 
-НЕ анализируй содержание блоков — только разбей, классифицируй и извлеки навыки."""
+"""
+
+PARSE_SYSTEM = (
+    "Ты — толковый карьерный консультант. Говоришь на «ты», даёшь прямые советы "
+    "без снобизма и HR-жаргона. Твоя задача — разобрать резюме на блоки и дать "
+    "первичную диагностику.\n\n"
+    + _PARSE_TYPES
+    + _PARSE_BLOCKS
+    + _PARSE_DIAGNOSIS
+    + "НЕ анализируй содержание блоков — только разбей, классифицируй и извлеки навыки."
+)
 
 PARSE_SCHEMA = {
     "type": "object",
@@ -98,11 +111,16 @@ PARSE_SCHEMA = {
                         "description": "Название компании и роли",
                     },
                     "period": {"type": "string"},
-                    "full_text": {
+                    "start_anchor": {
+                        "type": "string",
+                        "description": (
+                            "Первые 5-8 слов блока дословно из резюме"
+                        ),
+                    },
+                    "end_anchor": {
                         "type": "string",
                         "description": (
-                            "ПОЛНЫЙ оригинальный текст этого блока "
-                            "опыта из резюме, как есть. Копируй дословно."
+                            "Последние 5-8 слов блока дословно из резюме"
                         ),
                     },
                 },
@@ -110,7 +128,8 @@ PARSE_SCHEMA = {
                     "block_id",
                     "section_title",
                     "period",
-                    "full_text",
+                    "start_anchor",
+                    "end_anchor",
                 ],
             },
         },
@@ -159,6 +178,26 @@ PARSE_SCHEMA = {
     ],
 }
 
+# ---------------------------------------------------------------------------
+# Step 0a, fast path: blocks already found by segmenter.py — classify only
+# ---------------------------------------------------------------------------
+
+PARSE_CLASSIFY_SYSTEM = (
+    "Ты — толковый карьерный консультант. Говоришь на «ты», даёшь прямые советы "
+    "без снобизма и HR-жаргона. Твоя задача — дать первичную диагностику резюме.\n\n"
+    + _PARSE_TYPES
+    + "2. БЛОКИ ОПЫТА уже выделены (список после резюме) — заново их не выделяй, "
+    "но учитывай даты и должности для red flags.\n\n"
+    + _PARSE_DIAGNOSIS
+    + "НЕ анализируй содержание блоков — только классифицируй и извлеки навыки."
+)
+
+PARSE_CLASSIFY_SCHEMA = {
+    "type": "object",
+    "properties": {k: v for k, v in PARSE_SCHEMA["properties"].items() if k != "sections"},
+    "required": [k for k in PARSE_SCHEMA["required"] if k != "sections"],
+}
+
 # ---------------------------------------------------------------------------
 # Step 0b: Annotate — per-section weaknesses/strengths (parallel)
 # ---------------------------------------------------------------------------
@@ -226,10 +265,7 @@ ANNOTATE_SCHEMA = {
 # Step 0b: Scoring (parallel call 2 of 2)
 # ---------------------------------------------------------------------------
 
-SCORING_SYSTEM = """Ты — толковый карьерный консультант. Говоришь прямо, \
-без HR-жаргона, конкретно и по делу.
-
-Оцени резюме по 10 измерениям, каждое от 0 до 10.
+_SCORING_RULES = """Оцени резюме по 10 измерениям, каждое от 0 до 10.
 Будь строгим, но справедливым. Типичное «нормальное» резюме получает 50-65 баллов, не выше.
 
 Измерения:
@@ -250,6 +286,11 @@ SCORING_SYSTEM = """Ты — толковый карьерный консуль
 Вердикт — 2-3 предложения. Как если бы объяснял другу, что с его резюме не так \
 и что с ним делать дальше."""
 
+SCORING_SYSTEM = """Ты — толковый карьерный консультант. Говоришь прямо, \
+без HR-жаргона, конкретно и по делу.
+
+""" + _SCORING_RULES
+
 SCORING_SCHEMA = {
     "type": "object",
     "properties": {
@@ -277,6 +318,23 @@ SCORING_SCHEMA = {
     "required": ["dimensions", "verdict"],
 }
 
+# ---------------------------------------------------------------------------
+# Step 0a+0b fused: Parse + Scoring in one call (FUSED_PARSE_SCORING=1)
+# ---------------------------------------------------------------------------
+
+PARSE_SCORING_SYSTEM = PARSE_SYSTEM + """
+
+6. ОЦЕНКА РЕЗЮМЕ ЦЕЛИКОМ (заполни dimensions и verdict; это единственное \
+место, где нужна оценка содержания):
+
+""" + _SCORING_RULES
+
+PARSE_SCORING_SCHEMA = {
+    "type": "object",
+    "properties": {**PARSE_SCHEMA["properties"], **SCORING_SCHEMA["properties"]},
+    "required": PARSE_SCHEMA["required"] + SCORING_SCHEMA["required"],
+}
+
 # ---------------------------------------------------------------------------
 # Step 1: Role Matching
 # ---------------------------------------------------------------------------
@@ -299,6 +357,8 @@ ROLES_SYSTEM = """Ты — толковый карьерный консульт
 - Типичные обязанности (одно предложение, не список)
 - matched_skills: навыки кандидата, подходящие для роли
 - missing_skills: что нужно для роли, но отсутствует
+- required_skills: что обычно требуют в вакансиях на эту роль — \
+по вакансиям, а не по резюме кандидата
 - Позиция в команде: reports_to и works_with
 
 В рекомендации объясни простым языком, какую роль выбрать \
@@ -355,6 +415,11 @@ ROLES_SCHEMA = {
                         "items": {"type": "string"},
                         "description": "Навыки/инструменты, нужные для роли, но отсутствующие у кандидата",
                     },
+                    "required_skills": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Навыки/инструменты, которые обычно требуют в вакансиях на эту роль (не зависит от кандидата)",
+                    },
                     "reports_to": {
                         "type": "string",
                         "description": "Кому подчиняется",
@@ -373,6 +438,7 @@ ROLES_SCHEMA = {
                     "typical_duties",
                     "matched_skills",
                     "missing_skills",
+                    "required_skills",
                     "reports_to",
                     "works_with",
                 ],
@@ -468,6 +534,7 @@ REWRITE_BLOCK_SCHEMA = {
                             "clarify",
                             "keep",
                         ],
+                        "default": "keep",
                     },
                     "comment": {
                         "type": "string",
@@ -624,6 +691,7 @@ REGENERATE_BULLET_SYSTEM = """Ты — толковый карьерный ко
 редактирует переписанное резюме и просит переделать фрагмент буллета.
 
 Тебе дан:
+- Оригинальное резюме (для контекста)
 - Полный текст буллета
 - Выделенный фрагмент, который нужно изменить (может быть весь буллет)
 - Комментарий пользователя — что он хочет (факты, инструкция, пожелание)
@@ -639,18 +707,9 @@ REGENERATE_BULLET_SYSTEM = """Ты — толковый карьерный ко
 4. Если пользователь дал инструкцию ("сделай короче", "добавь метрики") — \
 выполни её, но не выдумывай цифры. Если нужны цифры — оставь [уточнить: ...].
 5. Сохраняй тон и стиль остальных буллетов (профессиональный, результато-ориентированный).
-6. Используй правильный грамматический род (указан в контексте)."""
-
-REGENERATE_BULLET_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "new_bullet": {
-            "type": "string",
-            "description": "Полный текст нового буллета (весь, не только фрагмент)",
-        },
-    },
-    "required": ["new_bullet"],
-}
+6. Используй правильный грамматический род (указан в контексте).
+7. Ответь ТОЛЬКО текстом нового буллета (весь, не только фрагмент) — \
+без кавычек, маркера списка и пояснений."""
 
 # ---------------------------------------------------------------------------
 # Recheck
@@ -0,0 +1,120 @@
+"""Bounded per-task recheck history.
+
+Every recheck used to append its full result to task["rechecks"], so a
+long editing session kept hundreds of near-identical payloads per task.
+Consecutive rechecks mostly differ in a few fields (score, verdict, one
+issue list), so entries are stored as a ring buffer of:
+
+  - full snapshots every RECHECK_KEYFRAME_INTERVAL entries;
+  - field-level deltas from the previous entry in between.
+
+At most RECHECK_HISTORY_SIZE entries are kept. When the oldest entry is
+dropped, the next one is rebased into a full snapshot, so any kept entry
+is rebuilt from at most KEYFRAME_INTERVAL - 1 deltas. Every entry also
+carries its score, so timeline() does not rebuild anything.
+"""
+
+import os
+import time
+from collections import deque
+from typing import Any, Iterator
+
+RECHECK_HISTORY_SIZE = int(os.environ.get("RECHECK_HISTORY_SIZE", "50"))
+RECHECK_KEYFRAME_INTERVAL = 8
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("n", "at", "score", "score_delta", "snapshot", "changed", "removed")
+
+    def __init__(self, n: int, at: float, result: dict[str, Any]):
+        self.n = n
+        self.at = at
+        self.score = result.get("updated_score")
+        self.score_delta = result.get("score_delta")
+        self.snapshot: dict[str, Any] | None = None  # set on keyframes
+        self.changed: dict[str, Any] = {}
+        self.removed: tuple[str, ...] = ()
+
+
+def _diff(old: dict[str, Any], new: dict[str, Any]) -> tuple[dict[str, Any], tuple[str, ...]]:
+    changed = {k: v for k, v in new.items() if old.get(k, _MISSING) != v}
+    removed = tuple(k for k in old if k not in new)
+    return changed, removed
+
+
+class RecheckHistory:
+    """Recheck results of one task, oldest first."""
+
+    def __init__(self, capacity: int = RECHECK_HISTORY_SIZE, keyframe_interval: int = RECHECK_KEYFRAME_INTERVAL):
+        self._entries: deque[_Entry] = deque()
+        self._capacity = max(1, capacity)
+        self._interval = max(1, keyframe_interval)
+        self._latest: dict[str, Any] | None = None  # rebuilt newest entry, for the next diff
+        self._count = 0  # entries ever appended; numbers them
+        self._since_keyframe = 0
+
+    def append(self, result: dict[str, Any]) -> int:
+        """Add a recheck result; returns its number (1-based, never reused)."""
+        self._count += 1
+        entry = _Entry(self._count, time.time(), result)
+        if self._latest is None or self._since_keyframe + 1 >= self._interval:
+            entry.snapshot = dict(result)
+            self._since_keyframe = 0
+        else:
+            entry.changed, entry.removed = _diff(self._latest, result)
+            self._since_keyframe += 1
+        self._entries.append(entry)
+        self._latest = dict(result)
+        if len(self._entries) > self._capacity:
+            head = self._entries[1]
+            if head.snapshot is None:
+                # Rebased while the keyframe it depends on is still here
+                head.snapshot = self._rebuild(1)
+                head.changed, head.removed = {}, ()
+            self._entries.popleft()
+        return entry.n
+
+    def latest(self) -> dict[str, Any] | None:
+        return dict(self._latest) if self._latest is not None else None
+
+    def _rebuild(self, index: int) -> dict[str, Any]:
+        start = index
+        while self._entries[start].snapshot is None:
+            start -= 1
+        result = dict(self._entries[start].snapshot)
+        for i in range(start + 1, index + 1):
+            entry = self._entries[i]
+            result.update(entry.changed)
+            for key in entry.removed:
+                result.pop(key, None)
+        return result
+
+    def __getitem__(self, index: int) -> dict[str, Any]:
+        if index < 0:
+            index += len(self._entries)
+        if not 0 <= index < len(self._entries):
+            raise IndexError("recheck index out of range")
+        return self._rebuild(index)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for i in range(len(self._entries)):
+            yield self._rebuild(i)
+
+    def timeline(self) -> list[dict[str, Any]]:
+        """Score of every kept recheck, oldest first."""
+        return [
+            {"n": e.n, "at": e.at, "updated_score": e.score, "score_delta": e.score_delta}
+            for e in self._entries
+        ]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "appended": self._count,
+            "keyframes": sum(1 for e in self._entries if e.snapshot is not None),
+        }
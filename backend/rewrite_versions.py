@@ -0,0 +1,214 @@
+"""Rewrite version history with bullet-level diffs.
+
+Every rewrite, user edit and restore of task["rewrite"] becomes a
+version, so the user can go back to the AI original or to any earlier
+edit (PLAN.md, "История версий / откат"). A full RewriteResult per
+version would multiply task memory, and an edit usually touches a few
+bullets. A version is stored as a diff from the previous one:
+
+  - summary and other top-level fields: new value if changed;
+  - skills: changed groups only;
+  - experiences: per block, the changed rewritten_bullets by index plus
+    the new length; a block whose other fields changed (another role,
+    new highlights) is stored whole.
+
+Every REWRITE_SNAPSHOT_INTERVAL versions a full snapshot is stored
+instead, so rebuilding any version applies at most INTERVAL - 1 diffs.
+The latest version is kept rebuilt.
+
+At most REWRITE_MAX_VERSIONS versions are kept. Version 1 (the AI
+original) always stays; older edits after it are dropped first, and the
+oldest remaining diff is rebased into a snapshot when its base goes.
+"""
+
+import copy
+import os
+import time
+from typing import Any
+
+REWRITE_SNAPSHOT_INTERVAL = 8
+REWRITE_MAX_VERSIONS = int(os.environ.get("REWRITE_MAX_VERSIONS", "30"))
+
+_MISSING = object()
+
+
+def _dict_diff(old: dict[str, Any], new: dict[str, Any], skip: tuple[str, ...] = ()) -> tuple[dict, list]:
+    changed = {k: v for k, v in new.items() if k not in skip and old.get(k, _MISSING) != v}
+    removed = [k for k in old if k not in skip and k not in new]
+    return changed, removed
+
+
+def _experiences_diff(old: list[dict], new: list[dict]) -> dict[str, Any]:
+    replaced: dict[int, dict] = {}
+    bullets: dict[int, dict[str, Any]] = {}
+    for i, block in enumerate(new):
+        if i >= len(old):
+            replaced[i] = block
+            continue
+        changed, removed = _dict_diff(old[i], block, skip=("rewritten_bullets",))
+        if changed or removed:
+            replaced[i] = block
+            continue
+        old_bullets, new_bullets = old[i].get("rewritten_bullets", []), block.get("rewritten_bullets", [])
+        if old_bullets == new_bullets:
+            continue
+        bullets[i] = {
+            "length": len(new_bullets),
+            "set": {j: b for j, b in enumerate(new_bullets) if j >= len(old_bullets) or old_bullets[j] != b},
+        }
+    diff: dict[str, Any] = {}
+    if len(new) != len(old):
+        diff["length"] = len(new)
+    if replaced:
+        diff["replaced"] = replaced
+    if bullets:
+        diff["bullets"] = bullets
+    return diff
+
+
+def diff(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    """Structural diff turning rewrite `old` into `new`."""
+    result: dict[str, Any] = {}
+    structured = ("experiences", "skills")
+    fields, removed = _dict_diff(old, new, skip=structured)
+    if fields:
+        result["fields"] = fields
+    if removed:
+        result["removed"] = removed
+
+    old_skills, new_skills = old.get("skills"), new.get("skills")
+    if isinstance(old_skills, dict) and isinstance(new_skills, dict):
+        changed, gone = _dict_diff(old_skills, new_skills)
+        if changed or gone:
+            result["skills"] = {"set": changed, "removed": gone}
+    elif old_skills != new_skills:
+        result.setdefault("fields", {})["skills"] = new_skills
+
+    experiences = _experiences_diff(old.get("experiences", []), new.get("experiences", []))
+    if experiences:
+        result["experiences"] = experiences
+    return result
+
+
+def apply(rewrite: dict[str, Any], delta: dict[str, Any]) -> None:
+    """Apply a diff() result to `rewrite` in place."""
+    rewrite.update(copy.deepcopy(delta.get("fields", {})))
+    for key in delta.get("removed", ()):
+        rewrite.pop(key, None)
+    if "skills" in delta:
+        skills = rewrite.setdefault("skills", {})
+        skills.update(copy.deepcopy(delta["skills"]["set"]))
+        for key in delta["skills"]["removed"]:
+            skills.pop(key, None)
+    experiences_delta = delta.get("experiences")
+    if experiences_delta:
+        experiences = rewrite.setdefault("experiences", [])
+        del experiences[experiences_delta.get("length", len(experiences)):]
+        for i, block in experiences_delta.get("replaced", {}).items():
+            block = copy.deepcopy(block)
+            if i < len(experiences):
+                experiences[i] = block
+            else:
+                experiences.append(block)  # new blocks come in index order
+        for i, change in experiences_delta.get("bullets", {}).items():
+            bullets = experiences[i].setdefault("rewritten_bullets", [])
+            del bullets[change["length"]:]
+            for j, text in change["set"].items():
+                if j < len(bullets):
+                    bullets[j] = text
+                else:
+                    bullets.append(text)
+
+
+class _Version:
+    __slots__ = ("n", "at", "source", "role", "score", "snapshot", "delta")
+
+    def __init__(self, n: int, source: str, role: str | None, score: int | None):
+        self.n = n
+        self.at = time.time()
+        self.source = source  # "rewrite" | "edit" | "restore"
+        self.role = role
+        self.score = score
+        self.snapshot: dict[str, Any] | None = None
+        self.delta: dict[str, Any] | None = None
+
+    def info(self) -> dict[str, Any]:
+        return {"n": self.n, "at": self.at, "source": self.source, "role": self.role, "score": self.score}
+
+
+class RewriteVersions:
+    """Versions of one task's rewrite, numbered from 1 (numbers are never reused)."""
+
+    def __init__(self, snapshot_interval: int = REWRITE_SNAPSHOT_INTERVAL, max_versions: int = REWRITE_MAX_VERSIONS):
+        self._versions: list[_Version] = []
+        self._interval = max(1, snapshot_interval)
+        self._max_versions = max(2, max_versions)
+        self._latest: dict[str, Any] | None = None
+        self._count = 0  # versions ever appended
+        self._since_snapshot = 0
+
+    def append(
+        self,
+        rewrite: dict[str, Any],
+        source: str,
+        role: str | None = None,
+        score: int | None = None,
+    ) -> int:
+        """Record `rewrite` as the newest version; returns its number."""
+        rewrite = copy.deepcopy(rewrite)  # diffs share its values
+        self._count += 1
+        version = _Version(self._count, source, role, score)
+        if self._latest is None or self._since_snapshot + 1 >= self._interval:
+            version.snapshot = rewrite
+            self._since_snapshot = 0
+        else:
+            version.delta = diff(self._latest, rewrite)
+            self._since_snapshot += 1
+        self._versions.append(version)
+        self._latest = rewrite
+        if len(self._versions) > self._max_versions:
+            # Drop the oldest edit, never the original
+            following = self._versions[2]
+            if following.snapshot is None:
+                following.snapshot, following.delta = self._rebuild(2), None
+            del self._versions[1]
+        return version.n
+
+    def latest(self) -> dict[str, Any] | None:
+        """Newest version, not copied: treat as read-only."""
+        return self._latest
+
+    def get(self, n: int) -> dict[str, Any]:
+        """Rebuild version `n`; KeyError if there is none (or it was dropped)."""
+        return self._rebuild(self._index(n))
+
+    def _index(self, n: int) -> int:
+        if n == 1 and self._versions:
+            return 0
+        if len(self._versions) > 1:
+            index = n - self._versions[1].n + 1
+            if 1 <= index < len(self._versions):
+                return index
+        raise KeyError(n)
+
+    def _rebuild(self, index: int) -> dict[str, Any]:
+        start = index
+        while self._versions[start].snapshot is None:
+            start -= 1
+        rewrite = copy.deepcopy(self._versions[start].snapshot)
+        for version in self._versions[start + 1:index + 1]:
+            apply(rewrite, version.delta)
+        return rewrite
+
+    def history(self) -> list[dict[str, Any]]:
+        """Metadata of every version, oldest first."""
+        return [v.info() for v in self._versions]
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "versions": len(self._versions),
+            "snapshots": sum(1 for v in self._versions if v.snapshot is not None),
+        }
@@ -0,0 +1,149 @@
+"""Per-step model selection under a latency SLO.
+
+Each step has an ordered list of candidate models (preferred first) and a
+latency SLO. The router keeps an EWMA of latency, input size and error
+rate per (model, step) and picks the first candidate that is healthy and
+whose latency, scaled to this request's input size, fits the SLO. When
+the preferred model is predicted over the SLO, a later candidate is used
+only if it is predicted to be faster: a long input is slow on every
+model, and the stronger one is usually the slower.
+
+The error rate decays with ERROR_HALF_LIFE since the last recorded call,
+so a model that was marked unhealthy gets traffic again (one probe call
+at a time) instead of being locked out until restart.
+
+Routing is sticky in practice: the preferred model keeps the traffic
+(and its prompt cache) unless it is failing or too slow.
+
+Pin a step with LLM_MODEL_<STEP>=model[,fallback...], e.g.
+LLM_MODEL_REWRITE_BLOCK=claude-sonnet-4-5-20250929.
+"""
+
+import os
+import time
+from typing import NamedTuple
+
+HAIKU = "claude-haiku-4-5-20251001"
+SONNET = "claude-sonnet-4-5-20250929"
+
+DEFAULT_MODEL = HAIKU
+MAX_ERROR_RATE = 0.3  # EWMA share of failed calls that marks a model unhealthy
+EWMA_ALPHA = 0.2
+ERROR_HALF_LIFE = 60.0  # seconds for an idle model's error rate to halve
+MIN_SAMPLES = 3  # calls before a model's latency is trusted
+
+
+class StepRoute(NamedTuple):
+    models: tuple[str, ...]
+    slo: float  # seconds, p50 target for the whole call
+
+
+# Short-output steps stay on the fastest tier; long-output ones may spill
+# over to a stronger model when the fast one is failing.
+STEP_ROUTES = {
+    "parse": StepRoute((HAIKU, SONNET), 60.0),
+    "parse_classify": StepRoute((HAIKU, SONNET), 30.0),
+    "scoring": StepRoute((HAIKU,), 20.0),
+    "parse_scoring": StepRoute((HAIKU, SONNET), 75.0),
+    "annotate": StepRoute((HAIKU, SONNET), 30.0),
+    "roles": StepRoute((HAIKU, SONNET), 120.0),
+    "rewrite_block": StepRoute((HAIKU, SONNET), 30.0),
+    "rewrite_meta": StepRoute((HAIKU, SONNET), 30.0),
+    "regenerate_bullet": StepRoute((HAIKU,), 8.0),
+    "recheck": StepRoute((HAIKU, SONNET), 45.0),
+}
+DEFAULT_ROUTE = StepRoute((DEFAULT_MODEL,), 60.0)
+
+
+def _route_for(step: str) -> StepRoute:
+    route = STEP_ROUTES.get(step, DEFAULT_ROUTE)
+    pinned = os.environ.get(f"LLM_MODEL_{step.upper()}")
+    if pinned:
+        models = tuple(m.strip() for m in pinned.split(",") if m.strip())
+        return StepRoute(models or route.models, route.slo)
+    return route
+
+
+class _ModelStats:
+    __slots__ = ("latency", "chars", "_error_rate", "_error_at", "calls", "errors")
+
+    def __init__(self):
+        self.latency = 0.0
+        self.chars = 0.0
+        self._error_rate = 0.0
+        self._error_at = 0.0  # monotonic time _error_rate was last updated
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def error_rate(self) -> float:
+        if not self._error_rate:
+            return 0.0
+        idle = time.monotonic() - self._error_at
+        return self._error_rate * 0.5 ** (idle / ERROR_HALF_LIFE)
+
+    def record_outcome(self, ok: bool) -> None:
+        self._error_rate = self.error_rate + EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        self._error_at = time.monotonic()
+
+    def predict(self, input_chars: int) -> float | None:
+        """Expected latency for this input size; None until enough samples."""
+        if self.calls - self.errors < MIN_SAMPLES:
+            return None
+        return self.latency * max(0.5, input_chars / self.chars if self.chars else 1.0)
+
+
+class ModelRouter:
+    def __init__(self):
+        self._stats: dict[tuple[str, str], _ModelStats] = {}
+
+    def _get(self, model: str, step: str) -> _ModelStats:
+        key = (model, step)
+        if key not in self._stats:
+            self._stats[key] = _ModelStats()
+        return self._stats[key]
+
+    def choose(self, step: str, input_chars: int) -> str:
+        route = _route_for(step)
+        healthy = [m for m in route.models if self._get(m, step).error_rate <= MAX_ERROR_RATE]
+        if not healthy:
+            # Everything is failing: least-bad error rate
+            return min(route.models, key=lambda m: self._get(m, step).error_rate)
+        preferred = healthy[0]
+        slowest = self._get(preferred, step).predict(input_chars)
+        if slowest is None or slowest <= route.slo:
+            return preferred
+        # Over the SLO: switch only to a candidate known to be faster
+        predicted = {m: self._get(m, step).predict(input_chars) for m in healthy[1:]}
+        faster = [m for m, p in predicted.items() if p is not None and p < slowest]
+        for model in faster:
+            if predicted[model] <= route.slo:
+                return model
+        return min(faster, key=predicted.get, default=preferred)
+
+    def record(self, model: str, step: str, input_chars: int, seconds: float, ok: bool) -> None:
+        stats = self._get(model, step)
+        stats.calls += 1
+        stats.record_outcome(ok)
+        if not ok:
+            stats.errors += 1
+            return
+        if stats.calls - stats.errors == 1:
+            stats.latency, stats.chars = seconds, float(input_chars)
+        else:
+            stats.latency += EWMA_ALPHA * (seconds - stats.latency)
+            stats.chars += EWMA_ALPHA * (input_chars - stats.chars)
+
+    def stats(self) -> dict:
+        return {
+            f"{step}/{model}": {
+                "latency": round(s.latency, 2),
+                "error_rate": round(s.error_rate, 3),
+                "calls": s.calls,
+                "errors": s.errors,
+            }
+            for (model, step), s in self._stats.items()
+        }
+
+
+model_router = ModelRouter()
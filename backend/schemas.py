@@ -0,0 +1,312 @@
+"""Compiled validators for structured LLM outputs.
+
+Every ``*_SCHEMA`` in prompts.py is compiled once into a tree of closures.
+A validator checks a tool_use payload against its schema, repairs the
+usual model slips locally (string instead of array, "7" instead of 7,
+enum in the wrong case, missing nested field) and reports the top-level
+required fields it could not recover, so call_claude can re-ask for just
+those instead of failing the whole step.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+from typing import Any, Callable
+
+import prompts
+
+logger = logging.getLogger("llm")
+
+_MISSING = object()
+
+
+class _Invalid(Exception):
+    """Value cannot be repaired locally."""
+
+
+Check = Callable[[Any, str, list[str]], Any]
+
+
+# ---------------------------------------------------------------------------
+# Compilers (one closure per schema node)
+# ---------------------------------------------------------------------------
+
+def _default_for(schema: dict) -> Any:
+    """Safe local default for a missing nested value, or _MISSING."""
+    if "default" in schema:
+        return schema["default"]
+    if "enum" in schema:
+        return _MISSING
+    return {
+        "string": "",
+        "array": [],
+        "integer": 0,
+        "number": 0,
+        "boolean": False,
+    }.get(schema.get("type"), _MISSING)
+
+
+def _compile_string(schema: dict) -> Check:
+    enum = schema.get("enum")
+    by_key = {e.strip().lower(): e for e in enum} if enum else None
+
+    def check(value: Any, path: str, repairs: list[str]) -> Any:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            repairs.append(f"{path}: number → string")
+            value = str(value)
+        elif isinstance(value, list) and all(isinstance(v, str) for v in value):
+            repairs.append(f"{path}: array → string")
+            value = "\n".join(value)
+        elif not isinstance(value, str):
+            raise _Invalid(path)
+        if by_key is not None and value not in enum:
+            fixed = by_key.get(value.strip().lower())
+            if fixed is None:
+                raise _Invalid(path)
+            repairs.append(f"{path}: enum {value!r} → {fixed!r}")
+            value = fixed
+        return value
+
+    return check
+
+
+def _compile_number(schema: dict) -> Check:
+    integer = schema.get("type") == "integer"
+
+    def check(value: Any, path: str, repairs: list[str]) -> Any:
+        if isinstance(value, bool):
+            raise _Invalid(path)
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            if integer:
+                repairs.append(f"{path}: float → int")
+                return round(value)
+            return value
+        if isinstance(value, str):
+            try:
+                number = float(value.strip().replace(",", "."))
+            except ValueError:
+                raise _Invalid(path) from None
+            repairs.append(f"{path}: string → number")
+            return round(number) if integer else number
+        raise _Invalid(path)
+
+    return check
+
+
+def _compile_boolean(schema: dict) -> Check:
+    def check(value: Any, path: str, repairs: list[str]) -> Any:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            repairs.append(f"{path}: string → boolean")
+            return value.strip().lower() == "true"
+        raise _Invalid(path)
+
+    return check
+
+
+def _split_lines(text: str) -> list[str]:
+    return [
+        line.lstrip("•-– ").strip()
+        for line in text.split("\n")
+        if line.strip()
+    ]
+
+
+def _compile_array(schema: dict) -> Check:
+    items = schema.get("items", {})
+    item_check = _compile(items)
+    items_are_strings = items.get("type") == "string"
+
+    def check(value: Any, path: str, repairs: list[str]) -> Any:
+        if isinstance(value, str):
+            stripped = value.strip()
+            if stripped.startswith("["):
+                try:
+                    value = json.loads(stripped)
+                    repairs.append(f"{path}: JSON string → array")
+                except ValueError:
+                    pass
+        if isinstance(value, str):
+            if not items_are_strings:
+                raise _Invalid(path)
+            repairs.append(f"{path}: string → array ({len(value)} chars split by lines)")
+            value = _split_lines(value)
+        elif isinstance(value, dict):
+            repairs.append(f"{path}: object → array")
+            value = [value]
+        elif not isinstance(value, list):
+            raise _Invalid(path)
+
+        out = []
+        for i, item in enumerate(value):
+            try:
+                out.append(item_check(item, f"{path}[{i}]", repairs))
+            except _Invalid:
+                repairs.append(f"{path}[{i}]: dropped invalid item")
+        return out
+
+    return check
+
+
+def _compile_object(schema: dict) -> Check:
+    props = {
+        name: (_compile(sub), _default_for(sub))
+        for name, sub in schema.get("properties", {}).items()
+    }
+    required = tuple(schema.get("required", ()))
+
+    def check(value: Any, path: str, repairs: list[str]) -> Any:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+                repairs.append(f"{path}: JSON string → object")
+            except ValueError:
+                raise _Invalid(path) from None
+        if not isinstance(value, dict):
+            raise _Invalid(path)
+
+        out = dict(value)
+        for name, (sub_check, default) in props.items():
+            sub_path = f"{path}.{name}"
+            if name in value and value[name] is not None:
+                try:
+                    out[name] = sub_check(value[name], sub_path, repairs)
+                    continue
+                except _Invalid:
+                    pass
+            if name not in required:
+                out.pop(name, None)
+                continue
+            if default is _MISSING:
+                raise _Invalid(sub_path)
+            repairs.append(f"{sub_path}: missing → default")
+            out[name] = copy.deepcopy(default)
+        return out
+
+    return check
+
+
+def _compile(schema: dict) -> Check:
+    kind = schema.get("type")
+    if kind == "object":
+        return _compile_object(schema)
+    if kind == "array":
+        return _compile_array(schema)
+    if kind == "string":
+        return _compile_string(schema)
+    if kind in ("integer", "number"):
+        return _compile_number(schema)
+    if kind == "boolean":
+        return _compile_boolean(schema)
+    return lambda value, path, repairs: value
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+class CompiledSchema:
+    """Validator for one tool output schema (top-level object)."""
+
+    def __init__(self, name: str, schema: dict):
+        self.name = name
+        self.schema = schema
+        self._props = {
+            key: _compile(sub) for key, sub in schema.get("properties", {}).items()
+        }
+        self._required = tuple(schema.get("required", ()))
+
+    def validate(
+        self,
+        payload: Any,
+        label: str | None = None,
+        only: list[str] | None = None,
+    ) -> tuple[dict, list[str]]:
+        """Check and repair payload in a copy.
+
+        Returns (result, missing) — missing lists top-level required fields
+        that are absent or unrepairable; everything else is fixed locally.
+        only — restrict the check to these fields (re-ask answers).
+        """
+        fields = only if only is not None else list(self._props)
+        if not isinstance(payload, dict):
+            return {}, [f for f in fields if f in self._required]
+
+        repairs: list[str] = []
+        result = dict(payload)
+        missing = []
+        for key in fields:
+            check = self._props.get(key)
+            if check is None:
+                continue
+            if key in payload and payload[key] is not None:
+                try:
+                    result[key] = check(payload[key], key, repairs)
+                    continue
+                except _Invalid as e:
+                    repairs.append(f"{e}: unrepairable")
+            result.pop(key, None)
+            if key in self._required:
+                missing.append(key)
+
+        if repairs:
+            logger.warning(f"~~~ [{label or self.name}] repaired output: {'; '.join(repairs)}")
+        return result, missing
+
+    def subschema(self, fields: list[str]) -> dict:
+        """Schema asking only for the given top-level fields (for re-asks)."""
+        props = self.schema.get("properties", {})
+        return {
+            "type": "object",
+            "properties": {f: props[f] for f in fields if f in props},
+            "required": [f for f in fields if f in props],
+        }
+
+
+_by_name: dict[str, CompiledSchema] = {}
+_by_id: dict[int, CompiledSchema] = {}
+_fingerprints: dict[str, str] = {}
+
+
+def _fingerprint(name: str, schema: dict) -> str:
+    """Short hash of a step's schema + system prompt (identifies prompt versions)."""
+    system = getattr(prompts, name.removesuffix("_SCHEMA") + "_SYSTEM", "")
+    payload = json.dumps(schema, ensure_ascii=False, sort_keys=True) + system
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+
+def compile_all() -> dict[str, CompiledSchema]:
+    """Compile every *_SCHEMA in prompts.py and hash it once. Idempotent.
+
+    Called from the app lifespan; get_validator falls back to it lazily.
+    """
+    for name in dir(prompts):
+        if not name.endswith("_SCHEMA") or name in _by_name:
+            continue
+        schema = getattr(prompts, name)
+        compiled = CompiledSchema(name, schema)
+        _by_name[name] = compiled
+        _by_id[id(schema)] = compiled
+        _fingerprints[name.removesuffix("_SCHEMA").lower()] = _fingerprint(name, schema)
+    return _by_name
+
+
+def prompt_fingerprints() -> dict[str, str]:
+    """step → hash of its schema and system prompt."""
+    compile_all()
+    return _fingerprints
+
+
+def get_validator(schema: dict) -> CompiledSchema:
+    """Precompiled validator for a schema; ad-hoc schemas compile per call."""
+    compiled = _by_id.get(id(schema))
+    if compiled is None and not _by_name:
+        compile_all()
+        compiled = _by_id.get(id(schema))
+    if compiled is None:
+        compiled = CompiledSchema("adhoc", schema)
+    return compiled
@@ -0,0 +1,173 @@
+"""Rule-based split of a resume into experience blocks, without an LLM.
+
+Most resumes follow one of a few layouts: a heading ("Опыт работы",
+"Experience") followed by blocks that each open with a date range, either
+on the company/title line ("TechnoSoft — Менеджер (2022–2024)") or on a
+line of its own (hh.ru: "Январь 2020 — по настоящее время", then company
+and position). segment() finds those blocks in about a millisecond and
+scores how sure it is. run_parse trusts it above SEGMENTER_MIN_CONFIDENCE
+and then only asks the model to classify the resume; anything odd falls
+back to the full LLM parse.
+"""
+
+import os
+import re
+from typing import NamedTuple
+
+SEGMENTER_MIN_CONFIDENCE = float(os.environ.get("SEGMENTER_MIN_CONFIDENCE", "0.75"))
+
+_MONTH = (
+    r"(?:январ[ья]|феврал[ья]|марта?|апрел[ья]|ма[йя]|июн[ья]|июл[ья]|августа?|"
+    r"сентябр[ья]|октябр[ья]|ноябр[ья]|декабр[ья]|"
+    r"янв|фев|мар|апр|июн|июл|авг|сент?|окт|ноя|дек|"
+    r"january|february|march|april|may|june|july|august|september|october|"
+    r"november|december|jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec)\.?"
+)
+_YEAR = r"(?:19|20)\d{2}"
+_POINT = rf"(?:{_MONTH}\s+{_YEAR}|\d{{1,2}}[./]{_YEAR}|{_YEAR})"
+_PRESENT = (
+    r"(?:(?:по\s+)?настоящее\s+время|(?:по\s+)?н\.\s?в\.?|по\s+нв|наст\.\s*вр\.?|сейчас|"
+    r"present|current|now|today)"
+)
+PERIOD = re.compile(
+    rf"(?:с\s+)?{_POINT}\s*(?:[-–—]+|\bпо\b|\bto\b|\buntil\b)\s*(?:{_POINT}|{_PRESENT})",
+    re.IGNORECASE,
+)
+
+_EXPERIENCE_HEADING = re.compile(
+    r"^\s*(?:опыт\s+работы|опыт|профессиональный\s+опыт|трудовая\s+деятельность|"
+    r"места\s+работы|work\s+experience|professional\s+experience|experience|"
+    r"employment(?:\s+history)?)\b[\s:—–\-\d\w]{0,40}$",
+    re.IGNORECASE,
+)
+_OTHER_HEADING = re.compile(
+    r"^\s*(?:образование|education|ключевые\s+навыки|навыки|skills|курсы|"
+    r"повышение\s+квалификации|сертификаты|certifications?|знание\s+языков|языки|"
+    r"languages|о\s+себе|about(?:\s+me)?|дополнительная\s+информация|"
+    r"additional\s+information|проекты|projects|достижения|контакты|contacts|"
+    r"хобби|hobbies|портфолио|portfolio|рекомендации|references)\s*(?::.*)?$",
+    re.IGNORECASE,
+)
+_DURATION = re.compile(
+    r"^\s*(?:\d+\s*(?:год|года|лет|месяц|месяца|месяцев|years?|months?|yrs?|mos?)\b\s*)+$",
+    re.IGNORECASE,
+)
+_BULLET = re.compile(r"^\s*[-•*–·▪●◦]\s*")
+_TITLE_TRIM = " \t()[]|,;:—–-"
+MAX_HEADER_LINE = 90  # longer lines are prose, not company/title
+
+
+class Segmentation(NamedTuple):
+    sections: list[dict]
+    confidence: float
+
+
+class _Line(NamedTuple):
+    start: int  # raw offset
+    end: int  # raw offset, excluding newline
+    text: str
+
+
+def _lines(raw_text: str) -> list[_Line]:
+    lines, pos = [], 0
+    for chunk in raw_text.splitlines(keepends=True):
+        text = chunk.rstrip("\r\n")
+        lines.append(_Line(pos, pos + len(text), text))
+        pos += len(chunk)
+    return lines
+
+
+def _is_header_candidate(text: str) -> bool:
+    stripped = text.strip()
+    return bool(stripped) and not _BULLET.match(text) and len(stripped) <= MAX_HEADER_LINE
+
+
+def _first_year(period: str) -> int | None:
+    match = re.search(_YEAR, period)
+    return int(match.group()) if match else None
+
+
+def segment(raw_text: str) -> Segmentation:
+    lines = _lines(raw_text)
+    confidence = 1.0
+
+    # Experience zone: after its heading, up to the next section heading
+    heading = next((i for i, l in enumerate(lines) if _EXPERIENCE_HEADING.match(l.text)
+                    and not PERIOD.search(l.text)), None)
+    zone_start = heading + 1 if heading is not None else 0
+    if heading is None:
+        confidence *= 0.85
+
+    period_lines = [
+        i for i in range(zone_start, len(lines))
+        if not _BULLET.match(lines[i].text) and PERIOD.search(lines[i].text)
+    ]
+    if not period_lines:
+        return Segmentation([], 0.0)
+    zone_end = next(
+        (i for i in range(period_lines[0] + 1, len(lines)) if _OTHER_HEADING.match(lines[i].text)),
+        len(lines),
+    )
+    period_lines = [i for i in period_lines if i < zone_end]
+
+    # Each period line opens a block; a short line just above it (after a
+    # blank line) is the block's title line ("Менеджер\nООО Ромашка, 2020–2022")
+    blocks = []
+    for i in period_lines:
+        match = PERIOD.search(lines[i].text)
+        residue = (lines[i].text[:match.start()] + " " + lines[i].text[match.end():]).strip(_TITLE_TRIM)
+        start = i
+        title_parts = [residue] if len(re.findall(r"\w{2,}", residue)) else []
+        prev = i - 1
+        if (
+            prev >= zone_start
+            and _is_header_candidate(lines[prev].text)
+            and (prev == zone_start or not lines[prev - 1].text.strip())
+            and (not blocks or prev > blocks[-1]["header_end"])
+        ):
+            start = prev
+            title_parts.insert(0, lines[prev].text.strip(_TITLE_TRIM))
+        header_end = i
+        if not title_parts:
+            # Date on its own line (hh.ru): company and position follow
+            following = []
+            j = i + 1
+            while j < zone_end and len(following) < 4 and _is_header_candidate(lines[j].text):
+                if not _DURATION.match(lines[j].text):
+                    following.append(lines[j].text.strip(_TITLE_TRIM))
+                header_end = j
+                j += 1
+            if following:
+                title_parts += [following[0], following[-1]] if len(following) > 1 else following
+        blocks.append({
+            "start": start,
+            "header_end": header_end,
+            "title": " — ".join(p for p in title_parts if p),
+            "period": match.group().strip(),
+        })
+
+    sections = []
+    for n, block in enumerate(blocks):
+        end_line = blocks[n + 1]["start"] if n + 1 < len(blocks) else zone_end
+        body = [l for l in lines[block["header_end"] + 1:end_line] if l.text.strip()]
+        start_off = lines[block["start"]].start
+        end_off = lines[end_line - 1].end if end_line > block["start"] else lines[block["start"]].end
+        if not block["title"]:
+            confidence *= 0.6
+        if not body:
+            confidence *= 0.7
+        sections.append({
+            "block_id": n + 1,
+            "section_title": block["title"],
+            "period": block["period"],
+            "full_text": raw_text[start_off:end_off].strip(),
+        })
+
+    # Text in the zone before the first block was not assigned to any block
+    unassigned = [l for l in lines[zone_start:blocks[0]["start"]] if l.text.strip()]
+    if len(unassigned) > 2:
+        confidence *= 0.7
+    years = [_first_year(b["period"]) for b in blocks]
+    if years != sorted(years) and years != sorted(years, reverse=True):
+        confidence *= 0.8
+    return Segmentation(sections, round(confidence, 3))
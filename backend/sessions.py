@@ -0,0 +1,187 @@
+"""Stateless session tokens: HMAC-signed, verified without storage.
+
+The session cookie used to be a random id looked up in the process's own
+session dict, then in the user dict, on every authenticated request. A
+second worker did not know the id, so it logged everyone out. Now the
+cookie carries the claims it needs, signed:
+
+    v<kid>.<base64url(json claims)>.<base64url(hmac-sha256)>
+
+claims: {"sub": tg_id, "exp": unix time, "jti": token id, "user": {...}}.
+"user" holds the public profile fields, so get_current_user builds the
+user dict from the token alone.
+
+Keys: SESSION_KEYS="2:new-secret,1:old-secret". The first key signs, and
+all listed keys verify, so a key can be rotated without logging anyone
+out. Without SESSION_KEYS, key 1 is derived from TELEGRAM_BOT_TOKEN,
+which every worker already shares. With neither, a random per-process
+key is used (development only).
+
+Logout revokes the token's jti until it would expire anyway. The
+revoked set lives in storage, and each worker keeps a Bloom filter of
+it, refreshed every REVOCATION_REFRESH_SECONDS. A request costs one
+filter probe, and only a filter hit asks storage. SESSION_REVOCATION=0
+turns the check off: logout then only clears the cookie.
+
+Limitation: storage is still in-process memory (storage.py), so a
+revocation is only seen by the worker that handled the logout. Other
+workers accept the token until it expires (SESSION_TTL). The refresh
+picks up other workers' logouts once storage is shared.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import math
+import os
+import secrets
+import time
+from typing import Any
+
+import orjson
+
+from storage import storage
+
+logger = logging.getLogger("llm")
+
+SESSION_TTL = 86400
+SESSION_REVOCATION = os.environ.get("SESSION_REVOCATION", "1") == "1"
+REVOCATION_REFRESH_SECONDS = 30.0
+REVOCATION_CAPACITY = 100_000  # revoked tokens alive at once
+REVOCATION_FP_RATE = 0.01
+
+USER_CLAIMS = ("tg_id", "username", "first_name", "photo_url", "tier")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _load_keys() -> tuple[str, dict[str, bytes]]:
+    """(signing key id, all verification keys by id)."""
+    configured = os.environ.get("SESSION_KEYS", "")
+    keys: dict[str, bytes] = {}
+    for item in configured.split(","):
+        kid, _, secret = item.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret.encode()
+    if keys:
+        return next(iter(keys)), keys
+    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if bot_token:
+        return "1", {"1": hmac.new(bot_token.encode(), b"session-key-v1", hashlib.sha256).digest()}
+    logger.warning("!!! [auth] no SESSION_KEYS or TELEGRAM_BOT_TOKEN: sessions signed with a per-process key")
+    return "0", {"0": secrets.token_bytes(32)}
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = REVOCATION_CAPACITY, fp_rate: float = REVOCATION_FP_RATE):
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> list[int]:
+        # Double hashing: h1 + i*h2 from one blake2b digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class SessionTokens:
+    def __init__(self):
+        self._kid, self._keys = _load_keys()
+        self._revoked = BloomFilter()
+        self._refreshed_at = 0.0
+        self.verified = 0
+        self.rejected = 0
+        self.bloom_hits = 0  # probes that had to ask storage
+        self.revoked_hits = 0
+
+    def _sign(self, kid: str, payload: str) -> str:
+        return _b64(hmac.new(self._keys[kid], f"v{kid}.{payload}".encode(), hashlib.sha256).digest())
+
+    def issue(self, user: dict[str, Any], ttl: int = SESSION_TTL) -> str:
+        claims = {
+            "sub": user["tg_id"],
+            "exp": int(time.time()) + ttl,
+            "jti": secrets.token_urlsafe(12),
+            "user": {k: user[k] for k in USER_CLAIMS if user.get(k) is not None},
+        }
+        payload = _b64(orjson.dumps(claims))
+        return f"v{self._kid}.{payload}.{self._sign(self._kid, payload)}"
+
+    def verify(self, token: str) -> dict[str, Any] | None:
+        """Claims of a valid, unexpired, unrevoked token; None otherwise."""
+        claims = self._decode(token)
+        if claims is None:
+            self.rejected += 1
+            return None
+        if SESSION_REVOCATION and self._is_revoked(claims["jti"]):
+            self.revoked_hits += 1
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims
+
+    def _decode(self, token: str) -> dict[str, Any] | None:
+        version, _, rest = token.partition(".")
+        payload, _, signature = rest.partition(".")
+        kid = version[1:]
+        if not version.startswith("v") or kid not in self._keys or not payload or not signature:
+            return None
+        if not hmac.compare_digest(signature, self._sign(kid, payload)):
+            return None
+        try:
+            claims = orjson.loads(_unb64(payload))
+        except ValueError:
+            return None
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+            return None
+        return claims
+
+    def revoke(self, token: str) -> bool:
+        """Revoke a valid token until its expiry; False if it was not valid."""
+        claims = self._decode(token)
+        if claims is None:
+            return False
+        storage.revoke_session(claims["jti"], claims["exp"])
+        self._revoked.add(claims["jti"])
+        return True
+
+    def _is_revoked(self, jti: str) -> bool:
+        now = time.monotonic()
+        if now - self._refreshed_at >= REVOCATION_REFRESH_SECONDS:
+            # Rebuilt from storage: picks up other workers' logouts, drops expired ones
+            revoked = BloomFilter()
+            for revoked_jti in storage.revoked_sessions():
+                revoked.add(revoked_jti)
+            self._revoked, self._refreshed_at = revoked, now
+        if jti not in self._revoked:
+            return False
+        self.bloom_hits += 1
+        return storage.is_session_revoked(jti)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "key_id": self._kid,
+            "revocation": SESSION_REVOCATION,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "bloom_hits": self.bloom_hits,
+            "revoked_hits": self.revoked_hits,
+        }
+
+
+session_tokens = SessionTokens()
@@ -0,0 +1,250 @@
+"""Local skill dictionary: find and canonicalize skills in resume text.
+
+skills.json maps each canonical skill name, by key_skills category, to
+its aliases ("Яндекс.Директ", "Yandex Direct" → "Яндекс Директ"). All
+names and aliases are compiled into one Aho-Corasick automaton. A single
+pass over raw_text then finds every mention, whatever the dictionary
+size.
+
+The parse step uses it to cross-check the model's key_skills:
+  - model skills are renamed to canonical names and deduplicated;
+  - known tools the model missed are added;
+  - known hard skills that the text never mentions are dropped.
+run_roles gets the same canonical names, so role matching and the role
+market cache see "PostgreSQL" and not "Postgres" in one resume and
+"postgresql" in the next.
+
+The dictionary is hot-reloaded: every SKILLS_RELOAD_SECONDS the file's
+mtime is checked, and a changed file is compiled and swapped in without a
+restart. A file that fails to load leaves the current index in place.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import NamedTuple
+
+logger = logging.getLogger("llm")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SKILLS_DICT_PATH = os.environ.get("SKILLS_DICT_PATH", os.path.join(HERE, "skills.json"))
+SKILLS_RELOAD_SECONDS = 5.0
+
+CATEGORIES = ("hard_skills", "soft_skills", "domain_knowledge")
+EXACT_CASE_MAX_LEN = 3  # "Go", "JS", "k8s": too short to match case-insensitively
+
+
+def _fold(text: str) -> str:
+    """Lower case and ё → е, keeping positions aligned with text."""
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = "".join(c.lower()[0] for c in text)
+    return folded.replace("ё", "е")
+
+
+class Skill(NamedTuple):
+    name: str
+    category: str
+
+
+class _Pattern(NamedTuple):
+    alias: str  # as written in the dictionary
+    skill: Skill
+    exact_case: bool
+
+
+class _Automaton:
+    """Aho-Corasick over folded aliases; matches respect word boundaries."""
+
+    def __init__(self, patterns: list[_Pattern]):
+        self.patterns = patterns
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        for pid, pattern in enumerate(patterns):
+            node = 0
+            for ch in _fold(pattern.alias):
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(pid)
+
+        # Failure links, breadth-first; outputs inherit from their fail node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    @property
+    def size(self) -> int:
+        return len(self._goto)
+
+    def matches(self, text: str) -> list[tuple[int, int, _Pattern]]:
+        """(start, end, pattern) of every whole-word mention, overlaps included."""
+        folded = _fold(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        found = []
+        node = 0
+        for i, ch in enumerate(folded):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in out[node]:
+                pattern = self.patterns[pid]
+                start, end = i + 1 - len(pattern.alias), i + 1
+                if pattern.exact_case and text[start:end] != pattern.alias:
+                    continue
+                # Whole words only: "SQL" is not in "PostgreSQL", "Java" not in "JavaScript"
+                if pattern.alias[0].isalnum() and start > 0 and folded[start - 1].isalnum():
+                    continue
+                if pattern.alias[-1].isalnum() and end < len(folded) and folded[end].isalnum():
+                    continue
+                # Short aliases in an English compound: "Go-to-market" is not Go
+                # ("Go-разработчик" still is)
+                if pattern.exact_case and folded[end:end + 1] == "-" and "a" <= folded[end + 1:end + 2] <= "z":
+                    continue
+                found.append((start, end, pattern))
+        return found
+
+
+def _compile(data: dict) -> tuple[_Automaton, dict[str, Skill]]:
+    patterns: list[_Pattern] = []
+    by_alias: dict[str, Skill] = {}
+    for category in CATEGORIES:
+        for name, aliases in data.get(category, {}).items():
+            skill = Skill(name, category)
+            for alias in dict.fromkeys([name, *aliases]):
+                alias = alias.strip()
+                if not alias:
+                    continue
+                exact = len(alias) <= EXACT_CASE_MAX_LEN or alias.isupper()
+                patterns.append(_Pattern(alias, skill, exact))
+                by_alias.setdefault(_fold(alias), skill)
+    return _Automaton(patterns), by_alias
+
+
+class SkillIndex:
+    def __init__(self, path: str = SKILLS_DICT_PATH):
+        self._path = path
+        self._automaton: _Automaton | None = None
+        self._by_alias: dict[str, Skill] = {}
+        self._mtime = 0.0
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.extractions = 0
+
+    def load(self) -> bool:
+        """Compile the dictionary file; False (and the old index kept) on error."""
+        try:
+            mtime = os.path.getmtime(self._path)
+            with open(self._path, encoding="utf-8") as f:
+                automaton, by_alias = _compile(json.load(f))
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"!!! [skills] failed to load {self._path}: {e}")
+            return False
+        # One assignment each: requests in flight keep the index they started with
+        self._automaton, self._by_alias = automaton, by_alias
+        self._mtime = mtime
+        self.reloads += 1
+        logger.info(
+            f"=== Skills: {len(set(by_alias.values()))} skills, "
+            f"{len(automaton.patterns)} aliases, {automaton.size} states"
+        )
+        return True
+
+    def _current(self) -> _Automaton | None:
+        now = time.monotonic()
+        if self._automaton is None or now - self._checked_at >= SKILLS_RELOAD_SECONDS:
+            self._checked_at = now
+            try:
+                changed = os.path.getmtime(self._path) != self._mtime
+            except OSError:
+                changed = False
+            if changed or self._automaton is None:
+                self.load()
+        return self._automaton
+
+    def extract(self, text: str) -> list[Skill]:
+        """Skills mentioned in text, in order of first mention.
+
+        Overlapping mentions resolve to the longest one: "Яндекс Директ",
+        not "Директ"; "amoCRM", not "CRM".
+        """
+        automaton = self._current()
+        if automaton is None:
+            return []
+        self.extractions += 1
+        found = sorted(automaton.matches(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        skills: dict[Skill, None] = {}
+        covered = 0
+        for start, end, pattern in found:
+            if start < covered:
+                continue
+            covered = end
+            skills[pattern.skill] = None
+        return list(skills)
+
+    def canonical(self, name: str) -> Skill | None:
+        self._current()
+        return self._by_alias.get(_fold(name.strip()))
+
+    def normalize(self, key_skills: dict | None) -> dict[str, list[str]]:
+        """key_skills with known skills renamed to canonical names, deduplicated."""
+        key_skills = key_skills or {}
+        seen: set[str] = set()
+        normalized: dict[str, list[str]] = {}
+        for category in CATEGORIES:
+            names = []
+            for name in key_skills.get(category, []):
+                skill = self.canonical(name)
+                name = skill.name if skill else name.strip()
+                if name and _fold(name) not in seen:
+                    seen.add(_fold(name))
+                    names.append(name)
+            normalized[category] = names
+        return normalized
+
+    def cross_check(self, key_skills: dict | None, text: str) -> dict[str, list[str]]:
+        """The model's key_skills checked against the dictionary matches in text."""
+        mentioned = self.extract(text)
+        mentioned_names = {s.name for s in mentioned}
+        checked = self.normalize(key_skills)
+        for category in CATEGORIES:
+            checked[category] = [
+                name for name in checked[category]
+                if category != "hard_skills"
+                or name in mentioned_names
+                or (skill := self.canonical(name)) is None
+                or skill.category != "hard_skills"
+            ]
+        present = {_fold(n) for names in checked.values() for n in names}
+        for skill in mentioned:
+            if _fold(skill.name) not in present:
+                checked[skill.category].append(skill.name)
+        return checked
+
+    def stats(self) -> dict:
+        automaton = self._automaton
+        return {
+            "skills": len(set(self._by_alias.values())),
+            "aliases": len(automaton.patterns) if automaton else 0,
+            "reloads": self.reloads,
+            "extractions": self.extractions,
+        }
+
+
+skill_index = SkillIndex()
@@ -0,0 +1,115 @@
+"""Speculative rewrite of the recommended role while the user is deciding.
+
+When roles are ready, the rewrite for recommendation.primary_role is
+started in the background on the "speculative" tier, a background tier
+of the fair queue: its calls are served only while no other tenant is
+waiting, so it only uses capacity nobody else is waiting for. Once a request
+adopts it, the job continues as that request's tenant: its queued and
+later calls leave the background tier. POST /rewrite for
+the same role adopts the running (or finished) job instead of starting
+over; any other role cancels it. Blocks it finished are already saved
+in rewrite_partial, so even a cancelled speculation is not wasted if the
+user later picks that role.
+
+Opt-in: SPECULATIVE_REWRITE=1.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from llm import rpm_limiter
+from tenants import Tenant, TenantSlot, current_tenant, set_tenant
+
+SPECULATIVE_REWRITE = os.environ.get("SPECULATIVE_REWRITE", "0") == "1"
+SPECULATIVE_TIER = "speculative"
+MAX_SPECULATIONS = 64  # oldest are cancelled beyond this
+
+
+class Speculation:
+    __slots__ = ("role", "task", "adopted", "slot")
+
+    def __init__(self, role: str, tenant: Tenant):
+        self.role = role
+        self.task: asyncio.Task | None = None
+        self.adopted = False  # a real request is now waiting on it
+        # The job's tenant: speculative tier until adopted
+        self.slot = TenantSlot(Tenant(tenant.key, SPECULATIVE_TIER))
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    # Unadopted speculations may fail; don't log "exception never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+class SpeculativeRewrites:
+    def __init__(self):
+        self._running: OrderedDict[str, Speculation] = OrderedDict()  # task_id → job
+        self.started = 0
+        self.adopted = 0
+        self.cancelled = 0
+        self.skipped = 0  # no spare capacity / budget when roles finished
+
+    def start(
+        self,
+        task_id: str,
+        role: str,
+        job: Callable[[Speculation], Awaitable[dict]],
+    ) -> Speculation:
+        """Run job(spec) in the background on the speculative tier."""
+        self.discard(task_id)
+        spec = Speculation(role, current_tenant())
+
+        async def run() -> dict:
+            set_tenant(spec.slot)
+            return await job(spec)
+
+        spec.task = asyncio.create_task(run())
+        spec.task.add_done_callback(_retrieve)
+        self._running[task_id] = spec
+        self.started += 1
+        while len(self._running) > MAX_SPECULATIONS:
+            _, oldest = self._running.popitem(last=False)
+            self._cancel(oldest)
+        return spec
+
+    def take(self, task_id: str, role: str) -> Speculation | None:
+        """Hand over the speculation for task_id if it is for `role`,
+        moving it to the caller's tenant; otherwise cancel it and return
+        None."""
+        spec = self._running.pop(task_id, None)
+        if spec is None:
+            return None
+        if spec.role != role or spec.task.cancelled():
+            self._cancel(spec)
+            return None
+        spec.adopted = True
+        speculative_tenant, spec.slot.tenant = spec.slot.tenant, current_tenant()
+        rpm_limiter.retag(speculative_tenant, spec.slot.tenant)
+        self.adopted += 1
+        return spec
+
+    def discard(self, task_id: str) -> None:
+        spec = self._running.pop(task_id, None)
+        if spec is not None:
+            self._cancel(spec)
+
+    def _cancel(self, spec: Speculation) -> None:
+        if not spec.task.done():
+            spec.task.cancel()
+        self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SPECULATIVE_REWRITE,
+            "running": sum(1 for s in self._running.values() if not s.task.done()),
+            "started": self.started,
+            "adopted": self.adopted,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+        }
+
+
+speculative = SpeculativeRewrites()
@@ -1,16 +1,98 @@
 """In-memory task storage for MVP. Replace with Redis/PostgreSQL for production."""
 
+import base64
+import bisect
 import uuid
 import time
-from typing import Any
+from collections.abc import MutableMapping
+from typing import Any, Iterator
+
+from artifacts import ArtifactStore
+from recheck_history import RecheckHistory
+from rewrite_versions import RewriteVersions
+
+# Large fields kept compressed in the artifact store, decoded on access
+PACKED_FIELDS = (
+    "raw_text",
+    "parse_result",
+    "scoring",
+    "annotations",
+    "roles",
+    "rewrite",
+    "rewrite_partial",
+)
+
+
+class _Packed:
+    __slots__ = ("key",)
+
+    def __init__(self, key: str):
+        self.key = key
+
+
+class TaskRecord(MutableMapping):
+    """Task dict whose large fields live in the artifact store.
+
+    Reads of PACKED_FIELDS decompress lazily; step results that quote
+    raw_text verbatim (sections[*].full_text) are stored as slices of it.
+    """
+
+    __slots__ = ("_fields", "_store")
+
+    def __init__(self, store: ArtifactStore, **fields: Any):
+        self._fields: dict[str, Any] = {}
+        self._store = store
+        self.update(fields)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._fields[key]
+        if isinstance(value, _Packed):
+            return self._store.get(value.key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._release(key)
+        if key in PACKED_FIELDS and value is not None:
+            base = self._fields.get("raw_text") if key != "raw_text" else None
+            value = _Packed(self._store.put(value, base.key if base else None))
+        self._fields[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        self._release(key)
+        del self._fields[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def is_set(self, key: str) -> bool:
+        """Field present and not None, without decoding a packed value."""
+        return self._fields.get(key) is not None
+
+    def _release(self, key: str) -> None:
+        old = self._fields.get(key)
+        if isinstance(old, _Packed):
+            self._store.release(old.key)
+
+    def release_all(self) -> None:
+        """Drop artifact references (task expired)."""
+        for key in list(self._fields):
+            self._release(key)
+        self._fields.clear()
 
 
 class TaskStorage:
     def __init__(self, ttl_seconds: int = 86400):
-        self._tasks: dict[str, dict[str, Any]] = {}
+        self._artifacts = ArtifactStore()
+        self._tasks: dict[str, TaskRecord] = {}
         self._hash_index: dict[str, str] = {}  # content_hash → task_id
         self._users: dict[int, dict[str, Any]] = {}  # tg_id → user
-        self._sessions: dict[str, dict[str, Any]] = {}  # token → session
+        # tg_id → [(created_at, task_id)], append-only, so sorted by creation
+        self._user_index: dict[int, list[tuple[float, str]]] = {}
+        self._revoked_sessions: dict[str, float] = {}  # session jti → its expiry
+        self._usage: dict[str, dict[str, Any]] = {}  # ledger key → counters
         self._ttl = ttl_seconds
 
     def create_task(
@@ -21,26 +103,33 @@ class TaskStorage:
         user_id: int | None = None,
     ) -> str:
         task_id = str(uuid.uuid4())
-        self._tasks[task_id] = {
-            "id": task_id,
-            "created_at": time.time(),
-            "file_name": file_name,
-            "raw_text": raw_text,
-            "content_hash": content_hash,
-            "user_id": user_id,
-            "parse_result": None,
-            "scoring": None,
-            "annotations": None,
-            "roles": None,
-            "selected_role": None,
-            "rewrite": None,
-            "rechecks": [],
-        }
+        self._tasks[task_id] = TaskRecord(
+            self._artifacts,
+            id=task_id,
+            version=0,  # bumped on every update; drives ETags
+            created_at=time.time(),
+            file_name=file_name,
+            raw_text=raw_text,
+            content_hash=content_hash,
+            user_id=user_id,
+            parse_result=None,
+            scoring=None,
+            annotations=None,
+            roles=None,
+            selected_role=None,
+            rewrite=None,
+            rewrite_partial=None,  # {"role", "blocks"} of an unfinished rewrite
+            rewrite_versions=RewriteVersions(),  # diffs of every rewrite / edit
+            rechecks=RecheckHistory(),  # bounded; deltas between snapshots
+        )
         if content_hash:
             self._hash_index[content_hash] = task_id
+        if user_id is not None:
+            task = self._tasks[task_id]
+            self._user_index.setdefault(user_id, []).append((task["created_at"], task_id))
         return task_id
 
-    def find_by_hash(self, content_hash: str) -> dict[str, Any] | None:
+    def find_by_hash(self, content_hash: str) -> TaskRecord | None:
         task_id = self._hash_index.get(content_hash)
         if task_id is None:
             return None
@@ -50,12 +139,14 @@ class TaskStorage:
             return None
         return task
 
-    def get_task(self, task_id: str) -> dict[str, Any] | None:
+    def get_task(self, task_id: str) -> TaskRecord | None:
         task = self._tasks.get(task_id)
         if task is None:
             return None
         if time.time() - task["created_at"] > self._ttl:
             del self._tasks[task_id]
+            self._usage.pop(f"task:{task_id}", None)
+            task.release_all()
             return None
         return task
 
@@ -63,6 +154,7 @@ class TaskStorage:
         task = self._tasks.get(task_id)
         if task is not None:
             task.update(kwargs)
+            task["version"] += 1
 
     # --- User / Session ---
 
@@ -87,33 +179,77 @@ class TaskStorage:
     def get_user(self, tg_id: int) -> dict[str, Any] | None:
         return self._users.get(tg_id)
 
-    def create_session(self, tg_id: int) -> str:
-        token = str(uuid.uuid4())
-        self._sessions[token] = {
-            "token": token,
-            "tg_id": tg_id,
-            "created_at": time.time(),
-        }
-        return token
+    # --- Revoked sessions (tokens themselves are stateless, see sessions.py) ---
+
+    def revoke_session(self, jti: str, expires_at: float) -> None:
+        self._revoked_sessions[jti] = expires_at
+
+    def is_session_revoked(self, jti: str) -> bool:
+        return jti in self._revoked_sessions
+
+    def revoked_sessions(self) -> list[str]:
+        """Revoked jtis whose tokens have not expired yet; drops the rest."""
+        now = time.time()
+        expired = [j for j, exp in self._revoked_sessions.items() if exp < now]
+        for jti in expired:
+            del self._revoked_sessions[jti]
+        return list(self._revoked_sessions)
 
-    def get_session(self, token: str) -> dict[str, Any] | None:
-        session = self._sessions.get(token)
-        if session is None:
+    def user_task_page(
+        self, tg_id: int, after: str | None = None, limit: int = 20
+    ) -> tuple[list[TaskRecord], str | None]:
+        """A page of the user's live tasks, newest first, and the cursor
+        for the next page (None on the last one). O(limit + log n).
+
+        Raises ValueError for a cursor this storage did not issue.
+        """
+        entries = self._user_index.get(tg_id, [])
+        # Expired tasks are the oldest: trim them off the front
+        expired = bisect.bisect_left(entries, (time.time() - self._ttl,))
+        if expired:
+            del entries[:expired]
+
+        end = len(entries)
+        if after is not None:
+            try:
+                created_at, _, task_id = base64.urlsafe_b64decode(after.encode()).decode().partition(":")
+                created = float(created_at)
+            except ValueError as e:
+                raise ValueError(f"invalid cursor: {after!r}") from e
+            # Tasks created in the same instant keep their append order
+            end = bisect.bisect_left(entries, (created,))
+            while end < len(entries) and entries[end][0] == created and entries[end][1] != task_id:
+                end += 1
+
+        page: list[TaskRecord] = []
+        i = end - 1
+        while i >= 0 and len(page) < limit:
+            task = self.get_task(entries[i][1])
+            if task is not None:
+                page.append(task)
+            i -= 1
+        if i < 0 or not page:
+            return page, None
+        last = page[-1]
+        cursor = base64.urlsafe_b64encode(f"{last['created_at']!r}:{last['id']}".encode()).decode()
+        return page, cursor
+
+    # --- Usage ledger ---
+
+    def get_usage(self, key: str) -> dict[str, Any] | None:
+        entry = self._usage.get(key)
+        if entry is None:
             return None
-        if time.time() - session["created_at"] > self._ttl:
-            del self._sessions[token]
+        if time.time() - entry["updated_at"] > 2 * self._ttl:
+            del self._usage[key]
             return None
-        return session
-
-    def get_user_tasks(self, tg_id: int, limit: int = 20) -> list[dict[str, Any]]:
-        user_tasks = [
-            t
-            for t in self._tasks.values()
-            if t.get("user_id") == tg_id
-            and time.time() - t["created_at"] <= self._ttl
-        ]
-        user_tasks.sort(key=lambda t: t["created_at"], reverse=True)
-        return user_tasks[:limit]
+        return entry["counters"]
+
+    def save_usage(self, key: str, counters: dict[str, Any]) -> None:
+        self._usage[key] = {"counters": counters, "updated_at": time.time()}
+
+    def memory_stats(self) -> dict[str, Any]:
+        return {"tasks": len(self._tasks), **self._artifacts.stats()}
 
 
 storage = TaskStorage()
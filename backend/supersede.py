@@ -0,0 +1,66 @@
+"""Latest-wins runs for requests a user repeats faster than they finish.
+
+Regenerating a bullet is iterative: the user tweaks the comment and
+clicks again before the previous answer has arrived, and that answer no
+longer matters. Each run is keyed by (task, block_id, bullet_index).
+Starting a run cancels the in-flight run for the same key, which closes
+its LLM stream, so it stops using a pool slot and output tokens.
+
+A run pumps text chunks from an async iterator into a queue of
+(event, payload) items:
+  ("delta", text)      another piece of output
+  ("done", None)       the iterator is exhausted
+  ("superseded", None) a newer run for the same key cancelled this one
+  ("error", exception) the iterator raised
+"""
+
+import asyncio
+from typing import AsyncIterator, Hashable
+
+
+class LatestOnly:
+    def __init__(self):
+        self._running: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.superseded = 0
+
+    def start(self, key: Hashable, chunks: AsyncIterator[str]) -> tuple[asyncio.Task, asyncio.Queue]:
+        """Pump chunks into a queue in the background; cancel key's previous run."""
+        previous = self._running.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump() -> None:
+            try:
+                async for chunk in chunks:
+                    queue.put_nowait(("delta", chunk))
+            except asyncio.CancelledError:
+                queue.put_nowait(("superseded", None))
+                raise
+            except Exception as e:
+                queue.put_nowait(("error", e))
+            else:
+                queue.put_nowait(("done", None))
+
+        task = asyncio.create_task(pump())
+        self._running[key] = task
+        self.started += 1
+
+        def forget(done: asyncio.Task) -> None:
+            if self._running.get(key) is done:
+                del self._running[key]
+
+        task.add_done_callback(forget)
+        return task, queue
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._running),
+            "started": self.started,
+            "superseded": self.superseded,
+        }
+
+
+regenerations = LatestOnly()
@@ -0,0 +1,80 @@
+"""Who an LLM call is made for, and how much of the shared capacity they get.
+
+Every request is bound to a tenant — the Telegram user when logged in,
+otherwise the client IP — and the tenant's tier picks its weight in the
+fair queue in front of the RPM limiter (see llm.TokenBucket). Weights are
+configured as LLM_TENANT_WEIGHTS="user=2,anonymous=1"; a user record with
+a "tier" field (e.g. "paid") uses that tier instead of "user".
+BACKGROUND_TIERS are below every weight: their calls are served only
+while no other tier is waiting.
+"""
+
+import os
+from contextvars import ContextVar
+from typing import NamedTuple
+
+DEFAULT_TENANT_WEIGHTS = "paid=4,user=2,anonymous=1,speculative=0.1"
+BACKGROUND_TIERS = frozenset({"speculative"})
+
+
+def _parse_weights(spec: str) -> dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        tier, sep, weight = item.partition("=")
+        if sep and tier.strip():
+            weights[tier.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+TENANT_WEIGHTS = _parse_weights(os.environ.get("LLM_TENANT_WEIGHTS", DEFAULT_TENANT_WEIGHTS))
+
+
+class Tenant(NamedTuple):
+    key: str  # "user:<tg_id>" or "ip:<addr>"
+    tier: str
+
+    @property
+    def weight(self) -> float:
+        return TENANT_WEIGHTS.get(self.tier, 1.0)
+
+    @property
+    def background(self) -> bool:
+        return self.tier in BACKGROUND_TIERS
+
+    @property
+    def queue(self) -> str:
+        """Fair-queue identity: the same user's work in another tier (e.g.
+        speculative) queues separately and never delays their own requests."""
+        return f"{self.key}/{self.tier}"
+
+
+# Work started outside a request (startup, scripts) shares one tenant
+SYSTEM_TENANT = Tenant("system", "anonymous")
+
+class TenantSlot:
+    """Tenant binding another request can take over: a speculative job
+    adopted by a real request continues as that request's tenant."""
+
+    __slots__ = ("tenant",)
+
+    def __init__(self, tenant: Tenant):
+        self.tenant = tenant
+
+
+_current_tenant: ContextVar[Tenant | TenantSlot] = ContextVar("tenant", default=SYSTEM_TENANT)
+
+
+def current_tenant() -> Tenant:
+    bound = _current_tenant.get()
+    return bound.tenant if isinstance(bound, TenantSlot) else bound
+
+
+def set_tenant(tenant: Tenant | TenantSlot) -> None:
+    """Bind the tenant for the rest of the current request (or task)."""
+    _current_tenant.set(tenant)
+
+
+def tenant_for(user: dict | None, client_host: str | None) -> Tenant:
+    if user is not None:
+        return Tenant(f"user:{user['tg_id']}", user.get("tier") or "user")
+    return Tenant(f"ip:{client_host or 'unknown'}", "anonymous")
@@ -94,6 +94,7 @@ MOCK_ROLES = {
             "typical_duties": "Управление проектами, контроль сроков и бюджета",
             "matched_skills": ["Jira", "Confluence"],
             "missing_skills": ["MS Project", "Agile-сертификация"],
+            "required_skills": ["Jira", "Confluence", "MS Project", "Agile"],
             "reports_to": "CTO",
             "works_with": "Разработчики, QA, дизайнеры",
         },
@@ -106,6 +107,7 @@ MOCK_ROLES = {
             "typical_duties": "Управление продуктом, приоритизация бэклога",
             "matched_skills": ["SQL"],
             "missing_skills": ["Figma", "Amplitude", "A/B тесты"],
+            "required_skills": ["SQL", "Figma", "Amplitude", "A/B тесты"],
             "reports_to": "CPO",
             "works_with": "Аналитики, маркетинг, разработка",
         },
@@ -165,6 +167,13 @@ MOCK_RECHECK = {
 # Helper to create a task with mock data
 # ---------------------------------------------------------------------------
 
+def get_metrics() -> dict:
+    with patch("auth.METRICS_TOKEN", "test-metrics-token"):
+        resp = client.get("/api/metrics", headers={"Authorization": "Bearer test-metrics-token"})
+    assert resp.status_code == 200
+    return resp.json()
+
+
 def create_mock_task():
     """Create a task with all mock data pre-populated."""
     task_id = storage.create_task("test.txt", SAMPLE_RESUME)
@@ -180,6 +189,19 @@ def create_mock_task():
     return task_id
 
 
+def connected_request(disconnected: bool = False):
+    """Starlette request for calling endpoint functions directly."""
+    import asyncio
+    from starlette.requests import Request
+
+    async def receive():
+        if disconnected:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+
+
 # ---------------------------------------------------------------------------
 # Unit Tests (mocked LLM)
 # ---------------------------------------------------------------------------
@@ -243,6 +265,80 @@ class TestGetTaskEndpoint:
         assert resp.status_code == 404
 
 
+class TestTaskPolling:
+    """ETag / conditional GET on GET /api/tasks/{taskId}"""
+
+    def test_not_modified_until_update(self):
+        task_id = create_mock_task()
+        first = client.get(f"/api/tasks/{task_id}")
+        etag = first.headers["etag"]
+
+        resp = client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+        storage.update_task(task_id, roles=None)
+        resp = client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+        assert resp.json()["roles"] is None
+
+    def test_not_modified_etag_matches_served_encoding(self):
+        task_id = storage.create_task("small.txt", "short")  # under MIN_COMPRESS_SIZE
+        headers = {"Accept-Encoding": "gzip"}
+        first = client.get(f"/api/tasks/{task_id}", headers=headers)
+        assert "content-encoding" not in first.headers
+        resp = client.get(
+            f"/api/tasks/{task_id}", headers={**headers, "If-None-Match": first.headers["etag"]}
+        )
+        assert resp.status_code == 304
+        assert resp.headers["etag"] == first.headers["etag"]
+
+    def test_gzip_body_cached_per_version(self):
+        from http_cache import task_payloads
+
+        task_id = create_mock_task()
+        headers = {"Accept-Encoding": "gzip"}
+        first = client.get(f"/api/tasks/{task_id}", headers=headers)
+        assert first.headers["content-encoding"] == "gzip"
+        hits = task_payloads.hits
+        second = client.get(f"/api/tasks/{task_id}", headers=headers)
+        assert task_payloads.hits == hits + 1
+        assert second.json() == first.json()
+        assert second.json()["parse"]["resume_type"] == "Список обязанностей"
+
+
+class TestArtifactStorage:
+    """Compressed, deduplicated task payloads."""
+
+    def test_full_text_stored_as_slice_of_raw_text(self):
+        from artifacts import ArtifactStore, _decompress
+
+        store = ArtifactStore()
+        raw_key = store.put(SAMPLE_RESUME)
+        block = SAMPLE_RESUME[SAMPLE_RESUME.index("TechnoSoft"):SAMPLE_RESUME.index("Банк")]
+        parse_key = store.put({"sections": [{"full_text": block}]}, raw_key)
+        store._decoded.clear()
+
+        assert store.get(parse_key) == {"sections": [{"full_text": block}]}
+        assert block.encode() not in _decompress(store._blobs[parse_key])
+
+    def test_identical_results_share_one_blob(self):
+        from storage import TaskStorage
+
+        local = TaskStorage()
+        first = local.create_task("a.txt", SAMPLE_RESUME)
+        second = local.create_task("b.txt", SAMPLE_RESUME)
+        local.update_task(first, roles=MOCK_ROLES)
+        local.update_task(second, roles=MOCK_ROLES)
+        assert local.memory_stats()["artifacts"] == 2  # raw_text + roles
+        assert local.get_task(second)["roles"] == MOCK_ROLES
+
+        local.update_task(first, roles=None)
+        local.update_task(second, roles=None)
+        assert local.memory_stats()["artifacts"] == 1
+
+
 class TestRolesEndpoint:
     """GET /api/tasks/{taskId}/roles"""
 
@@ -316,6 +412,187 @@ class TestRewriteEndpoint:
         assert resp.status_code == 400
 
 
+class TestRewriteResume:
+    """Partial-failure tolerance: finished blocks survive, retry resumes."""
+
+    def _task_with_two_blocks(self):
+        sections = [
+            {**MOCK_DIAGNOSIS["sections"][0], "block_id": 1},
+            {**MOCK_DIAGNOSIS["sections"][0], "block_id": 2},
+        ]
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        storage.update_task(
+            task_id,
+            parse_result={**MOCK_DIAGNOSIS, "sections": sections},
+            scoring=MOCK_SCORE,
+            annotations=sections,
+            roles=MOCK_ROLES,
+        )
+        return task_id
+
+    @patch("llm.RETRY_BACKOFF_SECONDS", 0)
+    def test_failed_block_is_resumed_alone(self):
+        task_id = self._task_with_two_blocks()
+        calls = []
+        fail = {"on": True}
+
+        async def fake_block(section, *args):
+            calls.append(section["block_id"])
+            if section["block_id"] == 2 and fail["on"]:
+                raise RuntimeError("overloaded")
+            return {**MOCK_REWRITE["experiences"][0], "block_id": section["block_id"]}
+
+        meta = {k: MOCK_REWRITE[k] for k in ("summary", "original_summary", "skills", "recommendations")}
+        with patch("llm._rewrite_block", side_effect=fake_block), \
+                patch("llm._rewrite_meta", new_callable=AsyncMock, return_value=meta):
+            resp = client.post(f"/api/tasks/{task_id}/rewrite", json={"selectedRole": "Project Manager"})
+            assert resp.status_code == 500
+            assert calls == [1, 2, 2, 2]  # block 2 retried individually
+            partial = storage.get_task(task_id)["rewrite_partial"]
+            assert [b["block_id"] for b in partial["blocks"]] == [1]
+
+            fail["on"] = False
+            calls.clear()
+            resp = client.post(f"/api/tasks/{task_id}/rewrite", json={"selectedRole": "Project Manager"})
+        assert resp.status_code == 200
+        assert calls == [2]
+        assert [e["block_id"] for e in resp.json()["experiences"]] == [1, 2]
+        assert storage.get_task(task_id)["rewrite_partial"] is None
+
+
+class TestSpeculativeRewrite:
+    """Pre-running the rewrite for the recommended role."""
+
+    def _task_before_roles(self):
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        storage.update_task(
+            task_id,
+            parse_result=MOCK_DIAGNOSIS,
+            scoring=MOCK_SCORE,
+            annotations=MOCK_DIAGNOSIS["sections"],
+        )
+        return task_id
+
+    def _roles_then_rewrite(self, task_id, role):
+        import asyncio
+        import main
+
+        async def scenario():
+            request = connected_request()
+            await main.get_roles(task_id, request)
+            await asyncio.sleep(0)  # speculation starts
+            return await main.rewrite(task_id, main.RewriteRequest(selectedRole=role), request)
+
+        with patch("main.SPECULATIVE_REWRITE", True), \
+             patch("main.run_roles", new=AsyncMock(return_value=MOCK_ROLES)):
+            return asyncio.run(scenario())
+
+    @patch("main.run_rewrite", new_callable=AsyncMock)
+    def test_matching_request_adopts_speculation(self, mock_llm):
+        mock_llm.return_value = MOCK_REWRITE
+        task_id = self._task_before_roles()
+        resp = self._roles_then_rewrite(task_id, "Project Manager")
+        assert json.loads(resp.body)["summary"] == MOCK_REWRITE["summary"]
+        assert mock_llm.call_count == 1
+        assert storage.get_task(task_id)["selected_role"] == "Project Manager"
+
+    @patch("main.run_rewrite", new_callable=AsyncMock)
+    def test_other_role_cancels_speculation(self, mock_llm):
+        from speculation import speculative
+
+        mock_llm.return_value = MOCK_REWRITE
+        task_id = self._task_before_roles()
+        cancelled = speculative.cancelled
+        self._roles_then_rewrite(task_id, "Product Manager")
+        assert speculative.cancelled == cancelled + 1
+        assert mock_llm.call_args_list[-1].args[3] == "Product Manager"
+
+    def test_adopted_speculation_leaves_background_tier(self):
+        import asyncio
+        from llm import TokenBucket
+        from speculation import SpeculativeRewrites
+        from tenants import Tenant, set_tenant
+
+        limiter = TokenBucket(rate_per_minute=6000)
+        limiter.tokens = 0
+        order = []
+
+        async def background_call():
+            set_tenant(Tenant("user:2", "speculative"))
+            await limiter.acquire()
+            order.append("other speculation")
+
+        async def job(spec):
+            await limiter.acquire()
+            order.append("adopted")
+            return MOCK_REWRITE
+
+        async def scenario():
+            others = [asyncio.create_task(background_call()) for _ in range(3)]
+            await asyncio.sleep(0)
+            set_tenant(Tenant("user:1", "user"))
+            specs = SpeculativeRewrites()
+            spec = specs.start("task", "PM", job)
+            await asyncio.sleep(0)  # queued behind the other speculation's calls
+            assert specs.take("task", "PM") is spec
+            await asyncio.gather(spec.task, *others)
+
+        with patch("speculation.rpm_limiter", limiter):
+            asyncio.run(scenario())
+        assert order[0] == "adopted"
+
+
+class TestClientDisconnect:
+    """Work of a client that left is cancelled unless someone else needs it."""
+
+    def _run(self, keep):
+        import asyncio
+        from disconnect import ClientDisconnected, until_disconnect
+
+        state = {}
+
+        async def slow():
+            try:
+                await asyncio.sleep(0.05)
+                return "done"
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        async def scenario():
+            try:
+                state["result"] = await until_disconnect(connected_request(True), slow(), keep=keep)
+            except ClientDisconnected:
+                state["disconnected"] = True
+
+        with patch("disconnect.DISCONNECT_POLL_SECONDS", 0.01):
+            asyncio.run(scenario())
+        return state
+
+    def test_cancelled_on_disconnect(self):
+        assert self._run(keep=lambda: False) == {"cancelled": True, "disconnected": True}
+
+    def test_kept_for_other_waiters(self):
+        assert self._run(keep=lambda: True) == {"result": "done"}
+
+    def test_cancelled_wait_refunds_virtual_time(self):
+        import asyncio
+        from llm import TokenBucket
+
+        async def scenario():
+            limiter = TokenBucket(rate_per_minute=60)
+            limiter.tokens = 0
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            return limiter
+
+        limiter = asyncio.run(scenario())
+        assert limiter.stats()["queued"] == 0 and limiter.stats()["tenants"] == {}
+        assert max(limiter._finish.values()) == limiter._vtime
+
+
 class TestRecheckEndpoint:
     """POST /api/tasks/{taskId}/recheck"""
 
@@ -341,6 +618,388 @@ class TestRecheckEndpoint:
         assert resp.status_code == 400
 
 
+class TestRegenerateEndpoint:
+    """POST /api/tasks/{taskId}/regenerate — streamed, latest request wins."""
+
+    BODY = {
+        "block_id": 1, "bullet_index": 0, "selected_text": "Управлял проектами",
+        "user_comment": "добавь 20%", "full_bullet": "Управлял проектами", "role": "PM",
+    }
+
+    @staticmethod
+    async def _chunks(*parts):
+        for part in parts:
+            yield part
+
+    def test_json(self):
+        task_id = create_mock_task()
+        with patch("main.stream_regenerate_bullet", return_value=self._chunks("Сократил ", "сроки на 20%")):
+            resp = client.post(f"/api/tasks/{task_id}/regenerate", json=self.BODY)
+        assert resp.status_code == 200
+        assert resp.json() == {"new_bullet": "Сократил сроки на 20%"}
+
+    def test_event_stream(self):
+        task_id = create_mock_task()
+        with patch("main.stream_regenerate_bullet", return_value=self._chunks("Сократил ", "сроки")):
+            resp = client.post(
+                f"/api/tasks/{task_id}/regenerate", json=self.BODY,
+                headers={"Accept": "text/event-stream"},
+            )
+        assert resp.text.count("event: delta") == 2
+        assert 'event: done\ndata: {"new_bullet":"Сократил сроки"}' in resp.text
+
+    def test_newer_request_cancels_older(self):
+        import asyncio
+        from supersede import LatestOnly
+
+        closed = []
+
+        async def slow():
+            try:
+                yield "старый"
+                await asyncio.sleep(10)
+                yield "не дойдёт"
+            finally:
+                closed.append(True)
+
+        async def run():
+            runs = LatestOnly()
+            _, old = runs.start(("t", 1, 0), slow())
+            assert await old.get() == ("delta", "старый")
+            _, new = runs.start(("t", 1, 0), self._chunks("новый"))
+            assert await old.get() == ("superseded", None)
+            assert [await new.get(), await new.get()] == [("delta", "новый"), ("done", None)]
+            return runs.stats()
+
+        assert asyncio.run(run())["superseded"] == 1
+        assert closed == [True]
+
+    def test_ticket_held_until_stream_ends_and_json_stops_on_disconnect(self):
+        import asyncio
+        import main
+        from disconnect import ClientDisconnected
+        from main import RegenerateRequest, admission
+
+        closed, in_flight = [], []
+
+        async def slow(**kwargs):
+            try:
+                yield "Сократил "
+                in_flight.append(admission.stats()["in_flight"])
+                await asyncio.sleep(10)
+                yield "не дойдёт"
+            finally:
+                closed.append(True)
+
+        async def scenario():
+            with pytest.raises(ClientDisconnected):
+                await main.regenerate(task_id, RegenerateRequest(**self.BODY), connected_request(True))
+            await asyncio.sleep(0)
+
+        task_id = create_mock_task()
+        with patch("main.stream_regenerate_bullet", side_effect=slow), \
+                patch("disconnect.DISCONNECT_POLL_SECONDS", 0.01):
+            asyncio.run(scenario())
+        assert in_flight == [1]  # after the first token the ticket is still held
+        assert closed == [True] and admission.stats()["in_flight"] == 0
+
+    def test_cancelled_stream_is_charged(self):
+        import asyncio
+        from unittest.mock import MagicMock
+
+        import llm
+        from ledger import bind_task, ledger
+        from supersede import LatestOnly
+
+        class FakeStream:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            @property
+            async def text_stream(self):
+                yield "Сократил сроки"
+                await asyncio.sleep(10)
+
+        fake_client = MagicMock()
+        fake_client.messages.stream.return_value = FakeStream()
+
+        async def run():
+            bind_task("cancelled-stream")
+            chunks = llm.stream_text("system " * 100, "request", "regenerate_bullet")
+            task, queue = LatestOnly().start("k", chunks)
+            assert await queue.get() == ("delta", "Сократил сроки")
+            task.cancel()
+            assert await queue.get() == ("superseded", None)
+
+        with patch("llm.get_client", return_value=fake_client), \
+                patch("llm._step_timeout", return_value=8.0):  # builds an SDK object
+            asyncio.run(run())
+        usage = ledger.task_usage("cancelled-stream")
+        assert usage["calls"] == 1 and usage["output"] > 0 and usage["cost"] > 0
+
+    def test_cacheable_prefix(self):
+        import llm
+
+        with patch("llm.stream_text") as mock_stream:
+            llm.stream_regenerate_bullet("буллет", "фрагмент", "комментарий", "PM", "female", SAMPLE_RESUME)
+        prefix, request = mock_stream.call_args.args[1]
+        assert prefix["cache_control"] == {"type": "ephemeral"}
+        assert "PM" in prefix["text"] and "женский" in prefix["text"]
+        assert "комментарий" not in prefix["text"] and "комментарий" in request["text"]
+
+
+class TestIdempotency:
+    """Idempotency-Key: one execution per key, retries get its response."""
+
+    @patch("main.run_recheck", new_callable=AsyncMock)
+    def test_retry_replays_stored_response(self, mock_llm):
+        mock_llm.return_value = MOCK_RECHECK
+        task_id = create_mock_task()
+        responses = [
+            client.post(
+                f"/api/tasks/{task_id}/recheck",
+                json={"updatedResume": "text"},
+                headers={"Idempotency-Key": "recheck-1"},
+            )
+            for _ in range(2)
+        ]
+        assert [r.json() for r in responses] == [MOCK_RECHECK, MOCK_RECHECK]
+        assert responses[1].headers["idempotent-replayed"] == "true"
+        assert mock_llm.call_count == 1
+        assert len(storage.get_task(task_id)["rechecks"]) == 1
+
+    @patch("main.run_recheck", new_callable=AsyncMock)
+    def test_same_key_other_body_rejected(self, mock_llm):
+        mock_llm.return_value = MOCK_RECHECK
+        task_id = create_mock_task()
+        url, headers = f"/api/tasks/{task_id}/recheck", {"Idempotency-Key": "recheck-2"}
+        assert client.post(url, json={"updatedResume": "a"}, headers=headers).status_code == 200
+        assert client.post(url, json={"updatedResume": "b"}, headers=headers).status_code == 422
+
+    @patch("main.run_recheck", new_callable=AsyncMock)
+    def test_server_error_not_stored(self, mock_llm):
+        mock_llm.side_effect = [RuntimeError("boom"), MOCK_RECHECK]
+        task_id = create_mock_task()
+        url, headers = f"/api/tasks/{task_id}/recheck", {"Idempotency-Key": "recheck-3"}
+        assert client.post(url, json={"updatedResume": "a"}, headers=headers).status_code == 500
+        assert client.post(url, json={"updatedResume": "a"}, headers=headers).status_code == 200
+        assert mock_llm.call_count == 2
+
+    def test_concurrent_retry_attaches(self):
+        import asyncio
+        from idempotency import IdempotencyMiddleware, IdempotencyStore
+
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append((await receive())["body"])
+            await asyncio.sleep(0.01)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = IdempotencyMiddleware(app, IdempotencyStore())
+        scope = {
+            "type": "http", "method": "POST", "path": "/api/tasks/t1/rewrite",
+            "headers": [(b"idempotency-key", b"k1")], "client": ("1.2.3.4", 1),
+        }
+
+        async def post():
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"{}", "more_body": False}
+
+            async def send(message):
+                sent.append(message)
+
+            await middleware(scope, receive, send)
+            return sent
+
+        async def scenario():
+            return await asyncio.gather(post(), post())
+
+        first, retry = asyncio.run(scenario())
+        assert calls == [b"{}"]
+        assert first[1]["body"] == retry[1]["body"] == b"ok"
+        assert (b"idempotent-replayed", b"true") in retry[0]["headers"]
+        assert middleware.store.stats()["attached"] == 1
+
+
+class TestSessionTokens:
+    """Signed stateless session cookies; logout revokes via the Bloom filter."""
+
+    LOGIN = {"id": 42, "first_name": "Иван", "username": "ivan", "auth_date": 1, "hash": "x"}
+
+    def test_login_me_logout(self):
+        with patch("main.verify_telegram_auth", return_value=True):
+            token = TestClient(app).post("/api/auth/telegram", json=self.LOGIN).cookies["session"]
+        browser = TestClient(app, cookies={"session": token})
+        with patch.object(storage, "get_user", side_effect=AssertionError("storage lookup")):
+            me = browser.get("/api/auth/me").json()
+        assert me["user"]["tg_id"] == 42 and me["user"]["username"] == "ivan"
+
+        stolen = TestClient(app, cookies={"session": token})
+        browser.post("/api/auth/logout")
+        assert stolen.get("/api/auth/me").json() == {"user": None}
+
+    def test_tampered_or_expired_rejected(self):
+        from sessions import session_tokens
+
+        token = session_tokens.issue({"tg_id": 7})
+        version, payload, signature = token.split(".")
+        forged = session_tokens.issue({"tg_id": 8}).split(".")[1]
+        assert session_tokens.verify(token)["sub"] == 7
+        assert session_tokens.verify(f"{version}.{forged}.{signature}") is None
+        assert session_tokens.verify(session_tokens.issue({"tg_id": 7}, ttl=-1)) is None
+
+    def test_key_rotation(self):
+        import sessions
+
+        with patch.dict("os.environ", {"SESSION_KEYS": "1:old"}):
+            token = sessions.SessionTokens().issue({"tg_id": 7})
+        with patch.dict("os.environ", {"SESSION_KEYS": "2:new,1:old"}):
+            rotated = sessions.SessionTokens()
+        assert rotated.verify(token)["sub"] == 7
+        assert rotated.issue({"tg_id": 7}).startswith("v2.")
+
+    def test_bloom_filter(self):
+        from sessions import BloomFilter
+
+        bloom = BloomFilter(capacity=1000, fp_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        assert all(f"jti-{i}" in bloom for i in range(1000))
+        assert sum(f"other-{i}" in bloom for i in range(10000)) < 300
+
+
+class TestHistoryPagination:
+    """GET /api/history — per-user index, opaque cursor."""
+
+    def test_pages_newest_first(self):
+        from sessions import session_tokens
+
+        created = [storage.create_task(f"r{i}.txt", f"resume {i}", user_id=99) for i in range(5)]
+        storage.create_task("other.txt", "other", user_id=100)
+        browser = TestClient(app, cookies={"session": session_tokens.issue({"tg_id": 99})})
+
+        seen, cursor = [], None
+        for _ in range(3):
+            params = {"limit": 2, **({"after": cursor} if cursor else {})}
+            data = browser.get("/api/history", params=params).json()
+            seen += [t["taskId"] for t in data["tasks"]]
+            cursor = data["nextCursor"]
+        assert seen == created[::-1]
+        assert cursor is None
+
+    def test_invalid_cursor(self):
+        from sessions import session_tokens
+
+        browser = TestClient(app, cookies={"session": session_tokens.issue({"tg_id": 99})})
+        assert browser.get("/api/history", params={"after": "!!"}).status_code == 400
+
+
+class TestRecheckHistory:
+    """Bounded recheck history: snapshots, deltas, score timeline."""
+
+    def test_entries_rebuilt_from_deltas(self):
+        from recheck_history import RecheckHistory
+
+        history = RecheckHistory(capacity=5, keyframe_interval=3)
+        results = [
+            {**MOCK_RECHECK, "updated_score": 60 + i, **({"verdict": f"v{i}"} if i % 2 else {})}
+            for i in range(12)
+        ]
+        for result in results:
+            history.append(result)
+        assert len(history) == 5
+        assert list(history) == results[-5:]
+        assert history[-1] == history.latest() == results[-1]
+        assert history.stats()["keyframes"] < 5
+        assert [p["n"] for p in history.timeline()] == [8, 9, 10, 11, 12]
+
+    @patch("main.run_recheck", new_callable=AsyncMock)
+    def test_recheck_updates_task_and_timeline(self, mock_llm):
+        task_id = create_mock_task()
+        version = storage.get_task(task_id)["version"]
+        for score in (70, 75):
+            mock_llm.return_value = {**MOCK_RECHECK, "updated_score": score}
+            assert client.post(f"/api/tasks/{task_id}/recheck", json={"updatedResume": "x"}).status_code == 200
+        assert mock_llm.call_args.args[2] == 70  # previous score from the latest entry
+        assert storage.get_task(task_id)["version"] == version + 2
+
+        data = client.get(f"/api/tasks/{task_id}/rechecks").json()
+        assert [p["updated_score"] for p in data["timeline"]] == [70, 75]
+        assert data["latest"]["updated_score"] == 75
+
+
+class TestRewriteVersions:
+    """Rewrite versions: bullet-level diffs, snapshots, rollback."""
+
+    def test_versions_rebuilt_from_diffs(self):
+        import copy
+        from rewrite_versions import RewriteVersions
+
+        versions = RewriteVersions(snapshot_interval=3)
+        expected = [copy.deepcopy(MOCK_REWRITE)]
+        versions.append(MOCK_REWRITE, "rewrite")
+        for i in range(7):
+            rewrite = copy.deepcopy(expected[-1])
+            rewrite["experiences"][0]["rewritten_bullets"].append(f"bullet {i}")
+            if i % 3 == 0:
+                rewrite["skills"]["tools"] = ["Jira", f"tool {i}"]
+            if i == 4:
+                rewrite["experiences"].append({**MOCK_REWRITE["experiences"][0], "company": "New"})
+            versions.append(rewrite, "edit")
+            expected.append(rewrite)
+        assert [versions.get(n) for n in range(1, 9)] == expected
+        assert versions.latest() == expected[-1]
+        assert versions.stats() == {"versions": 8, "snapshots": 3}
+
+    def test_bounded_keeps_original(self):
+        import copy
+        from rewrite_versions import RewriteVersions
+
+        versions = RewriteVersions(snapshot_interval=3, max_versions=4)
+        expected = {}
+        for n in range(1, 11):
+            rewrite = copy.deepcopy(MOCK_REWRITE)
+            rewrite["experiences"][0]["rewritten_bullets"] = [f"bullet {i}" for i in range(n)]
+            assert versions.append(rewrite, "edit") == n
+            expected[n] = rewrite
+        assert [v["n"] for v in versions.history()] == [1, 8, 9, 10]
+        assert all(versions.get(n) == expected[n] for n in (1, 8, 9, 10))
+        assert versions.latest() == expected[10]
+        with pytest.raises(KeyError):
+            versions.get(7)
+
+    @patch("main.run_rewrite", new_callable=AsyncMock)
+    def test_edit_and_restore(self, mock_llm):
+        mock_llm.return_value = MOCK_REWRITE
+        task_id = create_mock_task()
+        assert client.get(f"/api/tasks/{task_id}/versions").status_code == 400
+        client.post(f"/api/tasks/{task_id}/rewrite", json={"selectedRole": "PM"})
+
+        resp = client.post(
+            f"/api/tasks/{task_id}/versions",
+            json={"summary": "Новый summary", "bullets": [["Свой буллет"]], "score": 61},
+        )
+        assert resp.json()["version"] == 2
+        assert storage.get_task(task_id)["rewrite"]["experiences"][0]["rewritten_bullets"] == ["Свой буллет"]
+        bad = client.post(f"/api/tasks/{task_id}/versions", json={"bullets": []})
+        assert bad.status_code == 400
+
+        resp = client.post(f"/api/tasks/{task_id}/versions/1/restore")
+        assert resp.json()["version"] == 3
+        assert storage.get_task(task_id)["rewrite"] == MOCK_REWRITE
+        history = client.get(f"/api/tasks/{task_id}/versions").json()["versions"]
+        assert [(v["source"], v["score"]) for v in history] == [("rewrite", None), ("edit", 61), ("restore", None)]
+        assert client.get(f"/api/tasks/{task_id}/versions/2").json()["summary"] == "Новый summary"
+        assert client.get(f"/api/tasks/{task_id}/versions/9").status_code == 404
+
+
 class TestResponseSchemas:
     """Verify response shapes match frontend TypeScript types."""
 
@@ -470,8 +1129,7 @@ class TestEdgeCases:
     def test_multiple_rechecks(self):
         """Multiple rechecks should append to list."""
         task_id = create_mock_task()
-        task = storage.get_task(task_id)
-        task["rechecks"] = [MOCK_RECHECK]
+        storage.get_task(task_id)["rechecks"].append(MOCK_RECHECK)
         with patch("main.run_recheck", new_callable=AsyncMock) as mock_llm:
             mock_llm.return_value = {**MOCK_RECHECK, "updated_score": 75}
             resp = client.post(
@@ -482,6 +1140,604 @@ class TestEdgeCases:
             assert len(storage.get_task(task_id)["rechecks"]) == 2
 
 
+class TestTaskEvents:
+    """Progressive delivery of annotate / rewrite fan-out results."""
+
+    def test_annotate_publishes_each_section(self):
+        from events import task_events
+
+        sections = [
+            {**MOCK_DIAGNOSIS["sections"][0], "block_id": 2},
+            {**MOCK_DIAGNOSIS["sections"][0], "block_id": 1},
+        ]
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        storage.update_task(task_id, parse_result={**MOCK_DIAGNOSIS, "sections": sections})
+
+        async def fake_annotate(section, resume_text):
+            return {**section, "annotations": []}
+
+        with patch("llm._annotate_section", side_effect=fake_annotate):
+            resp = client.post(f"/api/tasks/{task_id}/annotate")
+        assert resp.status_code == 200
+
+        events = task_events.history(task_id)
+        assert [e["event"] for e in events] == ["section", "section"]
+        positions = {e["data"]["block_id"]: e["data"]["position"] for e in events}
+        assert positions == {1: 0, 2: 1}
+        assert all(e["data"]["total"] == 2 for e in events)
+
+    def test_subscribe_replays_after_id(self):
+        import asyncio
+        from events import TaskEvents, format_sse
+
+        bus = TaskEvents()
+        bus.publish("t", "block", {"block_id": 1})
+        bus.publish("t", "rewrite_meta", {"role": "PM"})
+
+        async def first_after(after):
+            async for entry in bus.subscribe("t", after):
+                return entry
+
+        entry = asyncio.run(first_after(1))
+        assert entry["event"] == "rewrite_meta"
+        assert format_sse(entry).startswith("id: 2\nevent: rewrite_meta\n")
+
+    def test_events_nonexistent_task(self):
+        resp = client.get("/api/tasks/nonexistent/events")
+        assert resp.status_code == 404
+
+
+class TestMetricsEndpoint:
+    """GET /api/metrics"""
+
+    def test_reports_pool_stats(self):
+        pool = get_metrics()["pool"]
+        assert pool["size"] >= 1
+        assert {"wait_avg", "wait_max", "in_flight"} <= set(pool)
+
+    def test_requires_token(self):
+        assert client.get("/api/metrics").status_code == 404  # METRICS_TOKEN unset
+        with patch("auth.METRICS_TOKEN", "test-metrics-token"):
+            assert client.get("/api/metrics").status_code == 401
+            resp = client.get("/api/metrics", headers={"Authorization": "Bearer wrong"})
+            assert resp.status_code == 401
+
+
+class TestAdmission:
+    """429 + Retry-After instead of queueing past the SLO."""
+
+    @patch("main.run_scoring", new_callable=AsyncMock)
+    def test_rejects_when_queue_exceeds_slo(self, mock_llm):
+        from llm import rpm_limiter
+
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        with patch.object(rpm_limiter, "queued", 200):  # ~4 min at 50 RPM
+            resp = client.post(f"/api/tasks/{task_id}/score")
+        assert resp.status_code == 429
+        assert int(resp.headers["retry-after"]) >= 1
+        assert resp.json()["queuePosition"] == 1
+        mock_llm.assert_not_called()
+
+    @patch("main.run_parse", new_callable=AsyncMock)
+    def test_retry_after_429_reuses_task(self, mock_llm):
+        from llm import rpm_limiter
+
+        mock_llm.return_value = MOCK_DIAGNOSIS
+        upload = {"file": ("retry.txt", (SAMPLE_RESUME + " retry-429").encode(), "text/plain")}
+        tasks_before = len(storage._tasks)
+        with patch.object(rpm_limiter, "queued", 200):
+            assert client.post("/api/analyze", files=upload).status_code == 429
+        resp = client.post("/api/analyze", files=upload)
+        assert resp.status_code == 200
+        assert len(storage._tasks) == tasks_before + 1
+        assert storage.get_task(resp.json()["taskId"])["parse_result"] is not None
+
+    @patch("main.run_scoring", new_callable=AsyncMock)
+    def test_admits_and_releases_ticket(self, mock_llm):
+        from main import admission
+
+        mock_llm.return_value = MOCK_SCORE
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        resp = client.post(f"/api/tasks/{task_id}/score")
+        assert resp.status_code == 200
+        stats = get_metrics()["admission"]
+        assert stats["in_flight"] == 0
+        assert stats["outstanding_calls"] == admission.outstanding == 0
+
+
+class TestUsageLedger:
+    """Per-task / per-user usage and budget enforcement."""
+
+    def test_usage_charged_to_task(self):
+        from ledger import bind_task, ledger
+
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        bind_task(task_id)
+        ledger.record(1000, 200, 500, 0, 0.0021)
+        ledger.flush()
+        bind_task(None)
+
+        resp = client.get(f"/api/tasks/{task_id}/usage")
+        assert resp.status_code == 200
+        usage = resp.json()["usage"]
+        assert usage["calls"] == 1 and usage["input"] == 1000 and usage["cache_read"] == 500
+        assert storage.get_usage(f"task:{task_id}")["output"] == 200
+
+    @patch("main.run_recheck", new_callable=AsyncMock)
+    def test_task_over_budget_rejected(self, mock_llm):
+        from ledger import TASK_BUDGET_USD, ledger
+
+        task_id = create_mock_task()
+        ledger._get(ledger.task_key(task_id))["cost"] = TASK_BUDGET_USD
+        resp = client.post(
+            f"/api/tasks/{task_id}/recheck", json={"updatedResume": "better text"}
+        )
+        assert resp.status_code == 429
+        assert resp.json()["scope"] == "task"
+        mock_llm.assert_not_called()
+
+    def test_daily_budgets_user_and_anonymous(self):
+        import contextvars
+
+        from ledger import ANON_DAILY_BUDGET_USD, USER_DAILY_BUDGET_USD, BudgetExceeded, ledger
+        from tenants import Tenant, set_tenant
+
+        def check_as(tenant):
+            set_tenant(tenant)
+            ledger.check()
+
+        user, anon = Tenant("user:501", "user"), Tenant("ip:10.0.0.1", "anonymous")
+        for tenant in (user, anon):
+            ledger._get(ledger.user_key(tenant.key))["cost"] = USER_DAILY_BUDGET_USD
+        with pytest.raises(BudgetExceeded):
+            contextvars.copy_context().run(check_as, user)
+        # One IP can be a whole NAT: a larger limit, but still a limit
+        contextvars.copy_context().run(check_as, anon)
+        ledger._get(ledger.user_key(anon.key))["cost"] = ANON_DAILY_BUDGET_USD
+        with pytest.raises(BudgetExceeded):
+            contextvars.copy_context().run(check_as, anon)
+
+    def test_usage_nonexistent_task(self):
+        resp = client.get("/api/tasks/nonexistent/usage")
+        assert resp.status_code == 404
+
+
+class TestModelRouter:
+    """Per-step model choice and per-model cost accounting."""
+
+    def test_falls_back_when_preferred_model_fails(self):
+        from routing import HAIKU, SONNET, ModelRouter
+
+        router = ModelRouter()
+        assert router.choose("rewrite_block", 8000) == HAIKU
+        for _ in range(3):
+            router.record(HAIKU, "rewrite_block", 8000, 1.0, ok=False)
+        assert router.choose("rewrite_block", 8000) == SONNET
+        assert router.choose("scoring", 8000) == HAIKU  # single-tier step
+
+    def test_failed_model_recovers(self):
+        import time
+
+        from routing import ERROR_HALF_LIFE, HAIKU, SONNET, ModelRouter
+
+        router = ModelRouter()
+        for _ in range(2):
+            router.record(HAIKU, "rewrite_block", 8000, 1.0, ok=False)
+        assert router.choose("rewrite_block", 8000) == SONNET
+        later = time.monotonic() + ERROR_HALF_LIFE
+        with patch("routing.time.monotonic", return_value=later):
+            assert router.choose("rewrite_block", 8000) == HAIKU  # probed again
+            router.record(HAIKU, "rewrite_block", 8000, 1.0, ok=True)
+            assert router.choose("rewrite_block", 8000) == HAIKU
+
+    def test_long_input_stays_on_faster_model(self):
+        from routing import HAIKU, SONNET, ModelRouter
+
+        router = ModelRouter()
+        assert router.choose("recheck", 20000) == HAIKU
+        for _ in range(3):
+            router.record(HAIKU, "recheck", 5000, 15.0, ok=True)
+        assert router.choose("recheck", 20000) == HAIKU  # ~60 s; Sonnet unknown
+        for _ in range(3):
+            router.record(SONNET, "recheck", 5000, 35.0, ok=True)
+        assert router.choose("recheck", 20000) == HAIKU  # ~60 s vs ~140 s
+
+    def test_slow_preferred_model_yields_to_faster_one(self):
+        from routing import HAIKU, SONNET, ModelRouter
+
+        router = ModelRouter()
+        for _ in range(3):
+            router.record(HAIKU, "recheck", 5000, 60.0, ok=True)  # degraded
+            router.record(SONNET, "recheck", 5000, 30.0, ok=True)
+        assert router.choose("recheck", 5000) == SONNET
+
+    def test_cost_uses_model_price(self):
+        from types import SimpleNamespace
+
+        from llm import _calc_cost
+        from routing import HAIKU, SONNET
+
+        usage = SimpleNamespace(input_tokens=1_000_000, output_tokens=0)
+        assert _calc_cost(usage, HAIKU) == pytest.approx(0.80)
+        assert _calc_cost(usage, SONNET) == pytest.approx(3.00)
+        assert _calc_cost(usage, "unknown-model") == pytest.approx(3.00)
+
+
+class TestSectionAnchors:
+    """Parse returns block anchors; full_text is sliced from raw_text."""
+
+    def test_sections_sliced_verbatim(self):
+        from anchors import locate_sections
+
+        sections = locate_sections(SAMPLE_RESUME, [
+            {"block_id": 1, "section_title": "TechnoSoft", "period": "2022–2024",
+             "start_anchor": "TechnoSoft - менеджер проектов (2022-2024)",
+             "end_anchor": "Координировал команду из 8 человек"},
+            {"block_id": 2, "section_title": "Прогресс", "period": "2020–2022",
+             "start_anchor": "Банк «Прогресс» — Бизнес-аналитик",
+             "end_anchor": "Составлял ТЗ для разработки"},
+        ])
+        assert sections[0]["full_text"] == SAMPLE_RESUME[
+            SAMPLE_RESUME.index("TechnoSoft"):SAMPLE_RESUME.index("8 человек") + len("8 человек")
+        ]
+        assert sections[1]["full_text"].startswith('Банк "Прогресс"')
+        assert sections[1]["full_text"].endswith("Составлял ТЗ для разработки")
+        assert set(sections[0]) == {"block_id", "section_title", "period", "full_text"}
+
+    def test_inexact_anchors_fall_back(self):
+        from anchors import locate_sections
+
+        sections = locate_sections(SAMPLE_RESUME, [
+            {"block_id": 1, "start_anchor": "TechnoSoft — Менеджер проектов, Москва",
+             "end_anchor": "что-то, чего нет в резюме"},
+            {"block_id": 2, "start_anchor": "Банк Прогресс Бизнес-аналитик",
+             "end_anchor": "ТЗ для разработки ПО"},
+        ])
+        assert sections[0]["full_text"].startswith("TechnoSoft")
+        assert sections[0]["full_text"].endswith("8 человек")  # runs up to block 2
+        assert sections[1]["full_text"].endswith("ТЗ для разработки")
+
+    def test_run_parse_fills_full_text(self):
+        import asyncio
+        import llm
+
+        parsed = {**MOCK_DIAGNOSIS, "sections": [{
+            "block_id": 1, "section_title": "TechnoSoft", "period": "2022–2024",
+            "start_anchor": "TechnoSoft — Менеджер проектов",
+            "end_anchor": "Составлял ТЗ для разработки",
+        }]}
+        with patch("llm.call_claude", new=AsyncMock(return_value=parsed)), \
+                patch("llm.SEGMENTER_MIN_CONFIDENCE", 1.1):  # force the full parse
+            result = asyncio.run(llm.run_parse(SAMPLE_RESUME))
+        assert "Анализировал бизнес-процессы" in result["sections"][0]["full_text"]
+        assert "start_anchor" not in result["sections"][0]
+
+
+class TestSegmenter:
+    """Local segmenter: confident resumes skip block extraction in the LLM."""
+
+    def test_blocks_and_periods(self):
+        from segmenter import segment
+
+        seg = segment(SAMPLE_RESUME)
+        assert seg.confidence == 1.0
+        assert [(s["section_title"], s["period"]) for s in seg.sections] == [
+            ("TechnoSoft — Менеджер проектов", "2022–2024"),
+            ('Банк "Прогресс" — Бизнес-аналитик', "2020–2022"),
+        ]
+        assert seg.sections[1]["full_text"].endswith("Составлял ТЗ для разработки")
+
+    def test_hh_layout(self):
+        from segmenter import segment
+
+        seg = segment(
+            "Опыт работы — 5 лет\n\n"
+            "Март 2021 — по настоящее время\n3 года 8 месяцев\nООО «Ромашка»\nМосква\n"
+            "Менеджер по закупкам\n- Вела категорию молочной продукции\n\n"
+            "Июнь 2019 — Февраль 2021\nИП Соколов\nСнабженец\n- Поиск поставщиков\n\n"
+            "Образование\nРЭУ, 2019\n"
+        )
+        assert [s["section_title"] for s in seg.sections] == [
+            "ООО «Ромашка» — Менеджер по закупкам", "ИП Соколов — Снабженец",
+        ]
+        assert "Образование" not in seg.sections[-1]["full_text"]
+
+    def test_no_dates_not_confident(self):
+        from segmenter import SEGMENTER_MIN_CONFIDENCE, segment
+
+        seg = segment("Иван\n\nРаботал в TechnoSoft менеджером, потом в банке аналитиком.")
+        assert seg.sections == [] and seg.confidence < SEGMENTER_MIN_CONFIDENCE
+
+    def test_run_parse_classifies_only(self):
+        import asyncio
+        import llm
+
+        mock = AsyncMock(return_value={k: v for k, v in MOCK_DIAGNOSIS.items() if k != "sections"})
+        with patch("llm.call_claude", new=mock):
+            result = asyncio.run(llm.run_parse(SAMPLE_RESUME))
+        assert mock.call_args.args[3] == "parse_classify"
+        assert "1. TechnoSoft — Менеджер проектов (2022–2024)" in mock.call_args.args[1]
+        assert [s["block_id"] for s in result["sections"]] == [1, 2]
+
+
+class TestSkillIndex:
+    """Local skill dictionary: canonical names, cross-check, hot reload."""
+
+    def test_extract_canonical(self):
+        from skills import skill_index
+
+        names = [s.name for s in skill_index.extract(
+            "Postgres, Яндекс.Директ, JS; писал на PostgreSQL и javascript, не на Java"
+        )]
+        assert names == ["PostgreSQL", "Яндекс Директ", "JavaScript", "Java"]
+
+    def test_short_alias_not_in_english_compound(self):
+        from skills import skill_index
+
+        assert [s.name for s in skill_index.extract("Go-to-market стратегия")] == []
+        assert [s.name for s in skill_index.extract("Go-разработчик")] == ["Go"]
+
+    def test_cross_check(self):
+        from skills import skill_index
+
+        checked = skill_index.cross_check(
+            {"hard_skills": ["jira", "Kubernetes", "Внутренняя CRM"], "soft_skills": []},
+            SAMPLE_RESUME,
+        )
+        # Kubernetes is never mentioned; Confluence and SQL were missed
+        assert checked["hard_skills"] == ["Jira", "Внутренняя CRM", "Confluence", "SQL"]
+
+    def test_hot_reload(self, tmp_path):
+        import json
+        import os
+        import skills
+
+        path = tmp_path / "skills.json"
+        path.write_text(json.dumps({"hard_skills": {"Jira": []}}), encoding="utf-8")
+        index = skills.SkillIndex(str(path))
+        assert [s.name for s in index.extract("Jira, Miro")] == ["Jira"]
+
+        path.write_text(json.dumps({"hard_skills": {"Jira": [], "Miro": []}}), encoding="utf-8")
+        os.utime(path, (1, 1))
+        with patch("skills.SKILLS_RELOAD_SECONDS", 0):
+            assert [s.name for s in index.extract("Jira, Miro")] == ["Jira", "Miro"]
+            path.write_text("{broken", encoding="utf-8")
+            os.utime(path, (2, 2))
+            assert [s.name for s in index.extract("Jira, Miro")] == ["Jira", "Miro"]
+        assert index.reloads == 2
+
+
+class TestFusedParseScoring:
+    """FUSED_PARSE_SCORING=1: one call stores both parse and scoring."""
+
+    def test_split_into_parse_and_scoring(self):
+        import asyncio
+        import llm
+
+        dims = [{"name": f"d{i}", "score": 8, "comment": ""} for i in range(10)]
+        sections = [{"block_id": 1, "section_title": "TechnoSoft", "period": "2022–2024",
+                     "start_anchor": "TechnoSoft", "end_anchor": "8 человек"}]
+        fused = {**MOCK_DIAGNOSIS, "sections": sections, "dimensions": dims, "verdict": "Хорошо"}
+        with patch("llm.call_claude", new=AsyncMock(return_value=fused)):
+            parse_result, scoring = asyncio.run(llm.run_parse_scoring(SAMPLE_RESUME))
+        assert "dimensions" not in parse_result
+        assert parse_result["sections"][0]["full_text"].endswith("8 человек")
+        assert scoring["total_score"] == 80
+        assert scoring["grade"] == "Хорошее резюме"
+
+    @patch("main.run_parse_scoring", new_callable=AsyncMock)
+    def test_score_served_from_fused_parse(self, mock_llm):
+        mock_llm.return_value = (MOCK_DIAGNOSIS, MOCK_SCORE)
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        with patch("main.FUSED_PARSE_SCORING", True), \
+             patch("main.run_scoring", new_callable=AsyncMock) as mock_scoring:
+            assert client.post(f"/api/tasks/{task_id}/parse").status_code == 200
+            resp = client.post(f"/api/tasks/{task_id}/score")
+        assert resp.json()["total_score"] == MOCK_SCORE["total_score"]
+        mock_scoring.assert_not_called()
+
+
+class TestRoleMarketCache:
+    """Search-derived role facts shared between roles calls."""
+
+    def test_second_resume_reuses_cached_roles(self):
+        import asyncio
+        import llm
+        from market_cache import RoleMarketCache
+
+        analysis = {**MOCK_DIAGNOSIS, "sections": MOCK_DIAGNOSIS["sections"]}
+        # Three shared skills with each cached role: relevant enough to inject
+        skills = {"hard_skills": ["Jira", "Confluence", "MS Project", "SQL", "Figma", "Amplitude"]}
+        with patch("llm.role_market", RoleMarketCache()) as cache, \
+             patch("llm.call_claude", new_callable=AsyncMock) as mock_call:
+            mock_call.return_value = MOCK_ROLES
+            asyncio.run(llm.run_roles(SAMPLE_RESUME, analysis, key_skills=skills))
+            assert mock_call.call_args.kwargs["web_search"] == llm.ROLES_WEB_SEARCHES
+
+            asyncio.run(llm.run_roles(SAMPLE_RESUME, analysis, key_skills=skills))
+            prompt = mock_call.call_args.args[1][1]["text"]
+            assert "Справка по рынку" in prompt and "Project Manager" in prompt
+            assert mock_call.call_args.kwargs["web_search"] == 1
+            assert cache.stats()["hit_rate"] == 0.5  # 2 misses, then 2 hits
+
+    def test_generic_title_word_is_not_a_match(self):
+        from market_cache import RoleMarketCache
+
+        cache = RoleMarketCache()
+        cache.store([{"role": "Менеджер по продажам", "required_skills": ["CRM"]}], "ru")
+        assert cache.lookup(["Менеджер проектов"], ["Jira"], "ru") == []
+        assert cache.lookup(["Менеджер по продажам B2B"], ["CRM"], "ru")  # "продажам" + CRM
+
+    def test_role_names_normalized(self):
+        from market_cache import normalize_role
+
+        assert normalize_role("Ведущий категорийный менеджер") == "категорийный менеджер"
+        assert normalize_role("Senior Product-Manager") == "product manager"
+
+    def test_candidate_skills_are_not_cached(self):
+        from market_cache import RoleMarketCache
+
+        cache = RoleMarketCache()
+        cache.store([{
+            "role": "Product Manager",
+            "matched_skills": ["1С: Предприятие"],
+            "missing_skills": ["Tableau"],
+            "required_skills": ["SQL", "Amplitude"],
+        }], "ru")
+        [entry] = cache.lookup(["Product Manager"], ["SQL"], "ru")
+        assert entry["required_skills"] == ["SQL", "Amplitude"]
+        assert "1С" not in str(entry) and "Tableau" not in str(entry)
+
+
+class TestFairQueueing:
+    """Per-tenant weighted fair queueing in the RPM limiter."""
+
+    def test_light_tenant_not_stuck_behind_heavy(self):
+        import asyncio
+        from llm import TokenBucket
+        from tenants import Tenant, set_tenant
+
+        async def scenario():
+            limiter = TokenBucket(rate_per_minute=6000)  # 100/s
+            limiter.tokens = 0
+            order = []
+
+            async def call(tenant):
+                set_tenant(tenant)
+                await limiter.acquire()
+                order.append(tenant.key)
+
+            heavy = [call(Tenant("user:1", "user")) for _ in range(8)]
+            tasks = [asyncio.create_task(c) for c in heavy]
+            await asyncio.sleep(0)
+            tasks += [asyncio.create_task(call(Tenant("ip:1.2.3.4", "anonymous"))) for _ in range(2)]
+            await asyncio.sleep(0)
+            depth = limiter.stats()["tenants"]
+            await asyncio.gather(*tasks)
+            return order, depth
+
+        order, depth = asyncio.run(scenario())
+        assert sorted(depth.values()) == [2, 8]  # per tenant, under pseudonyms
+        assert "1.2.3.4" not in str(depth) and "user:1" not in str(depth)
+        assert order.index("ip:1.2.3.4") <= 2
+        assert order[:7].count("ip:1.2.3.4") == 2
+
+    def test_speculative_waits_for_everyone_else(self):
+        import asyncio
+        from llm import TokenBucket
+        from tenants import Tenant, set_tenant
+
+        async def scenario():
+            limiter = TokenBucket(rate_per_minute=6000)
+            limiter.tokens = 0
+            order = []
+
+            async def call(tenant):
+                set_tenant(tenant)
+                await limiter.acquire()
+                order.append(tenant.tier)
+
+            tasks = [asyncio.create_task(call(Tenant("user:1", "speculative"))) for _ in range(3)]
+            await asyncio.sleep(0)
+            tasks += [asyncio.create_task(call(Tenant("ip:1.2.3.4", "anonymous"))) for _ in range(3)]
+            await asyncio.gather(*tasks)
+            return order
+
+        assert asyncio.run(scenario()) == ["anonymous"] * 3 + ["speculative"] * 3
+
+    @patch("main.run_scoring", new_callable=AsyncMock)
+    def test_request_bound_to_client_tenant(self, mock_llm):
+        from tenants import current_tenant
+
+        seen = []
+        mock_llm.side_effect = lambda *a: seen.append(current_tenant()) or MOCK_SCORE
+        task_id = storage.create_task("test.txt", SAMPLE_RESUME)
+        resp = client.post(f"/api/tasks/{task_id}/score")
+        assert resp.status_code == 200
+        assert seen[0].key.startswith("ip:") and seen[0].tier == "anonymous"
+        limiter = get_metrics()["limiter"]
+        assert "tenants" in limiter and "ip:" not in str(limiter)
+
+
+class TestStartup:
+    """Cold start: heavy dependencies and side effects stay out of import."""
+
+    def test_import_main_is_lazy(self):
+        import subprocess
+        import sys
+
+        code = (
+            "import logging, sys, main; "
+            "assert 'anthropic' not in sys.modules; "
+            "assert not logging.getLogger('llm').handlers"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_prompt_fingerprints_cover_steps(self):
+        from schemas import prompt_fingerprints
+
+        prints = prompt_fingerprints()
+        assert {"parse", "scoring", "rewrite_block"} <= set(prints)
+        assert all(len(h) == 12 for h in prints.values())
+
+
+class TestOutputValidation:
+    """Compiled schema validators and local repair in call_claude."""
+
+    def test_all_schemas_compiled(self):
+        import prompts
+        from schemas import compile_all
+
+        names = {n for n in dir(prompts) if n.endswith("_SCHEMA")}
+        assert names <= set(compile_all())
+
+    def test_repairs_block_locally(self):
+        from prompts import REWRITE_BLOCK_SCHEMA
+        from schemas import get_validator
+
+        raw = {
+            "block_id": "2",
+            "company": "TechnoSoft",
+            "role": "PM",
+            "period": "2022–2024",
+            "original_bullets": ["Управлял проектами"],
+            "rewritten_bullets": "• Запустил 5 проектов\n• Вырос до тимлида",
+            "highlights": [{"action": "Rephrase"}],
+            "responsibilities": [],
+        }
+        result, missing = get_validator(REWRITE_BLOCK_SCHEMA).validate(raw)
+        assert missing == []
+        assert result["block_id"] == 2
+        assert result["rewritten_bullets"] == ["Запустил 5 проектов", "Вырос до тимлида"]
+        assert result["highlights"] == [{"action": "rephrase", "comment": ""}]
+
+    def test_reports_missing_top_level(self):
+        from prompts import REWRITE_META_SCHEMA
+        from schemas import get_validator
+
+        result, missing = get_validator(REWRITE_META_SCHEMA).validate(
+            {"summary": "PM", "skills": {"tools": "Jira"}, "recommendations": []}
+        )
+        assert missing == ["original_summary"]
+        assert result["skills"] == {"key_competencies": [], "tools": ["Jira"], "ats_keywords": []}
+
+    def test_reask_only_missing_fields(self):
+        import asyncio
+        import llm
+        from prompts import REWRITE_META_SCHEMA
+
+        first = {"summary": "PM", "skills": MOCK_REWRITE["skills"], "recommendations": []}
+        with patch("llm._request_tool_output", new_callable=AsyncMock) as mock_req:
+            mock_req.side_effect = [first, {"original_summary": "Менеджер"}]
+            result = asyncio.run(
+                llm.call_claude("sys", "resume", REWRITE_META_SCHEMA, "rewrite_meta")
+            )
+        assert result["original_summary"] == "Менеджер"
+        assert result["summary"] == "PM"
+        reask_schema = mock_req.call_args_list[1].args[2]
+        assert reask_schema["required"] == ["original_summary"]
+
+
 # ---------------------------------------------------------------------------
 # Integration tests (real Claude API calls)
 # ---------------------------------------------------------------------------
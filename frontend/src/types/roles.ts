@@ -9,6 +9,7 @@ export interface Role {
   typical_duties: string;
   matched_skills: string[];
   missing_skills: string[];
+  required_skills?: string[];
   reports_to: string;
   works_with: string;
 }